@@ -0,0 +1,88 @@
+"""Compare the sorted-postings merge join with the old nested loop.
+
+Runs ``find_matches`` from ``scripts/search.py`` and the nested loop it
+replaced on high-frequency character pairs, checks that both return the same
+pairs and prints the timings::
+
+    python -m benchmarks.bench_find_matches --index-dir ./index --pair 不人 --pair 风月
+
+The nested loop is quadratic, so ``--max-postings`` caps the postings used
+for it (and for the comparison); pass ``0`` to run it on the full lists.
+"""
+
+from __future__ import annotations
+
+import time
+
+import click
+
+from lib.indexer import load_index
+from lib.matcher import in_distance, occurs_before
+from scripts.search import find_matches
+
+
+def nested_loop(idx, c2, c3, src, dist, rev):
+    """The original O(n*m) implementation of ``find_matches``."""
+    occs2 = [o for o in idx.get(c2, []) if not src or o['type'] in src]
+    occs3 = [o for o in idx.get(c3, []) if not src or o['type'] in src]
+    results = []
+    for o2 in occs2:
+        for o3 in occs3:
+            if not in_distance(o2, o3, dist):
+                continue
+            if not rev and not occurs_before(o2, o3):
+                continue
+            pairs = [(o2, o3)] if not rev else [(o2, o3), (o3, o2)]
+            results.extend(pairs)
+    return results
+
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+
+def _as_keys(matches):
+    return sorted(
+        tuple((o['work_id'], o['paragraph'], o['line'], o['pos']) for o in pair)
+        for pair in matches
+    )
+
+
+@click.command()
+@click.option('--index-dir', default='./index', show_default=True,
+              help='directory containing the built index')
+@click.option('--pair', 'pairs', multiple=True, default=['不人', '人不', '风月', '之不'],
+              show_default=True, help='two characters to match, repeatable')
+@click.option('--source', multiple=True, help='restrict to these source types')
+@click.option('--reversible/--no-reversible', default=False, show_default=True)
+@click.option('--max-postings', default=5000, show_default=True,
+              help='truncate postings lists for the nested-loop comparison (0: no limit)')
+def main(index_dir: str, pairs: tuple[str, ...], source: tuple[str, ...], reversible: bool,
+         max_postings: int) -> None:
+    """Time merge join against the nested loop for each pair and distance."""
+
+    index = load_index(index_dir, mmap=True)
+    if max_postings:
+        limited = {ch: list(index.get(ch, []))[:max_postings] for pair in pairs for ch in pair}
+    else:
+        limited = {ch: list(index.get(ch, [])) for pair in pairs for ch in pair}
+
+    click.echo(f"{'pair':<6}{'distance':<11}{'postings':>16}{'matches':>10}"
+               f"{'merge(full)':>13}{'merge':>10}{'nested':>10}{'speedup':>9}")
+    for c2, c3 in pairs:
+        for dist in ('adjacent', 'sentence', 'paragraph', 'work'):
+            full, full_time = _timed(find_matches, index, c2, c3, source, dist, reversible)
+            merged, merge_time = _timed(find_matches, limited, c2, c3, source, dist, reversible)
+            nested, nested_time = _timed(nested_loop, limited, c2, c3, source, dist, reversible)
+            if _as_keys(merged) != _as_keys(nested):
+                raise click.ClickException(f'results differ for {c2}{c3} at {dist}')
+            sizes = f'{len(limited[c2])}x{len(limited[c3])}'
+            speedup = nested_time / merge_time if merge_time else float('inf')
+            click.echo(f'{c2}{c3:<5}{dist:<11}{sizes:>16}{len(full):>10}'
+                       f'{full_time:>12.3f}s{merge_time:>9.3f}s{nested_time:>9.3f}s{speedup:>8.0f}x')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+"""Compare the list-based loader methods with the lazy and prefetching iterators.
+
+Reads a dataset of ``loader/datas.json`` with ``body_extractor``, then with
+``iter_body`` sequentially, with a thread pool, with a process pool and,
+with ``--cache``, from a binary cache in a temporary directory (built by
+the first, "cold", run), checks that every run yields the same lines in the same order and
+prints the throughput::
+
+    python -m benchmarks.bench_loader --dataset tangsong --workers 4 --cache
+"""
+
+from __future__ import annotations
+
+import hashlib
+import resource
+import tempfile
+import time
+
+import click
+
+from loader.data_loader import DATAS_CONFIG, PlainDataLoader
+
+
+def _consume(lines) -> tuple[int, str]:
+    digest = hashlib.sha1()
+    count = 0
+    for line in lines:
+        digest.update(line.encode('utf-8'))
+        count += 1
+    return count, digest.hexdigest()
+
+
+@click.command()
+@click.option('--config', default=DATAS_CONFIG, show_default=True, help='datasets config')
+@click.option('--dataset', 'datasets', multiple=True, default=['tangsong'], show_default=True,
+              help='dataset to read, repeatable')
+@click.option('--workers', default=4, show_default=True, help='pool size for prefetching')
+@click.option('--repeat', default=3, show_default=True, help='best of this many runs')
+@click.option('--cache/--no-cache', default=False, show_default=True,
+              help='also time reading through a binary cache')
+def main(config: str, datasets: tuple[str, ...], workers: int, repeat: int, cache: bool) -> None:
+    with tempfile.TemporaryDirectory() as cache_dir:
+        _run(config, datasets, workers, repeat, cache_dir if cache else None)
+
+
+def _run(config: str, datasets: list, workers: int, repeat: int, cache_dir: str | None) -> None:
+    loader = PlainDataLoader(config)
+    cached = PlainDataLoader(config, cache_dir)
+    runs = {
+        'extract_from_multiple': lambda: loader.extract_from_multiple(datasets),
+        'iter_multiple': lambda: loader.iter_multiple(datasets),
+        f'iter_multiple threads={workers}': lambda: loader.iter_multiple(datasets, workers),
+        f'iter_multiple processes={workers}': lambda: loader.iter_multiple(
+            datasets, workers, processes=True),
+    }
+    if cache_dir:
+        runs['iter_multiple cache (cold)'] = lambda: cached.iter_multiple(datasets)
+        runs['iter_multiple cache (warm)'] = lambda: cached.iter_multiple(datasets)
+    expected = None
+    for name, run in runs.items():
+        best = float('inf')
+        for _ in range(1 if name.endswith('(cold)') else repeat):
+            start = time.perf_counter()
+            result = _consume(run())
+            best = min(best, time.perf_counter() - start)
+        if expected is None:
+            expected = result
+        elif result != expected:
+            raise click.ClickException(f'{name} yields different lines')
+        click.echo(f'{name:<36} {best:8.3f}s {result[0] / best:12,.0f} lines/s')
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss // 1024
+    click.echo(f'{expected[0]:,} lines, peak RSS {peak} MB')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+"""Load test a running ``scripts/serve.py`` and report latency and throughput.
+
+Opens ``--concurrency`` keep-alive connections, sends ``--requests`` search
+requests spread over them and prints the p50/p99 latency and the achieved
+queries per second::
+
+    python -m scripts.serve --index-dir ./index --port 8000 &
+    python -m benchmarks.bench_server --port 8000 --concurrency 16 --pair 明月 --pair 不人
+
+Each ``--pair`` is searched with ``--distance`` (``paragraph`` by default);
+the requests cycle through the pairs.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import itertools
+import json
+import time
+from typing import List, Tuple
+from urllib.parse import urlencode
+
+import click
+
+
+async def _request(reader: asyncio.StreamReader, writer: asyncio.StreamWriter,
+                   host: str, target: str) -> Tuple[int, bytes]:
+    writer.write(f'GET {target} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('utf-8'))
+    await writer.drain()
+    status = int((await reader.readline()).split()[1])
+    length = 0
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        if name.lower() == 'content-length':
+            length = int(value)
+    return status, await reader.readexactly(length)
+
+
+async def _client(host: str, port: int, socket_path: str | None, targets,
+                  latencies: List[float], errors: List[int]) -> None:
+    if socket_path:
+        reader, writer = await asyncio.open_unix_connection(socket_path)
+    else:
+        reader, writer = await asyncio.open_connection(host, port)
+    try:
+        for target in targets:
+            start = time.perf_counter()
+            status, body = await _request(reader, writer, host, target)
+            latencies.append(time.perf_counter() - start)
+            if status != 200:
+                errors.append(status)
+            else:
+                json.loads(body)
+    finally:
+        writer.close()
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Return the ``fraction`` percentile of ``values`` (nearest rank)."""
+
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+async def _run(host: str, port: int, socket_path: str | None, targets: List[str],
+               requests: int, concurrency: int) -> Tuple[List[float], List[int], float]:
+    cycle = itertools.islice(itertools.cycle(targets), requests)
+    shared = iter(list(cycle))
+    latencies: List[float] = []
+    errors: List[int] = []
+    start = time.perf_counter()
+    # the clients pull from one iterator, so a slow query does not hold back the others
+    await asyncio.gather(*(
+        _client(host, port, socket_path, shared, latencies, errors) for _ in range(concurrency)
+    ))
+    return latencies, errors, time.perf_counter() - start
+
+
+@click.command()
+@click.option('--host', default='127.0.0.1', show_default=True)
+@click.option('--port', default=8000, show_default=True, type=int)
+@click.option('--socket', 'socket_path', type=click.Path(), help='Connect to a Unix socket instead.')
+@click.option('--pair', 'pairs', multiple=True, default=('明月', '不人', '春风'), show_default=True,
+              help='Two characters to search for; may be repeated.')
+@click.option('--distance', default='paragraph', show_default=True,
+              type=click.Choice(['adjacent', 'sentence', 'paragraph', 'work']))
+@click.option('--limit', default=20, show_default=True, help='Results requested per query.')
+@click.option('--requests', default=500, show_default=True, type=click.IntRange(min=1))
+@click.option('--concurrency', default=8, show_default=True, type=click.IntRange(min=1))
+def main(host: str, port: int, socket_path: str | None, pairs: Tuple[str, ...], distance: str,
+         limit: int, requests: int, concurrency: int) -> None:
+    """Send search requests to the server and report p50/p99 latency and QPS."""
+
+    targets = [
+        '/search?' + urlencode({'char2': pair[0], 'char3': pair[1], 'distance': distance,
+                                'limit': limit})
+        for pair in pairs
+    ]
+    latencies, errors, elapsed = asyncio.run(
+        _run(host, port, socket_path, targets, requests, concurrency))
+    click.echo(f'{len(latencies)} requests, {concurrency} connections, {elapsed:.2f} s')
+    click.echo(f'p50 {percentile(latencies, 0.50) * 1000:.1f} ms  '
+               f'p99 {percentile(latencies, 0.99) * 1000:.1f} ms  '
+               f'{len(latencies) / elapsed:.0f} QPS')
+    if errors:
+        click.echo(f'{len(errors)} failed requests (status {sorted(set(errors))})', err=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,97 @@
+"""Per-character paragraph sets for boolean queries.
+
+``bitmaps.bin`` lists under every character of a segment the sorted
+``(work, paragraph)`` pairs of the paragraphs containing it, work numbers
+being those of the segment's ``char_index.bin``.  Reserved keys of more
+than one character hold ``#all``, every paragraph of the segment, and
+``type:<source>``, the paragraphs of the works of one source type.
+
+The position of a pair in ``#all`` is its paragraph id, so ids follow
+corpus order.  On disk a set is a pair of packed integer columns; in memory
+:func:`to_bitset` turns its ids into a Python integer used as a bitset, on
+which AND, OR and NOT are single big-integer operations::
+
+    from lib.bitmaps import from_bitset, to_bitset
+
+    both = to_bitset(index.char_paragraphs('月')) & to_bitset(index.char_paragraphs('霜'))
+    from_bitset(both)  # array of the paragraph ids holding both characters
+"""
+
+from __future__ import annotations
+
+from typing import Sequence
+
+import numpy as np
+
+from lib.postings import Postings, PostingsBuilder, PostingsFile
+
+BITMAP_COLUMNS = ('work', 'paragraph')
+ALL_KEY = '#all'
+#: Prefix of the keys holding the paragraphs of one source type.
+TYPE_KEY = 'type:'
+
+_SHIFT = 32
+
+
+def encode(view: Postings) -> np.ndarray:
+    """Return the pairs of a ``bitmaps.bin`` view as sorted 64-bit integers."""
+
+    works = np.asarray(view.column('work'), dtype=np.int64)
+    return (works << _SHIFT) | np.asarray(view.column('paragraph'), dtype=np.int64)
+
+
+def decode(pairs: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Split integers made by :func:`encode` into work and paragraph numbers."""
+
+    return pairs >> _SHIFT, pairs & ((1 << _SHIFT) - 1)
+
+
+def _rows(pairs: np.ndarray) -> list:
+    works, paragraphs = decode(pairs)
+    return np.column_stack((works, paragraphs)).ravel().tolist()
+
+
+def build_bitmaps(postings: PostingsFile) -> PostingsBuilder:
+    """Return the paragraph sets of every character and source type of ``postings``."""
+
+    builder = PostingsBuilder(BITMAP_COLUMNS)
+    if not postings.header['rows']:
+        return builder
+    starts = np.asarray(postings.starts, dtype=np.int64)
+    works = np.asarray(postings.column('work_id'), dtype=np.int64)
+    paragraphs = np.asarray(postings.column('paragraph'), dtype=np.int64)
+    kinds = np.asarray(postings.column('type'), dtype=np.int64)
+
+    pairs, row_ids = np.unique((works << _SHIFT) | paragraphs, return_inverse=True)
+    count = len(pairs)
+    builder.extend(ALL_KEY, _rows(pairs))
+
+    # one sort of (key, paragraph id) gives the distinct paragraphs of every key
+    rows_key = np.repeat(np.arange(len(starts) - 1), np.diff(starts))
+    keys, ids = np.divmod(np.unique(rows_key * count + row_ids), count)
+    bounds = np.searchsorted(keys, np.arange(len(starts)))
+    for idx, key in enumerate(postings.keys):
+        builder.extend(key, _rows(pairs[ids[bounds[idx]:bounds[idx + 1]]]))
+
+    types, ids = np.divmod(np.unique(kinds * count + row_ids), count)
+    for kind, name in enumerate(postings.tables['type']):
+        builder.extend(f'{TYPE_KEY}{name}', _rows(pairs[ids[types == kind]]))
+    return builder
+
+
+def to_bitset(ids: Sequence[int]) -> int:
+    """Return a bitset with the bits of ``ids`` set."""
+
+    ids = np.asarray(ids, dtype=np.int64)
+    if not ids.size:
+        return 0
+    bits = np.zeros(int(ids.max()) + 1, dtype=bool)
+    bits[ids] = True
+    return int.from_bytes(np.packbits(bits, bitorder='little').tobytes(), 'little')
+
+
+def from_bitset(bits: int) -> np.ndarray:
+    """Return the positions of the set bits of ``bits`` in increasing order."""
+
+    data = np.frombuffer(bits.to_bytes((bits.bit_length() + 7) // 8, 'little'), dtype=np.uint8)
+    return np.flatnonzero(np.unpackbits(data, bitorder='little'))
@@ -0,0 +1,87 @@
+"""Paragraph forward index and character co-occurrence table.
+
+``paragraphs.bin`` stores, under every work id, the distinct characters of
+each paragraph of the work as ``(paragraph, char)`` rows, characters being
+code points.  It answers "which characters share a paragraph with this
+occurrence" without scanning the character index.
+
+:func:`top_cooccurring` derives the optional ``cooccur.bin`` from it: for
+every character, the ``k`` other characters found in the most paragraphs
+together with it, as ``(rank, char, count)`` rows::
+
+    from lib.cooccur import top_cooccurring
+
+    with open('./index/segments/000001/paragraphs.bin', 'rb') as fh:
+        paragraphs = PostingsFile(fh.read())
+    top_cooccurring(paragraphs, 20).write('./index/segments/000001/cooccur.bin')
+
+Ties in the count are broken by code point, so the table is deterministic.
+"""
+
+from __future__ import annotations
+
+from typing import Set
+
+import numpy as np
+
+from lib.indexer import COOCCUR_COLUMNS, PARAGRAPH_COLUMNS
+from lib.postings import PostingsBuilder, PostingsFile
+
+
+def new_paragraphs() -> PostingsBuilder:
+    """Return an empty builder for ``paragraphs.bin``."""
+    return PostingsBuilder(PARAGRAPH_COLUMNS)
+
+
+def add_paragraph(paragraphs: PostingsBuilder, work_id: str, paragraph: int,
+                  chars: Set[str]) -> None:
+    """Record the distinct characters of one paragraph of ``work_id``."""
+    for code in sorted(map(ord, chars)):
+        paragraphs.append(work_id, (paragraph, code))
+
+
+def top_cooccurring(paragraphs: PostingsFile, k: int) -> PostingsBuilder:
+    """Return the ``k`` characters co-occurring most often with each character.
+
+    Works on the columns of ``paragraphs`` as a whole: the paragraphs that
+    contain a character are gathered with one vectorized slice per
+    character and their characters counted with ``bincount``, so the cost
+    is the total size of those paragraphs rather than one Python operation
+    per character pair.
+    """
+
+    builder = PostingsBuilder(COOCCUR_COLUMNS)
+    rows = paragraphs.header['rows']
+    if not rows or k <= 0:
+        return builder
+    codes, chars = np.unique(np.asarray(paragraphs.column('char')), return_inverse=True)
+    para = np.asarray(paragraphs.column('paragraph'))
+    starts = np.asarray(paragraphs.starts, dtype=np.int64)
+
+    # a paragraph is a run of rows with the same key and paragraph number
+    first = np.zeros(rows, dtype=bool)
+    first[starts[:-1]] = True
+    first[1:] |= para[1:] != para[:-1]
+    bounds = np.append(np.flatnonzero(first), rows)
+    paragraph_of = np.cumsum(first) - 1
+
+    # rows grouped by character: rows of char c are order[by_char[c]:by_char[c + 1]]
+    order = np.argsort(chars, kind='stable')
+    by_char = np.searchsorted(chars[order], np.arange(len(codes) + 1))
+    for char in range(len(codes)):
+        found = paragraph_of[order[by_char[char]:by_char[char + 1]]]
+        lengths = bounds[found + 1] - bounds[found]
+        offsets = np.repeat(bounds[found] - (np.cumsum(lengths) - lengths), lengths)
+        counts = np.bincount(chars[offsets + np.arange(offsets.size)], minlength=len(codes))
+        counts[char] = 0
+        n = min(k, int(np.count_nonzero(counts)))
+        if not n:
+            continue
+        kth = np.partition(counts, counts.size - n)[counts.size - n]
+        above = np.flatnonzero(counts > kth)
+        chosen = np.concatenate([above, np.flatnonzero(counts == kth)[:n - above.size]])
+        chosen = chosen[np.lexsort((chosen, -counts[chosen]))]
+        key = chr(codes[char])
+        for rank, other in enumerate(chosen):
+            builder.append(key, (rank, int(codes[other]), int(counts[other])))
+    return builder
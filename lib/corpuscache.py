@@ -0,0 +1,217 @@
+"""Binary cache of the text lines of corpus JSON files.
+
+Parsing the pretty-printed corpus JSON dominates every job that streams
+over the lines of a dataset.  :func:`open_cached` converts a file once into
+a ``.bin`` file under a cache directory and memory-maps it on later calls::
+
+    from lib.corpuscache import open_cached
+
+    corpus = open_cached('./全唐诗/poet.tang.0.json', 'paragraphs', './cache')
+    corpus.poem(3)     # the lines of the fourth poem
+    list(corpus)       # every line, in order
+
+A cache file holds the UTF-8 lines of the file, each ending in a newline,
+the byte offset of every line and the index of the first line of every
+poem, so a poem is found in constant time and all lines are read with a
+single decode and split.  Should a line contain a newline itself, the
+character offsets of the lines are stored as well and used instead.
+
+:func:`write_corpus` writes the same format from any sequence of poems,
+optionally with further string fields per poem.
+
+The header records the size, modification time and SHA-1 of the source; a
+file whose size or time changed is hashed and converted again only if its
+content did.  Cache files are named after the source path and tag and never
+modified in place: a stale one is replaced atomically.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import mmap
+import os
+from array import array
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+from lib.jsonstream import entry_lines, iter_array
+from lib.postings import read_sections, smallest_typecode, write_sections
+
+MAGIC = b'CPLIN\x00\x01\x00'
+VERSION = 2
+
+
+class CorpusFile(Sequence[List[str]]):
+    """The poems of one cached corpus file, each a list of lines."""
+
+    def __init__(self, buf) -> None:
+        header, sections = read_sections(buf, MAGIC, VERSION)
+        self.header = header
+        self._offsets = sections['lines.offsets']
+        self._blob = sections['lines.blob']
+        self._starts = sections['poems.start']
+        self._sections = sections
+
+    @classmethod
+    def open(cls, path: str) -> 'CorpusFile':
+        with open(path, 'rb') as fh:
+            if os.fstat(fh.fileno()).st_size == 0:
+                raise ValueError(f'{path} is empty')
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf)
+
+    def __len__(self) -> int:
+        return len(self._starts) - 1
+
+    def __getitem__(self, idx):  # type: ignore[override]
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        return self.poem(idx)
+
+    def poem(self, idx: int) -> List[str]:
+        """Return the lines of poem ``idx``."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        offsets, blob = self._offsets, self._blob
+        return [str(blob[offsets[line]:offsets[line + 1] - 1], 'utf-8')
+                for line in range(self._starts[idx], self._starts[idx + 1])]
+
+    def lines(self) -> List[str]:
+        """Return every line in order."""
+        text = str(self._blob, 'utf-8')
+        chars = self._sections.get('lines.chars')
+        if chars is None:
+            return text.split('\n')[:-1]
+        return [text[chars[idx]:chars[idx + 1] - 1] for idx in range(len(chars) - 1)]
+
+    def __iter__(self) -> Iterator[str]:  # type: ignore[override]
+        return iter(self.lines())
+
+    @property
+    def fields(self) -> List[str]:
+        """Names of the per-poem fields stored with the lines."""
+        return [name[6:-5] for name in self._sections
+                if name.startswith('field.') and name.endswith('.blob')]
+
+    def field(self, name: str, idx: int) -> str:
+        """Return field ``name`` of poem ``idx``."""
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        offsets = self._sections[f'field.{name}.offsets']
+        return str(self._sections[f'field.{name}.blob'][offsets[idx]:offsets[idx + 1]], 'utf-8')
+
+
+def file_digest(path: str) -> str:
+    """Return the SHA-1 of a file's content."""
+
+    digest = hashlib.sha1()
+    with open(path, 'rb') as fh:
+        for chunk in iter(lambda: fh.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def cache_path(cache_dir: str, path: str, tag: str) -> str:
+    """Return the cache file of the ``tag`` lines of ``path``."""
+
+    key = f'{os.path.abspath(path)}\x00{tag}'.encode('utf-8')
+    return os.path.join(cache_dir, hashlib.sha1(key).hexdigest()[:20] + '.bin')
+
+
+def _source(path: str) -> Dict[str, int]:
+    stat = os.stat(path)
+    return {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def write_corpus(path: str, poems: Iterable[Sequence[str]], header: Dict[str, Any],
+                 fields: Dict[str, Sequence[str | None]] | None = None) -> int:
+    """Write the lines of ``poems`` to ``path`` and return the number of poems.
+
+    ``fields`` maps a name to one string per poem, stored alongside the lines
+    and read back with :meth:`CorpusFile.field`; ``None`` is stored as an
+    empty string.
+    """
+
+    lines: List[str] = []
+    starts = array('Q', [0])
+    for poem in poems:
+        lines.extend(poem)
+        starts.append(len(lines))
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for line in lines:
+        blob += line.encode('utf-8')
+        blob += b'\n'
+        offsets.append(len(blob))
+    sections = [('lines.offsets', array(smallest_typecode(len(blob)), offsets)),
+                ('lines.blob', array('B', blob))]
+    if any('\n' in line for line in lines):
+        chars = array('Q', [0])
+        for line in lines:
+            chars.append(chars[-1] + len(line) + 1)
+        sections.append(('lines.chars', array(smallest_typecode(chars[-1]), chars)))
+    sections.append(('poems.start', array(smallest_typecode(len(lines)), starts)))
+    for name, values in (fields or {}).items():
+        encoded = [(value or '').encode('utf-8') for value in values]
+        if len(encoded) != len(starts) - 1:
+            raise ValueError(f'field {name!r} has {len(encoded)} values for {len(starts) - 1} poems')
+        field_offsets = array('Q', [0])
+        for value in encoded:
+            field_offsets.append(field_offsets[-1] + len(value))
+        sections.append((f'field.{name}.offsets',
+                         array(smallest_typecode(field_offsets[-1]), field_offsets)))
+        sections.append((f'field.{name}.blob', array('B', b''.join(encoded))))
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    write_sections(path, MAGIC, dict(header, version=VERSION, poems=len(starts) - 1), sections)
+    return len(starts) - 1
+
+
+def build_cache(path: str, tag: str, cached: str) -> None:
+    """Convert the ``tag`` lines of the JSON array in ``path`` to ``cached``."""
+
+    source = _source(path)
+    digest = file_digest(path)
+    poems = (entry_lines(entry, tag) for entry in iter_array(path))
+    write_corpus(cached, (lines for lines in poems if lines is not None),
+                 _header(path, tag, source, digest))
+
+
+def _header(path: str, tag: str, source: Dict[str, int], digest: str) -> Dict[str, Any]:
+    return {'version': VERSION, 'path': os.path.abspath(path), 'tag': tag,
+            'sha1': digest, **source}
+
+
+def _restamp(corpus: CorpusFile, cached: str, source: Dict[str, int]) -> None:
+    """Rewrite ``cached`` with a new source size and time, keeping its data."""
+
+    sections = []
+    for name, (_, _, code) in corpus.header['sections'].items():
+        values = array(code)
+        values.frombytes(corpus._sections[name].tobytes())
+        sections.append((name, values))
+    header = corpus.header
+    write_sections(cached, MAGIC, dict(_header(header['path'], header['tag'], source,
+                                               header['sha1']), poems=header['poems']), sections)
+
+
+def open_cached(path: str, tag: str, cache_dir: str) -> CorpusFile:
+    """Return the cached ``tag`` lines of ``path``, converting the file if needed."""
+
+    cached = cache_path(cache_dir, path, tag)
+    source = _source(path)
+    try:
+        corpus = CorpusFile.open(cached)
+    except (OSError, ValueError):
+        corpus = None
+    if corpus is not None:
+        header = corpus.header
+        if all(header.get(field) == value for field, value in source.items()):
+            return corpus
+        if header.get('size') == source['size'] and header.get('sha1') == file_digest(path):
+            _restamp(corpus, cached, source)
+            return CorpusFile.open(cached)
+    build_cache(path, tag, cached)
+    return CorpusFile.open(cached)
@@ -0,0 +1,369 @@
+"""SQLite database of the whole corpus with author/title indexes and full-text search.
+
+``scripts/export_db.py`` loads every dataset of ``loader/datas.json``
+together with the author records, the prosody of ``strains/`` and the
+search engine counts of ``rank/`` into one file::
+
+    from lib.corpusdb import CorpusDB
+
+    db = CorpusDB('./corpus.db')
+    db.by_author('李白', limit=10)        # indexed lookups
+    db.get('poet.tang.0-1')              # the record of a work id
+    list(db.find_phrase('明月光'))       # (work_id, paragraph, line, pos)
+
+``poems`` has one row per work with B-tree indexes on author, title,
+rhythmic and dynasty.  ``poems_fts`` is a contentless FTS5 table over the
+text of every poem.  SQLite's Python bindings cannot register a tokenizer,
+so the text is tokenized when it is stored instead: one token per
+character, folded to its canonical form (:mod:`lib.variants`) with
+punctuation left out.  A phrase query is a FTS5 phrase of its characters,
+and the lines of the few candidate poems are checked for the exact phrase.
+
+Work ids are the ones ``preprocess.py`` assigns, so the database can stand
+in for the document store of an index.
+"""
+
+from __future__ import annotations
+
+import json
+import os
+import re
+import sqlite3
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+from lib.jsonstream import NotAnArray, entry_lines, iter_array
+from lib.phrases import is_punctuation, phrase_chars
+from lib.variants import fold_text
+
+SCHEMA = '''
+CREATE TABLE datasets (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    title TEXT,
+    tag TEXT NOT NULL
+);
+CREATE TABLE authors (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL,
+    dynasty TEXT,
+    description TEXT,
+    short_description TEXT
+);
+CREATE TABLE poems (
+    id INTEGER PRIMARY KEY,
+    dataset INTEGER NOT NULL REFERENCES datasets(id),
+    seq INTEGER NOT NULL,
+    work_id TEXT NOT NULL,
+    file TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    type TEXT NOT NULL,
+    title TEXT,
+    rhythmic TEXT,
+    author TEXT,
+    dynasty TEXT,
+    paragraphs TEXT NOT NULL,
+    strains TEXT,
+    rank TEXT
+);
+CREATE VIRTUAL TABLE poems_fts USING fts5(text, content='', columnsize=0);
+'''
+
+INDEXES = '''
+CREATE UNIQUE INDEX poems_seq ON poems(dataset, seq);
+CREATE INDEX poems_work_id ON poems(work_id);
+CREATE INDEX poems_author ON poems(author);
+CREATE INDEX poems_title ON poems(title);
+CREATE INDEX poems_rhythmic ON poems(rhythmic);
+CREATE INDEX poems_dynasty ON poems(dynasty);
+CREATE INDEX authors_name ON authors(name);
+CREATE INDEX authors_dynasty ON authors(dynasty);
+'''
+
+#: Author files under the corpus root and the dynasty of their authors.
+AUTHOR_FILES = (
+    ('全唐诗/authors.tang.json', '唐'),
+    ('全唐诗/authors.song.json', '宋'),
+    ('宋词/author.song.json', '宋'),
+    ('五代诗词/nantang/authors.json', '五代'),
+)
+
+#: Dynasty of the datasets written in a single one.
+DYNASTIES = {
+    'wudai-huajianji': '五代',
+    'wudai-nantang': '五代',
+    'yuanqu': '元',
+    'songci': '宋',
+    'yudingquantangshi': '唐',
+    'shuimotangshi': '唐',
+    'nalanxingde': '清',
+}
+
+#: Dynasty of a file of a mixed dataset, from its name.
+_FILE_DYNASTY = (('tang', '唐'), ('song', '宋'), ('唐', '唐'), ('宋', '宋'))
+
+_SHARD = re.compile(r'^(?P<kind>poet|ci)\.(?P<dynasty>\w+)\.(?P<num>\d+)\.json$')
+
+_POEM_COLUMNS = 'work_id, dataset, type, title, rhythmic, author, dynasty, paragraphs, strains, rank'
+
+
+def tokens(lines: Iterable[str]) -> str:
+    """Return the FTS5 text of ``lines``: one folded character per token."""
+    return ' '.join(ch for ch in fold_text(''.join(lines)) if not is_punctuation(ch))
+
+
+def file_dynasty(dataset: str, path: str) -> str | None:
+    """Return the dynasty of the works in ``path`` of ``dataset`` if known."""
+
+    if dataset in DYNASTIES:
+        return DYNASTIES[dataset]
+    name = os.path.basename(path)
+    for marker, dynasty in _FILE_DYNASTY:
+        if marker in name:
+            return dynasty
+    return None
+
+
+def companions(root: str, path: str) -> Tuple[str | None, str | None]:
+    """Return the strains and rank shards matching a corpus shard, if they exist.
+
+    ``strains/json/poet.song.0.json`` and ``rank/poet/poet.song.rank.0.json``
+    hold one record per entry of ``poet.song.0.json``.  Strains records carry
+    the id of their entry; rank records are matched by :func:`rank_key`.
+    """
+
+    match = _SHARD.match(os.path.basename(path))
+    if match is None:
+        return None, None
+    strains = os.path.join(root, 'strains', 'json', os.path.basename(path))
+    rank = os.path.join(root, 'rank', match['kind'],
+                        f"{match['kind']}.{match['dynasty']}.rank.{match['num']}.json")
+    return (strains if os.path.isfile(strains) else None,
+            rank if os.path.isfile(rank) else None)
+
+
+def rank_key(record: Dict[str, Any]) -> Tuple[Any, Any]:
+    """Return the (author, title) pair pairing a rank record with its entry."""
+
+    return record.get('author'), record.get('title', record.get('rhythmic'))
+
+
+def _read(path: str | None) -> List[Any]:
+    if path is None:
+        return []
+    try:
+        return list(iter_array(path))
+    except NotAnArray:
+        return []
+
+
+def _poem_rows(dataset: int, name: str, path: str, tag: str, root: str,
+               seq: int) -> Iterator[Tuple[tuple, str]]:
+    """Yield the ``poems`` row and FTS5 text of every work in ``path``."""
+
+    strains_path, rank_path = companions(root, path)
+    strains, ranks = _read(strains_path), _read(rank_path)
+    by_key: Dict[Tuple[Any, Any], int] = {}
+    for idx, record in enumerate(ranks):
+        if isinstance(record, dict):
+            by_key.setdefault(rank_key(record), idx)
+    dynasty = file_dynasty(name, path)
+    base = os.path.splitext(os.path.basename(path))[0]
+    entries = enumerate(iter_array(path))
+    while True:
+        try:
+            position, entry = next(entries)
+        except (NotAnArray, StopIteration):
+            return
+        lines = entry_lines(entry, tag)
+        if lines is None:
+            continue
+        work_id = entry.get('id') or entry.get('uuid') or f'{base}-{position + 1}'
+        strain = strains[position] if position < len(strains) else None
+        if isinstance(strain, dict) and strain.get('id') not in (None, entry.get('id')):
+            strain = None
+        key = rank_key(entry)
+        rank = ranks[position] if position < len(ranks) else None
+        if not isinstance(rank, dict) or rank_key(rank) != key:
+            rank = ranks[by_key[key]] if key in by_key else None
+        row = (
+            dataset, seq, work_id, os.path.relpath(path, root), position,
+            'ci' if 'rhythmic' in entry else 'poetry',
+            entry.get('title'), entry.get('rhythmic'), entry.get('author'), dynasty,
+            json.dumps(lines, ensure_ascii=False),
+            json.dumps(strain['strains'], ensure_ascii=False)
+            if isinstance(strain, dict) and 'strains' in strain else None,
+            json.dumps(rank, ensure_ascii=False) if isinstance(rank, dict) else None,
+        )
+        yield row, tokens(lines)
+        seq += 1
+
+
+def build_database(db_path: str, root: str, datasets: Dict[str, Dict[str, Any]],
+                   files: Dict[str, List[Tuple[str, str]]]) -> Dict[str, int]:
+    """Write the corpus database to ``db_path`` atomically.
+
+    ``datasets`` is the ``datasets`` section of ``loader/datas.json`` and
+    ``files`` the ``(path, tag)`` pairs of each dataset to load.  Returns the
+    number of works stored per dataset.
+    """
+
+    tmp_path = f'{db_path}.tmp'
+    if os.path.exists(tmp_path):
+        os.remove(tmp_path)
+    conn = sqlite3.connect(tmp_path)
+    counts: Dict[str, int] = {}
+    try:
+        conn.executescript(SCHEMA)
+        with conn:
+            for name, paths in files.items():
+                configs = datasets[name]
+                conn.execute('INSERT INTO datasets (id, name, title, tag) VALUES (?, ?, ?, ?)',
+                             (configs['id'], name, configs.get('name'), configs['tag']))
+                seq = 0
+                for path, tag in paths:
+                    rows = list(_poem_rows(configs['id'], name, path, tag, root, seq))
+                    cursor = conn.execute('SELECT coalesce(max(id), 0) FROM poems')
+                    first = cursor.fetchone()[0] + 1
+                    conn.executemany(
+                        'INSERT INTO poems (dataset, seq, work_id, file, position, type, title, '
+                        'rhythmic, author, dynasty, paragraphs, strains, rank) '
+                        'VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)',
+                        (row for row, _ in rows))
+                    conn.executemany('INSERT INTO poems_fts (rowid, text) VALUES (?, ?)',
+                                     ((first + idx, text) for idx, (_, text) in enumerate(rows)))
+                    seq += len(rows)
+                counts[name] = seq
+            for relpath, dynasty in AUTHOR_FILES:
+                conn.executemany(
+                    'INSERT INTO authors (name, dynasty, description, short_description) '
+                    'VALUES (?, ?, ?, ?)',
+                    ((author['name'], dynasty, author.get('desc') or author.get('description'),
+                      author.get('short_description'))
+                     for author in _read(_existing(os.path.join(root, relpath)))
+                     if isinstance(author, dict) and author.get('name')))
+            conn.executescript(INDEXES)
+            conn.execute("INSERT INTO poems_fts (poems_fts) VALUES ('optimize')")
+        conn.execute('VACUUM')
+    finally:
+        conn.close()
+    os.replace(tmp_path, db_path)
+    return counts
+
+
+def _existing(path: str) -> str | None:
+    return path if os.path.isfile(path) else None
+
+
+class CorpusDB:
+    """Read-only access to a database written by :func:`build_database`."""
+
+    def __init__(self, path: str) -> None:
+        if not os.path.isfile(path):
+            raise FileNotFoundError(path)
+        self.path = path
+        self.conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, check_same_thread=False)
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def _records(self, where: str, params: Sequence[Any], limit: int | None = None
+                 ) -> List[Dict[str, Any]]:
+        sql = f'SELECT {_POEM_COLUMNS} FROM poems WHERE {where} ORDER BY id'
+        if limit is not None:
+            sql += f' LIMIT {int(limit)}'
+        return [_record(row) for row in self.conn.execute(sql, params)]
+
+    def get(self, work_id: str) -> Dict[str, Any] | None:
+        """Return the record of ``work_id``, shaped like a corpus entry."""
+        records = self._records('work_id = ?', (work_id,), 1)
+        return records[0] if records else None
+
+    def __contains__(self, work_id: object) -> bool:
+        return isinstance(work_id, str) and self.get(work_id) is not None
+
+    def by_author(self, author: str, limit: int | None = None) -> List[Dict[str, Any]]:
+        return self._records('author = ?', (author,), limit)
+
+    def by_title(self, title: str, limit: int | None = None) -> List[Dict[str, Any]]:
+        """Return the works titled ``title``, or with ``title`` as their rhythmic."""
+        return self._records('id IN (SELECT id FROM poems WHERE title = ? '
+                             'UNION SELECT id FROM poems WHERE rhythmic = ?)', (title, title), limit)
+
+    def by_dynasty(self, dynasty: str, limit: int | None = None) -> List[Dict[str, Any]]:
+        return self._records('dynasty = ?', (dynasty,), limit)
+
+    def author(self, name: str) -> List[Dict[str, Any]]:
+        """Return the author records named ``name``, one per dynasty file."""
+        cursor = self.conn.execute(
+            'SELECT name, dynasty, description, short_description FROM authors '
+            'WHERE name = ? ORDER BY id', (name,))
+        return [dict(zip(('name', 'dynasty', 'description', 'short_description'), row))
+                for row in cursor]
+
+    def iter_lines(self, dataset: str) -> Iterator[str]:
+        """Yield the lines of ``dataset`` in corpus order."""
+        cursor = self.conn.execute(
+            'SELECT paragraphs FROM poems JOIN datasets ON datasets.id = poems.dataset '
+            'WHERE datasets.name = ? ORDER BY seq', (dataset,))
+        for (paragraphs,) in cursor:
+            yield from json.loads(paragraphs)
+
+    def poem(self, dataset: str, seq: int) -> List[str] | None:
+        """Return the lines of work ``seq`` of ``dataset``."""
+        cursor = self.conn.execute(
+            'SELECT paragraphs FROM poems JOIN datasets ON datasets.id = poems.dataset '
+            'WHERE datasets.name = ? AND seq = ?', (dataset, seq))
+        row = cursor.fetchone()
+        return None if row is None else json.loads(row[0])
+
+    def find_phrase(self, text: str, loose: bool = False, source: Sequence[str] = ()
+                    ) -> Iterator[Tuple[str, int, int, int]]:
+        """Yield ``(work_id, paragraph, line, pos)`` of each occurrence of a phrase.
+
+        As with the bigram index, the phrase must stand on one line without
+        punctuation inside unless ``loose``; traditional and variant forms
+        match each other.
+        """
+
+        chars = phrase_chars(fold_text(text))
+        if not chars:
+            raise ValueError(f'no characters to match in {text!r}')
+        sql = ('SELECT work_id, position, type, paragraphs FROM poems WHERE id IN '
+               '(SELECT rowid FROM poems_fts WHERE poems_fts MATCH ?)')
+        params: List[Any] = ['"' + ' '.join(chars) + '"']
+        if source:
+            sql += f" AND type IN ({', '.join('?' * len(source))})"
+            params.extend(source)
+        for work_id, position, _, paragraphs in self.conn.execute(sql + ' ORDER BY id', params):
+            lines = json.loads(paragraphs)
+            for line_idx, pos in _occurrences(lines, chars, loose):
+                yield work_id, position + 1, line_idx, pos
+
+
+def _record(row: Sequence[Any]) -> Dict[str, Any]:
+    work_id, _, _, title, rhythmic, author, dynasty, paragraphs, strains, rank = row
+    record: Dict[str, Any] = {'id': work_id}
+    for key, value in (('title', title), ('rhythmic', rhythmic), ('author', author),
+                       ('dynasty', dynasty)):
+        if value is not None:
+            record[key] = value
+    record['paragraphs'] = json.loads(paragraphs)
+    if strains is not None:
+        record['strains'] = json.loads(strains)
+    if rank is not None:
+        record['rank'] = json.loads(rank)
+    return record
+
+
+def _occurrences(lines: Sequence[str], chars: str, loose: bool) -> Iterator[Tuple[int, int]]:
+    """Yield the ``(line, pos)`` where the folded ``chars`` start in ``lines``."""
+
+    places = [(line_idx, pos) for line_idx, line in enumerate(lines, start=1)
+              for pos, ch in enumerate(line, start=1) if not is_punctuation(ch)]
+    text = ''.join(ch for ch in fold_text(''.join(lines)) if not is_punctuation(ch))
+    start = text.find(chars)
+    while start >= 0:
+        span = places[start:start + len(chars)]
+        if loose or all(b == (a[0], a[1] + 1) for a, b in zip(span, span[1:])):
+            yield span[0]
+        start = text.find(chars, start + 1)
@@ -0,0 +1,340 @@
+"""Fetch many pages of a site concurrently, politely and resumably.
+
+:class:`Fetcher` sends form POSTs over a pool of keep-alive connections,
+with at most ``concurrency`` requests in flight, at most ``rate`` requests
+started per second, and failed requests (connection errors, timeouts,
+``429`` and ``5xx`` responses) retried with exponential backoff.  Redirects
+are followed the way browsers do: ``301``, ``302`` and ``303`` turn the POST
+into a GET, ``307`` and ``308`` repeat it.  Compressed responses are
+decoded, and the ``http_proxy``/``https_proxy`` environment variables are
+honoured unless a ``proxy`` is given.
+:func:`crawl` runs a coroutine per page and saves each finished page in a
+:class:`Checkpoint` directory, so an interrupted crawl resumes where it
+stopped::
+
+    async def fetch_page(page):
+        body = await fetcher.post({'pageno': page})
+        return parse(body)
+
+    async with Fetcher('http://example.com/getdata.asp', concurrency=8, rate=20) as fetcher:
+        pages = await crawl(range(1, 100), fetch_page, Checkpoint('pages'))
+
+Only the standard library is used; ``https`` URLs are supported, through a
+proxy as well.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import logging
+import os
+import ssl
+import zlib
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Tuple
+from urllib.parse import urlencode, urljoin, urlsplit
+from urllib.request import getproxies, proxy_bypass
+
+#: Statuses worth retrying.
+RETRY_STATUSES = frozenset({429, 500, 502, 503, 504})
+#: Statuses followed to their ``Location``.
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+MAX_REDIRECTS = 10
+
+Response = Tuple[int, Dict[str, str], bytes]
+Origin = Tuple[str, str, int]
+Connection = Tuple[asyncio.StreamReader, asyncio.StreamWriter]
+
+
+class FetchError(Exception):
+    """A request still failed after all retries."""
+
+
+class RateLimiter:
+    """Space request starts at least ``1 / rate`` seconds apart."""
+
+    def __init__(self, rate: float | None = None) -> None:
+        self.interval = 1.0 / rate if rate else 0.0
+        self._next = 0.0
+
+    async def wait(self) -> None:
+        if not self.interval:
+            return
+        now = asyncio.get_running_loop().time()
+        start = max(now, self._next)
+        self._next = start + self.interval
+        if start > now:
+            await asyncio.sleep(start - now)
+
+
+async def _read_head(reader: asyncio.StreamReader) -> Tuple[bytes, int, Dict[str, str]]:
+    """Read a status line and headers; return the version, status and headers."""
+
+    status_line = await reader.readline()
+    if not status_line:
+        raise ConnectionError('connection closed')
+    version, status = status_line.split()[:2]
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b'\r\n', b'\n', b''):
+            break
+        name, _, value = line.decode('latin-1').partition(':')
+        headers[name.strip().lower()] = value.strip()
+    return version, int(status), headers
+
+
+async def _read_response(reader: asyncio.StreamReader) -> Tuple[Response, bool]:
+    """Read one response; also return whether the connection can be reused."""
+
+    version, status, headers = await _read_head(reader)
+    connection = headers.get('connection', '').lower()
+    reusable = connection == 'keep-alive' if version == b'HTTP/1.0' else connection != 'close'
+    if headers.get('transfer-encoding', '').lower() == 'chunked':
+        chunks = []
+        while True:
+            size = int((await reader.readline()).split(b';')[0], 16)
+            if not size:
+                while (await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    pass
+                break
+            chunks.append(await reader.readexactly(size))
+            await reader.readexactly(2)
+        body = b''.join(chunks)
+    elif 'content-length' in headers:
+        body = await reader.readexactly(int(headers['content-length']))
+    else:
+        body = await reader.read()
+        reusable = False
+    encoding = headers.get('content-encoding', 'identity').lower()
+    if encoding in ('gzip', 'x-gzip', 'deflate'):
+        try:
+            # 47 accepts both gzip and zlib wrapped data
+            body = zlib.decompress(body, 47)
+        except zlib.error as exc:
+            raise ValueError(f'cannot decode {encoding} body: {exc}') from None
+    elif encoding != 'identity':
+        raise ValueError(f'unsupported content encoding {encoding!r}')
+    return (status, headers, body), reusable
+
+
+class Fetcher:
+    """POST forms to one URL with pooled connections, limits and retries.
+
+    ``proxy`` is the URL of an HTTP proxy for every request; by default the
+    proxy of the environment applies, as for :mod:`urllib`.
+    """
+
+    def __init__(self, url: str, concurrency: int = 8, rate: float | None = None,
+                 retries: int = 3, backoff: float = 0.5, timeout: float = 30.0,
+                 proxy: str | None = None) -> None:
+        self.url = url
+        self.proxy = proxy
+        self.retries = retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.limiter = RateLimiter(rate)
+        self.requests = 0
+        self._slots = asyncio.Semaphore(concurrency)
+        self._idle: Dict[Origin, List[Connection]] = {}
+        self._ssl: ssl.SSLContext | None = None
+
+    async def __aenter__(self) -> 'Fetcher':
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.close()
+
+    async def close(self) -> None:
+        idle, self._idle = self._idle, {}
+        for connections in idle.values():
+            for _, writer in connections:
+                writer.close()
+
+    def _proxy_for(self, scheme: str, host: str) -> Tuple[str, int] | None:
+        proxy = self.proxy
+        if proxy is None:
+            proxy = getproxies().get(scheme)
+            if proxy is None or proxy_bypass(host):
+                return None
+        parts = urlsplit(proxy if '//' in proxy else f'http://{proxy}')
+        return parts.hostname or 'localhost', parts.port or 80
+
+    async def _connect(self, origin: Origin) -> Connection:
+        scheme, host, port = origin
+        tls = None
+        if scheme == 'https':
+            if self._ssl is None:
+                self._ssl = ssl.create_default_context()
+            tls = self._ssl
+        proxy = self._proxy_for(scheme, host)
+        if proxy is None:
+            return await asyncio.open_connection(host, port, ssl=tls)
+        reader, writer = await asyncio.open_connection(*proxy)
+        if tls is None:
+            return reader, writer
+        # tunnel https through the proxy
+        try:
+            writer.write(f'CONNECT {host}:{port} HTTP/1.1\r\nHost: {host}:{port}\r\n\r\n'
+                         .encode('latin-1'))
+            await writer.drain()
+            _, status, _ = await _read_head(reader)
+            if status != 200:
+                raise ConnectionError(f'proxy refused CONNECT {host}:{port}: HTTP {status}')
+            await writer.start_tls(tls, server_hostname=host)
+        except BaseException:
+            writer.close()
+            raise
+        return reader, writer
+
+    async def _send(self, method: str, url: str, body: bytes | None) -> Response:
+        parts = urlsplit(url)
+        scheme = parts.scheme or 'http'
+        host = parts.hostname or 'localhost'
+        default_port = 443 if scheme == 'https' else 80
+        port = parts.port or default_port
+        target = (parts.path or '/') + (f'?{parts.query}' if parts.query else '')
+        if scheme == 'http' and self._proxy_for(scheme, host):
+            target = f'http://{parts.netloc}{target}'
+        authority = host if port == default_port else f'{host}:{port}'
+        head = (f'{method} {target} HTTP/1.1\r\nHost: {authority}\r\n'
+                'Accept-Encoding: gzip, deflate\r\n')
+        if body is not None:
+            head += ('Content-Type: application/x-www-form-urlencoded\r\n'
+                     f'Content-Length: {len(body)}\r\n')
+        request = (head + '\r\n').encode('latin-1') + (body or b'')
+        idle = self._idle.setdefault((scheme, host, port), [])
+        while True:
+            # an idle connection the server has closed fails at once: drop it
+            # and try the next one, or a new one, without counting a retry
+            pooled = bool(idle)
+            if pooled:
+                reader, writer = idle.pop()
+            else:
+                reader, writer = await self._connect((scheme, host, port))
+            try:
+                writer.write(request)
+                await writer.drain()
+                response, reusable = await _read_response(reader)
+                break
+            except (ConnectionError, asyncio.IncompleteReadError):
+                writer.close()
+                if not pooled:
+                    raise
+            except BaseException:
+                writer.close()
+                raise
+        if reusable:
+            idle.append((reader, writer))
+        else:
+            writer.close()
+        return response
+
+    async def _request(self, body: bytes) -> Tuple[int, bytes]:
+        """POST ``body``, following redirects; return the last status and body."""
+
+        method, url, payload = 'POST', self.url, body
+        for _ in range(MAX_REDIRECTS + 1):
+            await self.limiter.wait()
+            self.requests += 1
+            status, headers, content = await asyncio.wait_for(
+                self._send(method, url, payload), self.timeout)
+            if status not in REDIRECT_STATUSES or 'location' not in headers:
+                break
+            url = urljoin(url, headers['location'])
+            if status in (301, 302, 303):
+                method, payload = 'GET', None
+        return status, content
+
+    async def post(self, data: Dict[str, Any]) -> bytes:
+        """Return the body of the response to the form ``data``.
+
+        Raises :class:`FetchError` once ``retries`` retries have failed, and
+        at once for other statuses than ``2xx`` and :data:`RETRY_STATUSES`.
+        """
+
+        body = urlencode(data).encode('ascii')
+        for attempt in range(self.retries + 1):
+            async with self._slots:
+                try:
+                    status, content = await self._request(body)
+                except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError,
+                        ValueError) as exc:
+                    error = f'{type(exc).__name__}: {exc}'
+                else:
+                    if 200 <= status < 300:
+                        return content
+                    error = f'HTTP {status}'
+                    if status in REDIRECT_STATUSES:
+                        error += f' after {MAX_REDIRECTS} redirects'
+                    if status not in RETRY_STATUSES:
+                        break
+            if attempt < self.retries:
+                logging.warning('%s %s, retrying', data, error)
+                await asyncio.sleep(self.backoff * 2 ** attempt)
+        raise FetchError(f'{data}: {error}')
+
+
+class Checkpoint:
+    """A directory holding the result of each finished page as JSON."""
+
+    def __init__(self, directory: str) -> None:
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def path(self, page: int) -> str:
+        return os.path.join(self.directory, f'page.{page}.json')
+
+    def done(self) -> List[int]:
+        """Return the finished pages, sorted."""
+        return sorted(int(name.split('.')[1]) for name in os.listdir(self.directory)
+                      if name.startswith('page.') and name.endswith('.json'))
+
+    def load(self, page: int) -> Any:
+        with open(self.path(page), 'r', encoding='utf-8') as fh:
+            return json.load(fh)
+
+    def save(self, page: int, result: Any) -> None:
+        tmp_path = self.path(page) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(result, fh, ensure_ascii=False)
+        os.replace(tmp_path, self.path(page))
+
+
+async def crawl(pages: Iterable[int], fetch_page: Callable[[int], Awaitable[Any]],
+                checkpoint: Checkpoint | None = None, workers: int = 8) -> Dict[int, Any]:
+    """Run ``fetch_page`` on every page and return the results by page.
+
+    Pages already in ``checkpoint`` are loaded instead of fetched and new
+    results are saved there as soon as they are complete.  A page failing
+    with :class:`FetchError` or ``ValueError`` (say an unexpected response)
+    is logged and left out of the result, so running the crawl again
+    retries only the missing pages.
+    """
+
+    pages = list(pages)
+    done = set(checkpoint.done()) if checkpoint else set()
+    queue: asyncio.Queue = asyncio.Queue()
+    for page in pages:
+        if page not in done:
+            queue.put_nowait(page)
+    results: Dict[int, Any] = {}
+
+    async def worker() -> None:
+        while not queue.empty():
+            page = queue.get_nowait()
+            try:
+                result = await fetch_page(page)
+            except (FetchError, ValueError) as exc:
+                logging.error('page %d failed: %s', page, exc)
+                continue
+            if checkpoint:
+                checkpoint.save(page, result)
+            results[page] = result
+            logging.info('page %d done', page)
+
+    await asyncio.gather(*(worker() for _ in range(max(1, workers))))
+    for page in pages:
+        if page in done:
+            results[page] = checkpoint.load(page)
+    return {page: results[page] for page in pages if page in results}
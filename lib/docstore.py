@@ -0,0 +1,200 @@
+"""Work records for rendering search results without scanning the corpus.
+
+``scripts/preprocess.py`` writes ``docs.bin`` next to the character index.
+It holds one compact JSON record per work (title, rhythmic, author and the
+text lines) addressed by ``work_id``::
+
+    from lib.docstore import open_docstore
+
+    docs = open_docstore('./index')
+    entry = docs.get('ci-1')  # {'rhythmic': ..., 'paragraphs': [...]}
+
+Work ids are stored sorted, so a lookup is a binary search over the
+memory-mapped key table followed by decoding a single record.  Recently used
+records are kept in an LRU cache.  A segmented index has one store per
+segment; :func:`open_docstore` returns a :class:`SegmentedDocStore` that
+looks a work up in each of them.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import mmap
+import os
+import tempfile
+from array import array
+from typing import Any, Collection, Dict, Iterator, Sequence, Tuple
+
+from lib.indexer import read_manifest, segment_dir
+from lib.postings import StringTable, find_string, read_sections, string_sections, write_sections
+
+DOCSTORE = 'docs.bin'
+MAGIC = b'CPDOC\x00\x01\x00'
+VERSION = 1
+
+#: Entry fields copied into a work record besides its text lines.
+FIELDS = ('title', 'rhythmic', 'author')
+
+
+class DocStoreBuilder:
+    """Collect work records and write them as a ``docs.bin`` file.
+
+    Records are spooled to a temporary file as they are added; only the work
+    ids and record offsets are kept in memory.
+    """
+
+    def __init__(self, spool_dir: str | None = None) -> None:
+        fd, self._spool_path = tempfile.mkstemp(suffix='.spool', dir=spool_dir)
+        self._spool = os.fdopen(fd, 'wb')
+        self._records: Dict[str, Tuple[int, int]] = {}
+
+    def add(self, work_id: str, entry: Dict[str, Any], lines) -> None:
+        """Store ``entry`` under ``work_id`` unless the id was already seen."""
+
+        if work_id in self._records:
+            return
+        record = {field: entry[field] for field in FIELDS if entry.get(field)}
+        record['paragraphs'] = list(lines)
+        data = json.dumps(record, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+        self.add_raw(work_id, data)
+
+    def add_raw(self, work_id: str, data: bytes) -> None:
+        """Store an already encoded record unless ``work_id`` was already seen."""
+
+        if work_id in self._records:
+            return
+        self._records[work_id] = (self._spool.tell(), len(data))
+        self._spool.write(data)
+
+    def merge(self, store: 'DocStore') -> None:
+        """Add the records of ``store`` in the order they were written."""
+
+        for work_id, data in store.records():
+            self.add_raw(work_id, data)
+
+    def __len__(self) -> int:
+        return len(self._records)
+
+    def close(self) -> None:
+        """Discard the spooled records without writing a store."""
+
+        self._spool.close()
+        if os.path.exists(self._spool_path):
+            os.remove(self._spool_path)
+
+    def write(self, path: str) -> None:
+        """Write the store to ``path`` atomically."""
+
+        keys = sorted(self._records)
+        starts = array('Q', (self._records[key][0] for key in keys))
+        sizes = array('Q', (self._records[key][1] for key in keys))
+        self._spool.close()
+        sections = string_sections('keys', keys)
+        sections.append(('records.start', starts))
+        sections.append(('records.size', sizes))
+        sections.append(('records.blob', self._spool_path))
+        try:
+            write_sections(path, MAGIC, {'version': VERSION, 'works': len(keys)}, sections)
+        finally:
+            self.close()
+
+
+class DocStore:
+    """Look up work records by ``work_id`` from a ``docs.bin`` buffer."""
+
+    def __init__(self, buf, cache_size: int = 1024) -> None:
+        header, sections = read_sections(buf, MAGIC, VERSION)
+        self.header = header
+        self.keys = StringTable(sections['keys.offsets'], sections['keys.blob'])
+        self._starts = sections['records.start']
+        self._sizes = sections['records.size']
+        self._blob = sections['records.blob']
+        self.get = functools.lru_cache(maxsize=cache_size)(self._get)
+
+    @classmethod
+    def open(cls, path: str, cache_size: int = 1024) -> 'DocStore':
+        with open(path, 'rb') as fh:
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf, cache_size)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, work_id: object) -> bool:
+        return isinstance(work_id, str) and find_string(self.keys, work_id) >= 0
+
+    def records(self) -> Iterator[Tuple[str, bytes]]:
+        """Yield ``(work_id, encoded record)`` pairs in storage order."""
+
+        starts = self._starts
+        for idx in sorted(range(len(self.keys)), key=starts.__getitem__):
+            start = starts[idx]
+            yield self.keys[idx], bytes(self._blob[start:start + self._sizes[idx]])
+
+    def raw(self, work_id: str) -> bytes | None:
+        """Return the encoded record of ``work_id`` without decoding it."""
+
+        idx = find_string(self.keys, work_id)
+        if idx < 0:
+            return None
+        start = self._starts[idx]
+        return bytes(self._blob[start:start + self._sizes[idx]])
+
+    def _get(self, work_id: str) -> Dict[str, Any] | None:
+        data = self.raw(work_id)
+        return None if data is None else json.loads(data)
+
+
+class SegmentedDocStore:
+    """Look up work records in the document stores of an index's segments.
+
+    ``stores`` lists ``(store, deleted work ids)`` pairs oldest first.  The
+    record of the oldest segment that still holds a work wins, as the first
+    record of a work id wins in a full build.
+    """
+
+    def __init__(self, stores: Sequence[Tuple[DocStore, Collection[str]]],
+                 cache_size: int = 1024) -> None:
+        self.stores = [(store, frozenset(deleted)) for store, deleted in stores]
+        self.get = functools.lru_cache(maxsize=cache_size)(self._get)
+
+    @classmethod
+    def open(cls, index_dir: str, manifest: Dict[str, Any],
+             cache_size: int = 1024) -> 'SegmentedDocStore':
+        """Open the stores of the segments listed in ``manifest``."""
+
+        return cls([
+            (DocStore.open(os.path.join(segment_dir(index_dir, segment['name']), DOCSTORE), 0),
+             segment['deleted'])
+            for segment in manifest['segments']
+        ], cache_size)
+
+    def __contains__(self, work_id: object) -> bool:
+        return isinstance(work_id, str) and self.raw(work_id) is not None
+
+    def raw(self, work_id: str) -> bytes | None:
+        """Return the encoded record of ``work_id`` without decoding it."""
+
+        for store, deleted in self.stores:
+            if work_id not in deleted:
+                data = store.raw(work_id)
+                if data is not None:
+                    return data
+        return None
+
+    def _get(self, work_id: str) -> Dict[str, Any] | None:
+        data = self.raw(work_id)
+        return None if data is None else json.loads(data)
+
+
+def open_docstore(index_dir: str) -> DocStore | SegmentedDocStore | None:
+    """Open the document store of ``index_dir`` if the index has one."""
+
+    manifest = read_manifest(index_dir)
+    if manifest is not None and manifest.get('segments'):
+        return SegmentedDocStore.open(index_dir, manifest)
+    path = os.path.join(index_dir, DOCSTORE)
+    if not os.path.exists(path):
+        return None
+    return DocStore.open(path)
@@ -1,15 +1,38 @@
 """Utility helpers for loading and querying the character index.
 
 The preprocessing script ``scripts/preprocess.py`` generates an inverted
-character index in JSON format. The index is stored as ``char_index.json``
-inside the chosen output directory. This module provides two small helper
-functions to work with that file::
+character index inside the chosen output directory.  By default the index is
+written as ``char_index.bin``, a columnar binary file described in
+:mod:`lib.postings`; ``--format json`` exports the older ``char_index.json``
+instead.  This module provides two small helper functions to work with
+either file::
 
     from lib.indexer import load_index, query_char
 
     index = load_index('./index')
     hits = query_char('李', index)
 
+``load_index(index_dir, mmap=True)`` maps ``char_index.bin`` into memory
+instead of reading it.  Opening the index then costs the same whatever the
+corpus size, only the postings of characters that are actually queried are
+paged in, and several processes searching the same index share one copy in
+the page cache.
+
+A binary build is stored as immutable segments, ``segments/<name>/`` each
+holding a ``char_index.bin`` and a ``docs.bin``, listed oldest first in
+``manifest.json``.  An incremental update adds a segment and records the
+work ids it replaces as deleted from the older ones; ``load_index`` then
+returns a :class:`SegmentedIndex` that merges the live postings of every
+segment.  :mod:`lib.segments` merges segments back together.
+
+Each segment also has a ``paragraphs.bin`` forward index listing the
+distinct characters of every paragraph, and optionally a ``cooccur.bin``
+table of the characters most often found together (see :mod:`lib.cooccur`),
+and ``bitmaps.bin``, the paragraphs containing each character, which
+:mod:`lib.query` combines for boolean queries.  Builds with
+``--phrase-index`` add ``bigrams.bin`` for phrase search (see
+:mod:`lib.phrases`).
+
 Each element returned from ``query_char`` is a dictionary describing one
 occurrence of the character. The structure matches what is written by the
 preprocessing script (``work_id``, ``type``, ``paragraph`` etc.).
@@ -17,18 +40,499 @@ preprocessing script (``work_id``, ``type``, ``paragraph`` etc.).
 
 from __future__ import annotations
 
+import heapq
 import json
+import mmap as _mmap
 import os
-from typing import Dict, List, Any
+from array import array
+from bisect import bisect_left, bisect_right
+from itertools import accumulate, groupby
+from typing import Callable, Collection, Dict, Iterator, Any, List, Mapping, Sequence, Set, Tuple
+
+import numpy as np
+
+from lib.bitmaps import ALL_KEY, TYPE_KEY, decode, encode
+from lib.phrases import Matches, bigrams, match_phrase, phrase_chars
+from lib.postings import Postings, PostingsBuilder, PostingsFile
+from lib.variants import fold_text
+
+BINARY_INDEX = 'char_index.bin'
+JSON_INDEX = 'char_index.json'
+MANIFEST = 'manifest.json'
+MANIFEST_VERSION = 2
+#: Directory holding the segments listed in the manifest.
+SEGMENTS = 'segments'
+
+#: Columns stored for every character occurrence, in file order.
+COLUMNS = ('work_id', 'type', 'paragraph', 'line', 'pos', 'tone')
+#: Columns whose values are strings interned into a table.
+TABLES = ('work_id', 'type')
+#: Values of the ``type`` column.
+SOURCE_TYPES = ('poetry', 'ci')
+#: Columns the postings of a character are partitioned by, see :mod:`lib.postings`.
+PARTITIONS = ('type', 'tone')
+#: Column of folded indexes holding the code point of the character as written.
+SURFACE = 'surface'
+
+#: Forward index from work id to the distinct characters of each paragraph.
+PARAGRAPHS = 'paragraphs.bin'
+PARAGRAPH_COLUMNS = ('paragraph', 'char')
+#: Optional table of the characters sharing the most paragraphs with each character.
+COOCCUR = 'cooccur.bin'
+COOCCUR_COLUMNS = ('rank', 'char', 'count')
+#: Paragraphs containing each character and of each source type, see :mod:`lib.bitmaps`.
+BITMAPS = 'bitmaps.bin'
+#: Optional positional bigram index for phrase search, see :mod:`lib.phrases`.
+PHRASES = 'bigrams.bin'
+
+
+def new_builder(fold: bool = False) -> PostingsBuilder:
+    """Return an empty index builder with the source types interned in a fixed order.
+
+    Type ids then do not depend on which file is read first, which keeps
+    sharded, incremental and compacted builds identical to a full serial one.
+    Rows are partitioned by source type and tone.  With ``fold`` the rows
+    also store and are partitioned by the ``surface`` form of the character,
+    see :mod:`lib.variants`.
+    """
+    extra = (SURFACE,) if fold else ()
+    builder = PostingsBuilder(COLUMNS + extra, tables=TABLES, partitions=PARTITIONS + extra)
+    for entry_type in SOURCE_TYPES:
+        builder.intern('type', entry_type)
+    return builder
+
+
+def read_manifest(index_dir: str) -> Dict[str, Any] | None:
+    """Return the parsed ``manifest.json`` of ``index_dir``, or ``None``."""
+    path = os.path.join(index_dir, MANIFEST)
+    if not os.path.exists(path):
+        return None
+    with open(path, 'r', encoding='utf-8') as fh:
+        return json.load(fh)
+
+
+def segment_dir(index_dir: str, name: str) -> str:
+    """Return the directory of segment ``name``."""
+    return os.path.join(index_dir, SEGMENTS, name)
+
+
+def _read_postings(path: str, mmap: bool = False) -> PostingsFile:
+    with open(path, 'rb') as fh:
+        if mmap:
+            buf = _mmap.mmap(fh.fileno(), 0, access=_mmap.ACCESS_READ)
+        else:
+            buf = fh.read()
+    return PostingsFile(buf)
+
+
+class BinaryIndex(Mapping[str, Postings]):
+    """Read-only mapping from character to the postings in ``char_index.bin``.
+
+    ``paragraphs``, ``cooccur``, ``bitmaps`` and ``phrases`` are the forward
+    index, co-occurrence table, paragraph sets and bigram index written next
+    to it, when the build produced them.
+    """
+
+    def __init__(self, postings: PostingsFile, paragraphs: PostingsFile | None = None,
+                 cooccur: PostingsFile | None = None, bitmaps: PostingsFile | None = None,
+                 phrases: PostingsFile | None = None) -> None:
+        self.postings = postings
+        self.paragraphs = paragraphs
+        self.cooccur = cooccur
+        self.bitmaps = bitmaps
+        self.phrases = phrases
+        self._paragraph_pairs: np.ndarray | None = None
+
+    @classmethod
+    def open(cls, path: str, mmap: bool = False) -> 'BinaryIndex':
+        """Open ``path``, reading it into memory or mapping it with ``mmap``.
+
+        ``paragraphs.bin``, ``cooccur.bin``, ``bitmaps.bin`` and
+        ``bigrams.bin`` in the same directory are opened as well.
+        """
+        folder = os.path.dirname(path)
+        extra = [
+            _read_postings(os.path.join(folder, name), mmap)
+            if os.path.exists(os.path.join(folder, name)) else None
+            for name in (PARAGRAPHS, COOCCUR, BITMAPS, PHRASES)
+        ]
+        return cls(_read_postings(path, mmap), *extra)
+
+    @property
+    def folded(self) -> bool:
+        """Whether variants are indexed under their canonical character."""
+        return SURFACE in self.postings.columns
+
+    @property
+    def has_paragraphs(self) -> bool:
+        """Whether :meth:`paragraph_chars` can answer without a full scan."""
+        return self.paragraphs is not None
+
+    def paragraph_chars(self, work_id: str, paragraph: int) -> List[str]:
+        """Return the distinct characters of one paragraph of ``work_id``."""
+        if self.paragraphs is None or work_id not in self.paragraphs:
+            return []
+        view = self.paragraphs[work_id]
+        numbers = view.column('paragraph')
+        lo = bisect_left(numbers, paragraph)
+        hi = bisect_right(numbers, paragraph, lo)
+        return [chr(code) for code in view.column('char')[lo:hi]]
+
+    def cooccurring(self, char: str) -> List[Tuple[str, int]] | None:
+        """Return the most frequent paragraph neighbours of ``char`` with their counts.
+
+        Best first, as stored in ``cooccur.bin``; ``None`` when the index
+        has no such table.
+        """
+        if self.cooccur is None:
+            return None
+        if char not in self.cooccur:
+            return []
+        view = self.cooccur[char]
+        return [(chr(code), count) for code, count in zip(view.column('char'), view.column('count'))]
+
+    @property
+    def has_bitmaps(self) -> bool:
+        """Whether the paragraph sets used by :mod:`lib.query` are available."""
+        return self.bitmaps is not None
+
+    def _all_paragraphs(self) -> np.ndarray:
+        if self._paragraph_pairs is None:
+            self._paragraph_pairs = (encode(self.bitmaps[ALL_KEY])
+                                     if self.bitmaps is not None and ALL_KEY in self.bitmaps
+                                     else np.zeros(0, dtype=np.int64))
+        return self._paragraph_pairs
+
+    def _bitmap(self, key: str) -> Sequence[int]:
+        if self.bitmaps is None or key not in self.bitmaps:
+            return ()
+        return np.searchsorted(self._all_paragraphs(), encode(self.bitmaps[key]))
+
+    def char_paragraphs(self, char: str) -> Sequence[int]:
+        """Return the sorted ids of the paragraphs containing ``char``."""
+        return self._bitmap(char)
+
+    def source_paragraphs(self, source: str) -> Sequence[int]:
+        """Return the sorted ids of the paragraphs of source type ``source``."""
+        return self._bitmap(f'{TYPE_KEY}{source}')
+
+    def paragraph_works(self) -> Sequence[int]:
+        """Return the work number of every paragraph id."""
+        return decode(self._all_paragraphs())[0]
+
+    def paragraph_numbers(self) -> Sequence[int]:
+        """Return the paragraph number of every paragraph id."""
+        return decode(self._all_paragraphs())[1]
+
+    def live_paragraphs(self) -> Sequence[int]:
+        """Return the ids of every paragraph."""
+        return range(len(self.paragraph_works()))
+
+    def work_name(self, number: int) -> str:
+        """Return the work id numbered ``number``."""
+        return self.postings.tables['work_id'][number]
+
+    @property
+    def has_phrases(self) -> bool:
+        """Whether the bigram index used by :meth:`find_phrase` is available."""
+        return self.phrases is not None
+
+    def phrase_matches(self, chars: str, loose: bool = False,
+                       source: Collection[str] = ()) -> Matches:
+        """Return the work numbers, paragraphs, lines and positions where ``chars`` start.
+
+        ``chars`` holds no punctuation, see :func:`lib.phrases.phrase_chars`.
+        """
+        if len(chars) == 1:
+            view = self.postings[chars] if chars in self.postings else None
+            found = [np.asarray(view.column(name) if view is not None else (), dtype=np.int64)
+                     for name in ('work_id', 'paragraph', 'line', 'pos')]
+            order = np.lexsort(found[::-1])
+            works, paragraphs, lines, positions = (column[order] for column in found)
+        elif self.phrases is None:
+            raise ValueError('phrase search needs an index built with --phrase-index')
+        else:
+            works, paragraphs, lines, positions = match_phrase(self.phrases, bigrams(chars), loose)
+        if source:
+            if self.bitmaps is None:
+                raise ValueError('phrase search by source needs bitmaps.bin; '
+                                 'rebuild it with preprocess.py')
+            pairs = (works << 32) | paragraphs
+            allowed = [encode(self.bitmaps[f'{TYPE_KEY}{src}']) for src in source
+                       if f'{TYPE_KEY}{src}' in self.bitmaps]
+            keep = np.isin(pairs, np.concatenate(allowed) if allowed else pairs[:0])
+            works, paragraphs, lines, positions = (works[keep], paragraphs[keep], lines[keep],
+                                                   positions[keep])
+        return works, paragraphs, lines, positions
+
+    def find_phrase(self, text: str, loose: bool = False,
+                    source: Collection[str] = ()) -> Iterator[Tuple[str, int, int, int]]:
+        """Yield ``(work_id, paragraph, line, pos)`` of the first character of each match."""
+        chars = fold_text(phrase_chars(text)) if self.folded else phrase_chars(text)
+        if not chars:
+            raise ValueError('the phrase has no characters')
+        for work, paragraph, line, pos in zip(*(column.tolist() for column in
+                                                self.phrase_matches(chars, loose, source))):
+            yield self.work_name(work), paragraph, line, pos
+
+    def __getitem__(self, char: str) -> Postings:
+        return self.postings[char]
+
+    def __contains__(self, char: object) -> bool:
+        return char in self.postings
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.postings)
+
+    def __len__(self) -> int:
+        return len(self.postings)
+
+
+class SegmentPostings(Sequence[Dict[str, Any]]):
+    """Live postings of one character gathered from several segments.
+
+    ``parts`` holds one ``(postings, works, live)`` triple per segment:
+    the segment's :class:`Postings`, the index-wide number of each of the
+    segment's work ids and the positions of its live rows (``None`` when no
+    row was deleted).
+    """
+
+    def __init__(self, parts: List[Tuple[Postings, Sequence[int], List[int] | None]]) -> None:
+        self.parts = parts
+        self._ends = list(accumulate(
+            len(postings) if live is None else len(live) for postings, _, live in parts
+        ))
+
+    def __len__(self) -> int:
+        return self._ends[-1] if self._ends else 0
+
+    def __getitem__(self, idx):  # type: ignore[override]
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        part = bisect_right(self._ends, idx)
+        postings, _, live = self.parts[part]
+        if part:
+            idx -= self._ends[part - 1]
+        return postings[idx if live is None else live[idx]]
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, (str, bytes)):
+            return list(self) == list(other)
+        return NotImplemented
+
+
+class SegmentedIndex(Mapping[str, Sequence[Dict[str, Any]]]):
+    """Read-only mapping that merges the postings of the segments of an index.
+
+    ``segments`` lists ``(index, deleted work ids)`` pairs oldest first,
+    ``index`` being the :class:`BinaryIndex` of a segment.  Rows of deleted
+    works are skipped.  Work ids are numbered index-wide in
+    segment order so that keys from different segments compare consistently
+    in :func:`lib.matcher.sorted_keys`.
+    """
+
+    def __init__(self, segments: Sequence[Tuple[BinaryIndex, Collection[str]]]) -> None:
+        self.indexes = [index for index, _ in segments]
+        self.segments = [(index.postings, frozenset(deleted)) for index, deleted in segments]
+        self._works: List[Tuple[array, Set[int]]] | None = None
+        self._names: List[str] = []
+        self._paragraphs: Tuple[List[int], np.ndarray, np.ndarray, np.ndarray] | None = None
+
+    @classmethod
+    def open(cls, index_dir: str, manifest: Dict[str, Any], mmap: bool = False) -> 'SegmentedIndex':
+        """Open the segments listed in ``manifest``."""
+        return cls([
+            (BinaryIndex.open(os.path.join(segment_dir(index_dir, segment['name']), BINARY_INDEX),
+                              mmap=mmap),
+             segment['deleted'])
+            for segment in manifest['segments']
+        ])
+
+    def _work_ids(self) -> List[Tuple[array, Set[int]]]:
+        """Return the index-wide work numbers and deleted work ids of every segment."""
+        if self._works is None:
+            numbers: Dict[str, int] = {}
+            self._works = []
+            for postings, deleted in self.segments:
+                works = array('I')
+                dead = set()
+                for idx, name in enumerate(postings.tables['work_id']):
+                    if name not in numbers:
+                        numbers[name] = len(numbers)
+                        self._names.append(name)
+                    works.append(numbers[name])
+                    if name in deleted:
+                        dead.add(idx)
+                self._works.append((works, dead))
+        return self._works
+
+    def __getitem__(self, char: str) -> Sequence[Dict[str, Any]]:
+        if len(self.segments) == 1 and not self.segments[0][1]:
+            return self.segments[0][0][char]
+        parts = []
+        for (postings, _), (works, dead) in zip(self.segments, self._work_ids()):
+            if char not in postings:
+                continue
+            view = postings[char]
+            live = None
+            if dead:
+                live = [row for row, work in enumerate(view.column('work_id')) if work not in dead]
+                if not live:
+                    continue
+                if len(live) == len(view):
+                    live = None
+            parts.append((view, works, live))
+        if not parts:
+            raise KeyError(char)
+        return SegmentPostings(parts)
+
+    def __iter__(self) -> Iterator[str]:
+        if len(self.segments) == 1 and not self.segments[0][1]:
+            yield from self.segments[0][0]
+            return
+        keys = heapq.merge(*(postings.keys for postings, _ in self.segments))
+        for char, _ in groupby(keys):
+            if char in self:
+                yield char
+
+    def __len__(self) -> int:
+        return sum(1 for _ in self)
+
+    @property
+    def folded(self) -> bool:
+        """Whether variants are indexed under their canonical character."""
+        return bool(self.indexes) and all(index.folded for index in self.indexes)
+
+    @property
+    def has_paragraphs(self) -> bool:
+        """Whether every segment has a forward index."""
+        return all(index.has_paragraphs for index in self.indexes)
+
+    def paragraph_chars(self, work_id: str, paragraph: int) -> List[str]:
+        """Return the distinct characters of one paragraph of ``work_id``."""
+        chars: Set[str] = set()
+        for index, (_, deleted) in zip(self.indexes, self.segments):
+            if work_id not in deleted:
+                chars.update(index.paragraph_chars(work_id, paragraph))
+        return sorted(chars)
+
+    def cooccurring(self, char: str) -> List[Tuple[str, int]] | None:
+        """Return the co-occurrence table entry of ``char``, see :meth:`BinaryIndex.cooccurring`.
+
+        Only a single segment without deletions has exact counts; the
+        counts of several segments cannot be combined into a top list, so
+        ``None`` is returned then.
+        """
+        if len(self.indexes) == 1 and not self.segments[0][1]:
+            return self.indexes[0].cooccurring(char)
+        return None
+
+    @property
+    def has_bitmaps(self) -> bool:
+        """Whether every segment has the paragraph sets used by :mod:`lib.query`."""
+        return all(index.has_bitmaps for index in self.indexes)
+
+    def _paragraph_table(self) -> Tuple[List[int], np.ndarray, np.ndarray, np.ndarray]:
+        """Return the first paragraph id of every segment and the index-wide table.
+
+        Paragraph ids are numbered index-wide in segment order.  The table
+        holds the work number and paragraph number of every paragraph id
+        and the ids of the paragraphs of live works.
+        """
+        if self._paragraphs is None:
+            offsets, works, numbers, live = [], [], [], []
+            offset = 0
+            for index, (segment_works, dead) in zip(self.indexes, self._work_ids()):
+                local = np.asarray(index.paragraph_works(), dtype=np.int64)
+                offsets.append(offset)
+                works.append(np.asarray(segment_works, dtype=np.int64)[local])
+                numbers.append(np.asarray(index.paragraph_numbers(), dtype=np.int64))
+                alive = ~np.isin(local, list(dead)) if dead else np.ones(len(local), dtype=bool)
+                live.append(offset + np.flatnonzero(alive))
+                offset += len(local)
+            empty = np.zeros(0, dtype=np.int64)
+            self._paragraphs = (offsets, np.concatenate(works or [empty]),
+                                np.concatenate(numbers or [empty]), np.concatenate(live or [empty]))
+        return self._paragraphs
+
+    def _global_paragraphs(self, local: Callable[[BinaryIndex], Sequence[int]]) -> np.ndarray:
+        offsets = self._paragraph_table()[0]
+        found = [offset + np.asarray(local(index), dtype=np.int64)
+                 for offset, index in zip(offsets, self.indexes)]
+        return np.concatenate(found) if found else np.zeros(0, dtype=np.int64)
+
+    def char_paragraphs(self, char: str) -> Sequence[int]:
+        """Return the sorted index-wide ids of the paragraphs containing ``char``."""
+        return self._global_paragraphs(lambda index: index.char_paragraphs(char))
+
+    def source_paragraphs(self, source: str) -> Sequence[int]:
+        """Return the sorted index-wide ids of the paragraphs of type ``source``."""
+        return self._global_paragraphs(lambda index: index.source_paragraphs(source))
+
+    def paragraph_works(self) -> Sequence[int]:
+        """Return the index-wide work number of every paragraph id."""
+        return self._paragraph_table()[1]
+
+    def paragraph_numbers(self) -> Sequence[int]:
+        """Return the paragraph number of every paragraph id."""
+        return self._paragraph_table()[2]
+
+    def live_paragraphs(self) -> Sequence[int]:
+        """Return the ids of the paragraphs of live works."""
+        return self._paragraph_table()[3]
+
+    def work_name(self, number: int) -> str:
+        """Return the work id numbered ``number``."""
+        self._work_ids()
+        return self._names[number]
+
+    @property
+    def has_phrases(self) -> bool:
+        """Whether every segment has a bigram index."""
+        return all(index.has_phrases for index in self.indexes)
+
+    def find_phrase(self, text: str, loose: bool = False,
+                    source: Collection[str] = ()) -> Iterator[Tuple[str, int, int, int]]:
+        """Yield the matches of a phrase in live works, see :meth:`BinaryIndex.find_phrase`."""
+        chars = fold_text(phrase_chars(text)) if self.folded else phrase_chars(text)
+        if not chars:
+            raise ValueError('the phrase has no characters')
+        found = []
+        for index, (works, dead) in zip(self.indexes, self._work_ids()):
+            local, paragraphs, lines, positions = index.phrase_matches(chars, loose, source)
+            if dead:
+                keep = ~np.isin(local, list(dead))
+                local, paragraphs, lines, positions = (local[keep], paragraphs[keep],
+                                                       lines[keep], positions[keep])
+            found.extend(zip(np.asarray(works, dtype=np.int64)[local].tolist(),
+                             paragraphs.tolist(), lines.tolist(), positions.tolist()))
+        for work, paragraph, line, pos in sorted(set(found)):
+            yield self._names[work], paragraph, line, pos
+
 
+def load_index(index_dir: str, mmap: bool = False) -> Mapping[str, Sequence[Dict[str, Any]]]:
+    """Load the character index from ``index_dir``.
 
-def load_index(index_dir: str) -> Dict[str, List[Dict[str, Any]]]:
-    """Load ``char_index.json`` from ``index_dir`` and return the data."""
-    index_path = os.path.join(index_dir, 'char_index.json')
+    The segments listed in ``manifest.json`` are preferred, then a single
+    ``char_index.bin``; with ``mmap=True`` binary files are memory-mapped
+    and decoded lazily.  Otherwise the JSON export ``char_index.json`` is
+    parsed into a plain dictionary.
+    """
+    manifest = read_manifest(index_dir)
+    if manifest is not None and manifest.get('segments'):
+        return SegmentedIndex.open(index_dir, manifest, mmap=mmap)
+    binary_path = os.path.join(index_dir, BINARY_INDEX)
+    if os.path.exists(binary_path):
+        return BinaryIndex.open(binary_path, mmap=mmap)
+    index_path = os.path.join(index_dir, JSON_INDEX)
     with open(index_path, 'r', encoding='utf-8') as fh:
         return json.load(fh)
 
 
-def query_char(char: str, index: Dict[str, List[Dict[str, Any]]]) -> List[Dict[str, Any]]:
+def query_char(char: str, index: Mapping[str, Sequence[Dict[str, Any]]]) -> Sequence[Dict[str, Any]]:
     """Return the list of occurrences for ``char`` from the loaded index."""
     return index.get(char, [])
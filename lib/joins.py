@@ -0,0 +1,225 @@
+"""Join the texts, prosody and popularity of every poem by work id.
+
+``全唐诗/`` and ``宋词/`` hold the texts, ``strains/json/`` the level and
+oblique tones of the poet shards and ``rank/`` the search engine counts of
+every shard.  :func:`build_join` scans them once and writes ``join.bin``, a
+map from work id to the byte span of each part in its shard::
+
+    from lib.joins import open_join
+
+    join = open_join('.', './index/join.bin')
+    join.get('08e41396-2809-423d-9bbc-1e6fb24c0ca1')
+    # {'title': ..., 'paragraphs': [...], 'strains': [...], 'rank': {...}}
+
+A lookup is a binary search over the memory-mapped ids followed by one
+read per part, so no shard is parsed to answer it.  Strains records carry
+the work id and are matched by it.  Rank records carry none: the record at
+the same position in the matching ``rank`` shard is used when its author
+and title agree, otherwise the first one in the shard that does.  Ci have
+no id and get the ``<shard>-<n>`` ids of ``preprocess.py``.
+"""
+
+from __future__ import annotations
+
+import functools
+import glob
+import json
+import mmap
+import os
+from array import array
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from lib.corpusdb import companions, rank_key
+from lib.postings import (StringTable, find_string, read_sections, string_sections,
+                          write_sections)
+
+JOIN = 'join.bin'
+MAGIC = b'CPJOIN\x00\x01'
+VERSION = 1
+
+#: Text shards joined, relative to the corpus root.
+TEXTS = ('全唐诗/poet.*.json', '宋词/ci.song.*.json')
+
+#: The parts of a joined record, each a ``(file, offset, size)`` span.
+PARTS = ('text', 'strains', 'rank')
+
+#: Columns of ``join.bin``: the file, offset and size of each part.
+COLUMNS = tuple((f'{part}.{field}', code) for part in PARTS
+                for field, code in (('file', 'I'), ('offset', 'Q'), ('size', 'I')))
+
+#: Span of a part a work does not have.
+_MISSING = 0xFFFFFFFF
+
+Span = Tuple[str, int, int]
+
+
+def array_spans(path: str) -> Iterator[Tuple[int, int, Any]]:
+    """Yield ``(byte offset, byte size, element)`` of each element of a JSON array file."""
+
+    with open(path, 'rb') as fh:
+        text = fh.read().decode('utf-8')
+    decoder = json.JSONDecoder()
+    pos = text.index('[') + 1
+    chars = byte = 0
+    while True:
+        while text[pos] in ' \t\r\n,':
+            pos += 1
+        if text[pos] == ']':
+            return
+        value, end = decoder.raw_decode(text, pos)
+        byte += len(text[chars:pos].encode('utf-8'))
+        size = len(text[pos:end].encode('utf-8'))
+        yield byte, size, value
+        byte += size
+        chars = pos = end
+
+
+def _shards(root: str) -> List[str]:
+    return sorted(path for pattern in TEXTS for path in glob.glob(os.path.join(root, pattern)))
+
+
+def build_join(root: str, path: str) -> int:
+    """Write the join of the shards under ``root`` to ``path``; return the works joined."""
+
+    files: Dict[str, int] = {}
+
+    def file_id(name: str) -> int:
+        return files.setdefault(os.path.relpath(name, root), len(files))
+
+    strains: Dict[str, Tuple[int, int, int]] = {}
+    for name in sorted(glob.glob(os.path.join(root, 'strains', 'json', '*.json'))):
+        for offset, size, record in array_spans(name):
+            if isinstance(record, dict) and record.get('id'):
+                strains.setdefault(record['id'], (file_id(name), offset, size))
+
+    rows: Dict[str, Tuple[int, ...]] = {}
+    sources: Dict[str, Tuple[int, int]] = {}
+    for shard in _shards(root):
+        _, rank_path = companions(root, shard)
+        ranks = list(array_spans(rank_path)) if rank_path else []
+        by_key: Dict[Tuple[Any, Any], List[int]] = {}
+        for idx, (_, _, record) in enumerate(ranks):
+            by_key.setdefault(rank_key(record), []).append(idx)
+        base = os.path.splitext(os.path.basename(shard))[0]
+        for position, (offset, size, entry) in enumerate(array_spans(shard)):
+            if not isinstance(entry, dict):
+                continue
+            work_id = entry.get('id') or entry.get('uuid') or f'{base}-{position + 1}'
+            if work_id in rows:
+                continue
+            row = (file_id(shard), offset, size)
+            row += strains.get(entry.get('id') or work_id, (_MISSING, 0, 0))
+            key = rank_key(entry)
+            if position < len(ranks) and rank_key(ranks[position][2]) == key:
+                match = position
+            else:
+                match = (by_key.get(key) or [None])[0]
+            row += (_MISSING, 0, 0) if match is None else (file_id(rank_path),) + ranks[match][:2]
+            rows[work_id] = row
+    for name in files:
+        stat = os.stat(os.path.join(root, name))
+        sources[name] = (stat.st_size, stat.st_mtime_ns)
+
+    keys = sorted(rows)
+    names = sorted(files, key=files.__getitem__)
+    sections = string_sections('keys', keys) + string_sections('files', names)
+    for idx, (name, code) in enumerate(COLUMNS):
+        sections.append((name, array(code, (rows[key][idx] for key in keys))))
+    header = {'version': VERSION, 'works': len(keys),
+              'sources': {name: list(stat) for name, stat in sources.items()}}
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    write_sections(path, MAGIC, header, sections)
+    return len(keys)
+
+
+class PoemJoin:
+    """Look up joined poem records from a ``join.bin`` buffer."""
+
+    def __init__(self, buf, root: str, cache_size: int = 1024) -> None:
+        header, sections = read_sections(buf, MAGIC, VERSION)
+        self.header = header
+        self.root = root
+        self.keys = StringTable(sections['keys.offsets'], sections['keys.blob'])
+        self.files = StringTable(sections['files.offsets'], sections['files.blob'])
+        self._sections = sections
+        self.get = functools.lru_cache(maxsize=cache_size)(self._get)
+
+    @classmethod
+    def open(cls, root: str, path: str, cache_size: int = 1024) -> 'PoemJoin':
+        with open(path, 'rb') as fh:
+            buf = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        return cls(buf, root, cache_size)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, work_id: object) -> bool:
+        return isinstance(work_id, str) and find_string(self.keys, work_id) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys)
+
+    def stale(self) -> bool:
+        """Return whether a joined file changed, or a shard was added, since the build."""
+        sources = self.header['sources']
+        if any(os.path.relpath(shard, self.root) not in sources for shard in _shards(self.root)):
+            return True
+        for name, (size, mtime_ns) in sources.items():
+            try:
+                stat = os.stat(os.path.join(self.root, name))
+            except OSError:
+                return True
+            if (stat.st_size, stat.st_mtime_ns) != (size, mtime_ns):
+                return True
+        return False
+
+    def locate(self, work_id: str) -> Dict[str, Span | None]:
+        """Return the ``(file, offset, size)`` of each part of ``work_id``.
+
+        Raises ``KeyError`` for an unknown work id.
+        """
+        idx = find_string(self.keys, work_id)
+        if idx < 0:
+            raise KeyError(work_id)
+        spans: Dict[str, Span | None] = {}
+        for part in PARTS:
+            file = self._sections[f'{part}.file'][idx]
+            spans[part] = None if file == _MISSING else (
+                self.files[file], self._sections[f'{part}.offset'][idx],
+                self._sections[f'{part}.size'][idx])
+        return spans
+
+    def read(self, span: Span) -> Any:
+        """Decode the JSON value stored at ``span``."""
+        name, offset, size = span
+        with open(os.path.join(self.root, name), 'rb') as fh:
+            fh.seek(offset)
+            return json.loads(fh.read(size))
+
+    def _get(self, work_id: str) -> Dict[str, Any] | None:
+        try:
+            spans = self.locate(work_id)
+        except KeyError:
+            return None
+        record = dict(self.read(spans['text']))
+        if spans['strains'] is not None:
+            record['strains'] = self.read(spans['strains']).get('strains')
+        if spans['rank'] is not None:
+            record['rank'] = self.read(spans['rank'])
+        return record
+
+    def records(self, work_ids: Sequence[str]) -> Iterator[Dict[str, Any] | None]:
+        """Yield the joined record of each of ``work_ids``."""
+        for work_id in work_ids:
+            yield self.get(work_id)
+
+
+def open_join(root: str, path: str) -> PoemJoin:
+    """Open the join at ``path``, building it first if it is missing or stale."""
+
+    if os.path.exists(path):
+        join = PoemJoin.open(root, path)
+        if not join.stale():
+            return join
+    build_join(root, path)
+    return PoemJoin.open(root, path)
@@ -0,0 +1,129 @@
+"""Read the entries of large JSON array files one at a time.
+
+The corpus files are JSON arrays of poems, some of them hundreds of
+megabytes.  :func:`iter_array` yields their elements in order while holding
+only a window of the text and the current element in memory, so reading a
+whole dataset takes the same memory whatever its size::
+
+    from lib.jsonstream import iter_array
+
+    for poem in iter_array('./全唐诗/poet.tang.0.json'):
+        print(poem['title'])
+
+Each element is decoded by the standard library's ``JSONDecoder.raw_decode``
+from a buffer refilled in chunks; an element larger than the buffer grows
+the next read until it fits.
+"""
+
+from __future__ import annotations
+
+import json
+import re
+from typing import Any, Iterator, List, TextIO
+
+#: Characters read from the file at a time.
+CHUNK_SIZE = 1 << 16
+
+_WHITESPACE = re.compile(r'[ \t\n\r]*')
+_NUMBER = '0123456789+-.eE'
+
+
+class NotAnArray(ValueError):
+    """The file does not hold a JSON array."""
+
+
+class _Reader:
+    """Sliding window over a text file."""
+
+    def __init__(self, fh: TextIO, chunk_size: int) -> None:
+        self.fh = fh
+        self.chunk_size = chunk_size
+        self.buf = ''
+        self.pos = 0
+        self.eof = False
+
+    def fill(self, size: int) -> bool:
+        """Read ``size`` more characters, dropping consumed ones; ``False`` at the end."""
+        chunk = self.fh.read(size)
+        self.buf = self.buf[self.pos:] + chunk
+        self.pos = 0
+        self.eof = not chunk
+        return bool(chunk)
+
+    def peek(self) -> str:
+        """Return the next character that is not whitespace, ``''`` at the end."""
+        while True:
+            self.pos = _WHITESPACE.match(self.buf, self.pos).end()
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+            if not self.fill(self.chunk_size):
+                return ''
+
+    def value(self, decoder: json.JSONDecoder) -> Any:
+        """Decode the value starting at the current position."""
+        size = self.chunk_size
+        while True:
+            try:
+                value, end = decoder.raw_decode(self.buf, self.pos)
+            except json.JSONDecodeError:
+                if self.eof or not self.fill(size):
+                    raise
+                size *= 2
+                continue
+            # a number may continue in the next chunk
+            number = isinstance(value, (int, float)) and not isinstance(value, bool)
+            if not self.eof and (end == len(self.buf)
+                                 or number and not self.buf[end:].strip(_NUMBER)):
+                self.fill(size)
+                continue
+            self.pos = end
+            return value
+
+
+def iter_array(source: str | TextIO, chunk_size: int = CHUNK_SIZE) -> Iterator[Any]:
+    """Yield the elements of the JSON array in ``source``, a path or text file.
+
+    Raises :class:`NotAnArray` if the file holds another JSON value and
+    ``json.JSONDecodeError`` on malformed input, after yielding the
+    elements before the error.
+    """
+
+    if isinstance(source, str):
+        with open(source, 'r', encoding='utf-8') as fh:
+            yield from iter_array(fh, chunk_size)
+        return
+
+    reader = _Reader(source, chunk_size)
+    decoder = json.JSONDecoder()
+    if reader.peek() != '[':
+        raise NotAnArray(f'{getattr(source, "name", "input")} is not a JSON array')
+    reader.pos += 1
+    if reader.peek() == ']':
+        return
+    while True:
+        reader.peek()
+        yield reader.value(decoder)
+        sep = reader.peek()
+        if sep == ']':
+            return
+        if sep != ',':
+            raise json.JSONDecodeError("Expecting ',' delimiter", reader.buf, reader.pos)
+        reader.pos += 1
+
+
+def entry_lines(entry: Any, tag: str) -> List[str] | None:
+    """Return the ``tag`` lines of a corpus entry, or ``None`` to skip it.
+
+    A string is a single line.  Entries that are not objects holding a string
+    or a list under ``tag`` are skipped, and so not counted as poems, by the
+    files, the cache and the database alike.
+    """
+
+    if not isinstance(entry, dict):
+        return None
+    lines = entry.get(tag)
+    if isinstance(lines, str):
+        return [lines]
+    if not isinstance(lines, list):
+        return None
+    return [line for line in lines if isinstance(line, str)]
@@ -0,0 +1,270 @@
+"""Match occurrences of two characters under a distance constraint.
+
+Both postings lists are turned into sorted ``(work, paragraph, line, pos)``
+keys.  Every distance level compares a prefix of that key (``work`` for
+``work``, ``work, paragraph`` for ``paragraph`` and so on), so matching is a
+merge over the two sorted lists: groups with equal prefixes are located with
+binary searches and only pairs inside the same group are produced::
+
+    from lib.matcher import merge_join, sorted_keys
+
+    keys2, rows2 = sorted_keys(index['明'])
+    keys3, rows3 = sorted_keys(index['月'])
+    for i, j in merge_join(keys2, keys3, 'adjacent', reversible=False):
+        print(index['明'][rows2[i]], index['月'][rows3[j]])
+
+:func:`in_distance` and :func:`occurs_before` are the pairwise predicates
+that the merge reproduces; they are kept for tests and benchmarks.
+"""
+
+from __future__ import annotations
+
+from bisect import bisect_left, bisect_right
+from itertools import islice, repeat
+from typing import Any, Collection, Dict, Iterator, List, Sequence, Tuple
+
+from lib.indexer import SegmentPostings
+from lib.postings import Postings
+
+Key = Tuple[Any, int, int, int]
+
+#: Number of leading key fields that must be equal for each distance level.
+PREFIX = {'work': 1, 'paragraph': 2, 'sentence': 3, 'adjacent': 3}
+
+_END = float('inf')
+
+
+def in_distance(o2: dict, o3: dict, dist: str | None) -> bool:
+    """Return whether two occurrences satisfy the distance constraint."""
+    if dist == 'adjacent':
+        return (
+            o2['work_id'] == o3['work_id']
+            and o2['paragraph'] == o3['paragraph']
+            and o2['line'] == o3['line']
+            and abs(o2['pos'] - o3['pos']) == 1
+        )
+    if dist == 'sentence':
+        return (
+            o2['work_id'] == o3['work_id']
+            and o2['paragraph'] == o3['paragraph']
+            and o2['line'] == o3['line']
+        )
+    if dist == 'paragraph':
+        return (
+            o2['work_id'] == o3['work_id']
+            and o2['paragraph'] == o3['paragraph']
+        )
+    if dist == 'work':
+        return o2['work_id'] == o3['work_id']
+    return True
+
+
+def occurs_before(a: dict, b: dict) -> bool:
+    """Return whether ``a`` comes before ``b`` inside the same work."""
+    if a['work_id'] != b['work_id']:
+        return False
+    if a['paragraph'] != b['paragraph']:
+        return a['paragraph'] < b['paragraph']
+    if a['line'] != b['line']:
+        return a['line'] < b['line']
+    return a['pos'] < b['pos']
+
+
+def _runs(postings: Postings, part: range, name: str) -> Iterator[range]:
+    """Yield the runs of equal values of column ``name`` inside the sorted range ``part``."""
+    col = postings.column(name)
+    start = part.start
+    while start < part.stop:
+        stop = bisect_right(col, col[start], start, part.stop)
+        yield range(start, stop)
+        start = stop
+
+
+def _narrow(postings: Postings, part: range, name: str, values: Collection[int]) -> List[range]:
+    """Return the ranges of ``part`` where column ``name``, sorted there, holds ``values``."""
+    col = postings.column(name)
+    ranges = []
+    for value in sorted(values):
+        start = bisect_left(col, value, part.start, part.stop)
+        stop = bisect_right(col, value, start, part.stop)
+        if start < stop:
+            ranges.append(range(start, stop))
+    return ranges
+
+
+def partition_rows(postings: Postings, sources: Collection[str] = (),
+                   tones: Collection[int] = (),
+                   surfaces: Collection[str] = ()) -> List[range] | None:
+    """Return the row ranges of ``postings`` holding the wanted sources, tones and surfaces.
+
+    Postings partitioned by ``type`` and ``tone`` give one range per
+    selected partition, found by binary search; ``None`` is returned for
+    filters on unpartitioned files, whose rows have to be tested one by one.
+    ``surfaces`` selects the written forms of a folded index, whose
+    partitions end with the ``surface`` column.
+    """
+    if not sources and not tones and not surfaces:
+        return [range(len(postings))]
+    wanted = ('type', 'tone', 'surface') if surfaces else ('type', 'tone')
+    if postings.partitions[:len(wanted)] != wanted:
+        return None
+    table = postings.table('type')
+    types = [idx for idx in range(len(table)) if not sources or table[idx] in sources]
+    if not tones:
+        ranges = [postings.partition(kind) for kind in types]
+    else:
+        ranges = [postings.partition(kind, tone) for kind in types for tone in sorted(set(tones))]
+    if surfaces:
+        if not tones:
+            ranges = [run for part in ranges for run in _runs(postings, part, 'tone')]
+        codes = {ord(ch) for ch in surfaces}
+        ranges = [run for part in ranges for run in _narrow(postings, part, 'surface', codes)]
+    return ranges
+
+
+def _filtered_rows(postings: Postings, sources: Collection[str], tones: Collection[int],
+                   surfaces: Collection[str] = ()) -> List[int]:
+    """Return the rows of unpartitioned ``postings`` with a wanted source, tone and surface."""
+    table = postings.table('type')
+    wanted = {idx for idx in range(len(table)) if table[idx] in sources}
+    codes = {ord(ch) for ch in surfaces}
+    written = postings.column('surface') if surfaces else repeat(None)
+    return [
+        i for i, (kind, tone, code) in enumerate(zip(postings.column('type'),
+                                                     postings.column('tone'), written))
+        if (not sources or kind in wanted) and (not tones or tone in tones)
+        and (not codes or code in codes)
+    ]
+
+
+def _wanted(occ: Dict[str, Any], sources: Collection[str], tones: Collection[int],
+            surfaces: Collection[str]) -> bool:
+    return ((not sources or occ['type'] in sources) and (not tones or occ['tone'] in tones)
+            and (not surfaces or chr(occ['surface']) in surfaces))
+
+
+def has_rows(occs: Sequence[Dict[str, Any]], sources: Collection[str] = (),
+             tones: Collection[int] = (), surfaces: Collection[str] = ()) -> bool:
+    """Return whether any occurrence in ``occs`` has a wanted source, tone and surface."""
+    if isinstance(occs, Postings):
+        ranges = partition_rows(occs, sources, tones, surfaces)
+        if ranges is not None:
+            return any(ranges)
+        return bool(_filtered_rows(occs, sources, tones, surfaces))
+    if isinstance(occs, SegmentPostings):
+        for postings, _, live in occs.parts:
+            if live is None:
+                if has_rows(postings, sources, tones, surfaces):
+                    return True
+            elif set(_filtered_rows(postings, sources, tones, surfaces)).intersection(live):
+                return True
+        return False
+    return any(_wanted(o, sources, tones, surfaces) for o in occs)
+
+
+def sorted_keys(occs: Sequence[Dict[str, Any]], sources: Collection[str] = (),
+                tones: Collection[int] = (),
+                surfaces: Collection[str] = ()) -> Tuple[List[Key], List[int]]:
+    """Return sorted keys for ``occs`` and the row each key came from.
+
+    Rows whose ``type`` is not in ``sources``, whose ``tone`` is not in
+    ``tones``, or whose ``surface`` is not in ``surfaces``, are dropped when
+    those are given.  Binary postings are read
+    column-wise; when partitioned by source and tone only the selected
+    partitions are read, and the sorted runs they hold are merged.  Postings
+    merged from several segments are read segment by segment and only
+    sorted when a work id occurs in more than one segment.
+    """
+    if isinstance(occs, Postings):
+        cols = [occs.column(name) for name in ('work_id', 'paragraph', 'line', 'pos')]
+        ranges = partition_rows(occs, sources, tones, surfaces)
+        if ranges is None:
+            rows = _filtered_rows(occs, sources, tones, surfaces)
+            keys = list(zip(*([col[i] for i in rows] for col in cols)))
+        else:
+            rows = [i for part in ranges for i in part]
+            keys = [
+                key for part in ranges
+                for key in zip(*(col[part.start:part.stop] for col in cols))
+            ]
+    elif isinstance(occs, SegmentPostings):
+        keys, rows = [], []
+        offset = 0
+        for postings, works, live in occs.parts:
+            part_keys, part_rows = sorted_keys(postings, sources, tones, surfaces)
+            if live is None:
+                size = len(postings)
+            else:
+                position = {row: idx for idx, row in enumerate(live)}
+                size = len(live)
+                pairs = [(key, position[row]) for key, row in zip(part_keys, part_rows)
+                         if row in position]
+                part_keys = [key for key, _ in pairs]
+                part_rows = [row for _, row in pairs]
+            keys.extend((works[work], para, line, pos) for work, para, line, pos in part_keys)
+            rows.extend(offset + row for row in part_rows)
+            offset += size
+    else:
+        rows = [i for i, o in enumerate(occs) if _wanted(o, sources, tones, surfaces)]
+        keys = [
+            (occs[i]['work_id'], occs[i]['paragraph'], occs[i]['line'], occs[i]['pos'])
+            for i in rows
+        ]
+    if any(a > b for a, b in zip(keys, islice(keys, 1, None))):
+        order = sorted(range(len(keys)), key=keys.__getitem__)
+        keys = [keys[i] for i in order]
+        rows = [rows[i] for i in order]
+    return keys, rows
+
+
+def merge_join(keys2: Sequence[Key], keys3: Sequence[Key], dist: str | None,
+               reversible: bool, start: Tuple[int, int] = (0, 0)) -> Iterator[Tuple[int, int]]:
+    """Yield index pairs ``(i, j)`` of matching keys from two sorted lists.
+
+    The pairs are the ones for which :func:`in_distance` holds and, unless
+    ``reversible`` is set, ``keys2[i]`` occurs before ``keys3[j]``.  They are
+    produced in the order a nested loop over ``keys2`` and ``keys3`` would
+    find them, which is increasing ``(i, j)`` order; pairs before ``start``
+    are skipped without being enumerated, so a paused join can be resumed.
+    """
+    width = PREFIX.get(dist, 0)
+    if not width and not reversible:
+        width = 1  # occurs_before already requires the same work
+    n2, n3 = len(keys2), len(keys3)
+    first2, first3 = start
+    i, j = 0, 0
+    if first2:
+        if first2 >= n2:
+            return
+        group = keys2[first2][:width]
+        i = bisect_left(keys2, group)
+        j = bisect_left(keys3, group)
+    while i < n2 and j < n3:
+        group2 = keys2[i][:width]
+        group3 = keys3[j][:width]
+        if group2 < group3:
+            i = bisect_left(keys2, group3, i)
+            continue
+        if group3 < group2:
+            j = bisect_left(keys3, group2, j)
+            continue
+        end2 = bisect_left(keys2, group2 + (_END,), i) if width else n2
+        end3 = bisect_left(keys3, group3 + (_END,), j) if width else n3
+        for a in range(max(i, first2), end2):
+            skip = first3 if a == first2 else 0
+            key = keys2[a]
+            if dist == 'adjacent':
+                work, para, line, pos = key
+                spans = [(work, para, line, pos + 1)]
+                if reversible:
+                    spans.insert(0, (work, para, line, pos - 1))
+                for target in spans:
+                    lo = bisect_left(keys3, target, j, end3)
+                    hi = bisect_right(keys3, target, lo, end3)
+                    for b in range(max(lo, skip), hi):
+                        yield a, b
+            else:
+                lo = j if reversible else bisect_right(keys3, key, j, end3)
+                for b in range(max(lo, skip), end3):
+                    yield a, b
+        i, j = end2, end3
@@ -0,0 +1,128 @@
+"""Positional bigram index for exact phrase search.
+
+``bigrams.bin`` is derived from a segment's ``char_index.bin``.  The
+characters of a paragraph, read line by line with punctuation and spaces
+left out, form its text; every two consecutive characters of that text are
+a bigram, keyed by the two characters, with one
+``(work_id, paragraph, offset, line, pos, gap)`` row per occurrence.
+``offset`` is the position of the first character in the paragraph's text,
+``line``/``pos`` its place in the work, and ``gap`` is 1 when punctuation or
+a line break separates the two characters.
+
+A phrase of ``n`` characters occurs at offset ``o`` when its ``k``-th
+bigram occurs at ``o + k`` for every ``k``, so a search intersects ``n - 1``
+sorted postings lists instead of joining occurrences pair by pair::
+
+    from lib.indexer import load_index
+
+    index = load_index('./index', mmap=True)
+    for work_id, paragraph, line, pos in index.find_phrase('明月光'):
+        ...
+
+Exact phrases must stand on one line without punctuation inside; with
+``loose`` the bigrams may span punctuation and line breaks.
+"""
+
+from __future__ import annotations
+
+import unicodedata
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from lib.postings import PostingsBuilder, PostingsFile
+
+PHRASE_COLUMNS = ('work_id', 'paragraph', 'offset', 'line', 'pos', 'gap')
+
+#: Work numbers, paragraphs, lines and positions of the first character of matches.
+Matches = Tuple[np.ndarray, np.ndarray, np.ndarray, np.ndarray]
+
+
+def is_punctuation(ch: str) -> bool:
+    """Return whether ``ch`` is left out of the text phrases are matched in."""
+    return ch.isspace() or unicodedata.category(ch)[0] in 'PSZ'
+
+
+def phrase_chars(text: str) -> str:
+    """Return the characters of a phrase query, without punctuation and spaces."""
+    return ''.join(ch for ch in text if not is_punctuation(ch))
+
+
+def bigrams(chars: str) -> List[str]:
+    """Return the consecutive character pairs of ``chars``."""
+    return [chars[idx:idx + 2] for idx in range(len(chars) - 1)]
+
+
+def build_phrases(postings: PostingsFile) -> PostingsBuilder:
+    """Return the bigram postings of the text indexed in ``postings``."""
+
+    builder = PostingsBuilder(PHRASE_COLUMNS)
+    chosen = [idx for idx, key in enumerate(postings.keys) if not is_punctuation(key)]
+    if not chosen:
+        return builder
+    keys = [postings.keys[idx] for idx in chosen]
+    chosen = np.array(chosen, dtype=np.int64)
+    starts = np.asarray(postings.starts, dtype=np.int64)
+    lengths = starts[chosen + 1] - starts[chosen]
+    rows = np.concatenate([np.arange(starts[idx], starts[idx + 1]) for idx in chosen])
+    chars = np.repeat(np.arange(len(keys)), lengths)
+    columns = [np.asarray(postings.column(name), dtype=np.int64)[rows]
+               for name in ('work_id', 'paragraph', 'line', 'pos')]
+    order = np.lexsort(columns[::-1])
+    chars = chars[order]
+    works, paragraphs, lines, positions = (column[order] for column in columns)
+
+    # a paragraph's text is a run of rows; offsets count from its first row
+    first = np.ones(len(chars), dtype=bool)
+    first[1:] = (works[1:] != works[:-1]) | (paragraphs[1:] != paragraphs[:-1])
+    run_start = np.maximum.accumulate(np.where(first, np.arange(len(chars)), 0))
+    offsets = np.arange(len(chars)) - run_start
+
+    pair = np.flatnonzero(~first[1:])
+    gaps = ((lines[pair + 1] != lines[pair]) | (positions[pair + 1] != positions[pair] + 1))
+    grams = chars[pair] * len(keys) + chars[pair + 1]
+    order = np.argsort(grams, kind='stable')
+    grams, pair, gaps = grams[order], pair[order], gaps[order]
+    width = len(PHRASE_COLUMNS)
+    values = np.column_stack((works[pair], paragraphs[pair], offsets[pair], lines[pair],
+                              positions[pair], gaps)).ravel().tolist()
+    bounds = np.flatnonzero(np.diff(grams)) + 1
+    lows = np.concatenate(([0], bounds)).tolist()
+    highs = np.concatenate((bounds, [len(grams)])).tolist()
+    for lo, hi in zip(lows, highs):
+        first_char, second_char = divmod(int(grams[lo]), len(keys))
+        builder.extend(keys[first_char] + keys[second_char], values[lo * width:hi * width])
+    return builder
+
+
+def match_phrase(phrases: PostingsFile, grams: Sequence[str], loose: bool = False) -> Matches:
+    """Return the occurrences of the phrase made of ``grams`` in one segment.
+
+    Matches come in ``(work, paragraph, line, pos)`` order of the segment.
+    """
+
+    empty = np.zeros(0, dtype=np.int64)
+    if any(gram not in phrases for gram in grams):
+        return empty, empty, empty, empty
+    views = [phrases[gram] for gram in grams]
+    columns = [{name: np.asarray(view.column(name), dtype=np.int64)
+                for name in ('work_id', 'paragraph', 'offset', 'gap')} for view in views]
+    span = max(int(cols['paragraph'].max()) for cols in columns) + 1
+    width = max(int(cols['offset'].max()) for cols in columns) + 1
+
+    found = None
+    for shift, cols in enumerate(columns):
+        keys = (cols['work_id'] * span + cols['paragraph']) * width + cols['offset'] - shift
+        wanted = cols['offset'] >= shift
+        if not loose:
+            wanted &= cols['gap'] == 0
+        keys = keys[wanted]
+        found = keys if found is None else np.intersect1d(found, keys, assume_unique=True)
+        if not found.size:
+            return empty, empty, empty, empty
+    first = columns[0]
+    keys = (first['work_id'] * span + first['paragraph']) * width + first['offset']
+    rows = np.searchsorted(keys, found)
+    lines = np.asarray(views[0].column('line'), dtype=np.int64)[rows]
+    positions = np.asarray(views[0].column('pos'), dtype=np.int64)[rows]
+    return first['work_id'][rows], first['paragraph'][rows], lines, positions
@@ -0,0 +1,481 @@
+"""Columnar binary container for postings lists.
+
+The JSON character index stores one small dictionary per occurrence, which
+is slow to parse and large on disk.  This module stores the same data as a
+handful of packed integer columns instead::
+
+    from lib.postings import PostingsBuilder, PostingsFile
+
+    builder = PostingsBuilder(['work_id', 'type', 'paragraph', 'line', 'pos', 'tone'],
+                              tables=['work_id', 'type'])
+    work = builder.intern('work_id', 'poem-1')
+    kind = builder.intern('type', 'poetry')
+    builder.append('李', (work, kind, 1, 1, 1, 3))
+    builder.write('./index/char_index.bin')
+
+    with open('./index/char_index.bin', 'rb') as fh:
+        postings = PostingsFile(fh.read())
+    postings['李'][0]  # {'work_id': 'poem-1', 'type': 'poetry', ...}
+
+File layout, all integers in the byte order recorded in the header::
+
+    magic     8 bytes, ``MAGIC``
+    hlen      4 bytes, little-endian length of the header
+    header    ``hlen`` bytes of UTF-8 JSON (columns, tables, section offsets)
+    sections  8-byte aligned arrays referenced from the header
+
+Rows are grouped by key and sorted by their column values within a key, so
+with ``work_id`` as the first column the postings of a character are in
+corpus order (work ids are interned in the order works are first seen).
+A builder may name ``partitions``, columns the rows of a key are grouped by
+first: with ``partitions=['type', 'tone']`` the rows of one source type and
+tone are a contiguous, still sorted run that :meth:`Postings.partition`
+finds with binary searches instead of testing every row.
+``keys.starts`` holds the first row of every key,
+so the postings of one key are the slice ``[starts[i], starts[i + 1])`` of
+every column.  String valued columns (work ids, source types) store an index
+into a string table kept in the same file.
+"""
+
+from __future__ import annotations
+
+import bisect
+import json
+import os
+import shutil
+import struct
+import sys
+from array import array
+from itertools import chain
+from typing import Any, Container, Dict, Iterable, Iterator, List, Sequence, Tuple
+
+MAGIC = b'CPIDX\x00\x01\x00'
+VERSION = 1
+
+_ALIGN = 8
+
+
+def smallest_typecode(max_value: int) -> str:
+    """Return the narrowest unsigned ``array`` typecode holding ``max_value``."""
+
+    for code in ('B', 'H', 'I', 'Q'):
+        if max_value < 1 << (8 * array(code).itemsize):
+            return code
+    raise OverflowError(f'{max_value} does not fit in 64 bits')
+
+
+def _packed(values: array) -> array:
+    code = smallest_typecode(max(values, default=0))
+    return values if code == values.typecode else array(code, values)
+
+
+def string_sections(name: str, values: Iterable[str]) -> List[Tuple[str, array]]:
+    """Return the ``<name>.offsets``/``<name>.blob`` sections of a string table."""
+
+    blob = bytearray()
+    offsets = array('Q', [0])
+    for value in values:
+        blob += value.encode('utf-8')
+        offsets.append(len(blob))
+    return [(f'{name}.offsets', _packed(offsets)), (f'{name}.blob', array('B', blob))]
+
+
+def write_sections(path: str, magic: bytes, header: Dict[str, Any],
+                   sections: Sequence[Tuple[str, Any]]) -> None:
+    """Write ``header`` and aligned ``sections`` to ``path`` atomically.
+
+    A section is an ``array`` or the path of a file whose bytes are copied
+    verbatim, which lets large blobs be spooled to disk while building.  The
+    section layout and byte order are added to ``header``.
+    """
+
+    layout = {}
+    offset = 0
+    for name, data in sections:
+        offset += -offset % _ALIGN
+        if isinstance(data, array):
+            layout[name] = [offset, len(data), data.typecode]
+            offset += len(data) * data.itemsize
+        else:
+            size = os.path.getsize(data)
+            layout[name] = [offset, size, 'B']
+            offset += size
+
+    header = dict(header, byteorder=sys.byteorder, sections=layout)
+    # Section offsets are relative to the aligned end of the header.
+    head = json.dumps(header, sort_keys=True, separators=(',', ':')).encode('utf-8')
+    prefix = magic + struct.pack('<I', len(head)) + head
+    prefix += b'\x00' * (-len(prefix) % _ALIGN)
+
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'wb') as fh:
+        fh.write(prefix)
+        for name, data in sections:
+            fh.write(b'\x00' * (layout[name][0] - (fh.tell() - len(prefix))))
+            if isinstance(data, array):
+                data.tofile(fh)
+            else:
+                with open(data, 'rb') as src:
+                    shutil.copyfileobj(src, fh)
+    os.replace(tmp_path, path)
+
+
+def read_sections(buf, magic: bytes, version: int) -> Tuple[Dict[str, Any], Dict[str, Sequence[int]]]:
+    """Parse a buffer written by :func:`write_sections`.
+
+    Returns the header and a mapping of section name to a zero-copy
+    ``memoryview`` of its values (byte-swapped copies on a foreign platform).
+    """
+
+    view = memoryview(buf)
+    if bytes(view[:len(magic)]) != magic:
+        raise ValueError(f'not a {magic[:5].decode()} file')
+    (hlen,) = struct.unpack_from('<I', view, len(magic))
+    head_start = len(magic) + 4
+    header = json.loads(bytes(view[head_start:head_start + hlen]))
+    if header['version'] != version:
+        raise ValueError(f"unsupported {magic[:5].decode()} version {header['version']}")
+    base = head_start + hlen
+    base += -base % _ALIGN
+    swap = header['byteorder'] != sys.byteorder
+
+    sections: Dict[str, Sequence[int]] = {}
+    for name, (offset, length, code) in header['sections'].items():
+        size = length * array(code).itemsize
+        raw = view[base + offset:base + offset + size]
+        if code == 'B':
+            sections[name] = raw
+        elif swap:
+            arr = array(code, raw.tobytes())
+            arr.byteswap()
+            sections[name] = arr
+        else:
+            sections[name] = raw.cast(code)
+    return header, sections
+
+
+def find_string(table: Sequence[str], key: str) -> int:
+    """Return the position of ``key`` in the sorted ``table`` or ``-1``."""
+
+    idx = bisect.bisect_left(table, key)
+    if idx < len(table) and table[idx] == key:
+        return idx
+    return -1
+
+
+class StringTable(Sequence[str]):
+    """Read-only table of UTF-8 strings addressed by integer id."""
+
+    def __init__(self, offsets: Sequence[int], blob: memoryview) -> None:
+        self._offsets = offsets
+        self._blob = blob
+
+    def __len__(self) -> int:
+        return len(self._offsets) - 1
+
+    def __getitem__(self, idx):  # type: ignore[override]
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return str(self._blob[self._offsets[idx]:self._offsets[idx + 1]], 'utf-8')
+
+
+class PostingsBuilder:
+    """Accumulate postings rows in memory and write them as a binary file."""
+
+    def __init__(self, columns: Sequence[str], tables: Sequence[str] = (),
+                 partitions: Sequence[str] = ()) -> None:
+        self.columns: Tuple[str, ...] = tuple(columns)
+        self.partitions: Tuple[str, ...] = tuple(partitions)
+        self.tables: Dict[str, Dict[str, int]] = {name: {} for name in tables}
+        self._names: Dict[str, List[str]] = {name: [] for name in tables}
+        self._rows: Dict[str, array] = {}
+
+    def intern(self, column: str, value: str) -> int:
+        """Return the id of ``value`` in the string table of ``column``."""
+
+        table = self.tables[column]
+        idx = table.get(value)
+        if idx is None:
+            idx = table[value] = len(table)
+            self._names[column].append(value)
+        return idx
+
+    def name(self, column: str, idx: int) -> str:
+        """Return the string interned as ``idx`` in the table of ``column``."""
+
+        return self._names[column][idx]
+
+    def append(self, key: str, row: Sequence[int]) -> None:
+        """Add one row of already interned integer values under ``key``."""
+
+        rows = self._rows.get(key)
+        if rows is None:
+            rows = self._rows[key] = array('I')
+        rows.extend(row)
+
+    def extend(self, key: str, values: Iterable[int]) -> None:
+        """Add several rows under ``key``, given as one flat run of values."""
+
+        rows = self._rows.get(key)
+        if rows is None:
+            rows = self._rows[key] = array('I')
+        rows.extend(values)
+        if len(rows) % len(self.columns):
+            raise ValueError(f'rows of {key!r} do not fill {len(self.columns)} columns')
+
+    def merge(self, postings: 'PostingsFile',
+              keep: Dict[str, Dict[int, int]] | None = None,
+              keys: Container[str] | None = None) -> None:
+        """Append the rows of ``postings``, re-interning its string columns.
+
+        Tables are interned in their stored order, so merging the partial
+        files of consecutive corpus shards assigns the same ids as indexing
+        the shards in one builder.  ``keep`` maps a column to explicit
+        ``{old id: new id}`` translations instead; rows whose value is not in
+        that mapping are dropped.  With ``keys`` only those keys are merged.
+        """
+
+        if postings.columns != self.columns:
+            raise ValueError(f'cannot merge columns {postings.columns} into {self.columns}')
+        keep = keep or {}
+        remaps = {
+            name: [self.intern(name, value) for value in postings.tables[name]]
+            for name in self.tables if name not in keep
+        }
+        for key, view in postings.items():
+            if keys is not None and key not in keys:
+                continue
+            cols = []
+            for name in self.columns:
+                col = view.column(name)
+                if name in keep:
+                    mapping = keep[name]
+                    col = [mapping.get(value, -1) for value in col]
+                elif name in remaps:
+                    remap = remaps[name]
+                    col = [remap[value] for value in col]
+                cols.append(col)
+            rows = zip(*cols)
+            if keep:
+                rows = [row for row in rows if min(row) >= 0]
+                if not rows:
+                    continue
+            target = self._rows.get(key)
+            if target is None:
+                target = self._rows[key] = array('I')
+            target.extend(chain.from_iterable(rows))
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def _sorted_rows(self, key: str, partitioned: bool = True) -> array:
+        """Return the rows of ``key`` ordered by their partition and column values."""
+
+        rows = self._rows[key]
+        width = len(self.columns)
+        lead = [self.columns.index(name) for name in self.partitions] if partitioned else []
+        # partition columns are repeated in front of each row to sort by them first
+        tuples = list(zip(*(rows[col::width] for col in lead + list(range(width)))))
+        if all(a <= b for a, b in zip(tuples, tuples[1:])):
+            return rows
+        tuples.sort()
+        skip = len(lead)
+        return array('I', [value for row in tuples for value in row[skip:]])
+
+    def to_dict(self) -> Dict[str, List[Dict[str, Any]]]:
+        """Return the postings in the dictionary layout of ``char_index.json``.
+
+        Keys are sorted, as in the binary file, so the export does not depend
+        on the order in which the corpus was read.  Rows are not partitioned.
+        """
+
+        names = {col: list(table) for col, table in self.tables.items()}
+        width = len(self.columns)
+        result: Dict[str, List[Dict[str, Any]]] = {}
+        for key in sorted(self._rows):
+            rows = self._sorted_rows(key, partitioned=False)
+            occs = []
+            for start in range(0, len(rows), width):
+                occ = {}
+                for col, value in zip(self.columns, rows[start:start + width]):
+                    occ[col] = names[col][value] if col in names else value
+                occs.append(occ)
+            result[key] = occs
+        return result
+
+    def write(self, path: str) -> None:
+        """Write the binary postings file to ``path`` atomically."""
+
+        width = len(self.columns)
+        keys = sorted(self._rows)
+        starts = array('Q', [0])
+        columns = [array('I') for _ in self.columns]
+        for key in keys:
+            rows = self._sorted_rows(key)
+            for col_idx, col in enumerate(columns):
+                col.extend(rows[col_idx::width])
+            starts.append(len(columns[0]))
+
+        sections = string_sections('keys', keys)
+        sections.append(('keys.starts', _packed(starts)))
+        for name, table in self.tables.items():
+            sections.extend(string_sections(f'table.{name}', table))
+        for name, col in zip(self.columns, columns):
+            sections.append((f'col.{name}', _packed(col)))
+
+        header = {
+            'version': VERSION,
+            'columns': list(self.columns),
+            'tables': list(self.tables),
+            'partitions': list(self.partitions),
+            'keys': len(keys),
+            'rows': int(starts[-1]),
+        }
+        write_sections(path, MAGIC, header, sections)
+
+
+class Postings(Sequence[Dict[str, Any]]):
+    """Lazy view of the rows stored under one key of a :class:`PostingsFile`.
+
+    Indexing decodes a single row into the dictionary layout used by the JSON
+    index; :meth:`column` exposes the raw packed integers without copying.
+    """
+
+    def __init__(self, source: 'PostingsFile', start: int, stop: int) -> None:
+        self._source = source
+        self._start = start
+        self._stop = stop
+
+    def __len__(self) -> int:
+        return self._stop - self._start
+
+    def column(self, name: str) -> Sequence[int]:
+        """Return the packed integer values of column ``name``."""
+
+        return self._source.column(name)[self._start:self._stop]
+
+    def table(self, name: str) -> Sequence[str]:
+        """Return the string table that column ``name`` indexes into."""
+
+        return self._source.tables[name]
+
+    @property
+    def partitions(self) -> Tuple[str, ...]:
+        """Return the columns the rows are partitioned by."""
+
+        return self._source.partitions
+
+    def partition(self, *values: int) -> range:
+        """Return the positions of the rows whose leading partition columns equal ``values``."""
+
+        if len(values) > len(self.partitions):
+            raise ValueError(f'only {len(self.partitions)} partition columns')
+        start, stop = self._start, self._stop
+        for name, value in zip(self.partitions, values):
+            col = self._source.column(name)
+            start = bisect.bisect_left(col, value, start, stop)
+            stop = bisect.bisect_right(col, value, start, stop)
+        return range(start - self._start, stop - self._start)
+
+    def __getitem__(self, idx):  # type: ignore[override]
+        if isinstance(idx, slice):
+            return [self[i] for i in range(*idx.indices(len(self)))]
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError(idx)
+        return self._source.row(self._start + idx)
+
+    def __iter__(self) -> Iterator[Dict[str, Any]]:
+        source = self._source
+        names = source.columns
+        tables = [source.tables.get(name) for name in names]
+        cols = [source.column(name)[self._start:self._stop] for name in names]
+        for values in zip(*cols):
+            yield {
+                name: table[value] if table is not None else value
+                for name, table, value in zip(names, tables, values)
+            }
+
+    def __eq__(self, other: object) -> bool:
+        if isinstance(other, Sequence) and not isinstance(other, (str, bytes)):
+            return list(self) == list(other)
+        return NotImplemented
+
+    def __repr__(self) -> str:
+        return f'Postings({list(self)!r})'
+
+
+class PostingsFile:
+    """Read a file written by :class:`PostingsBuilder` from a buffer.
+
+    ``buf`` may be ``bytes`` or an ``mmap``; nothing beyond the header is
+    copied or decoded until a key is looked up.  Keys are stored sorted, so a
+    lookup is a binary search over the key table rather than a dictionary
+    built at open time.
+    """
+
+    def __init__(self, buf) -> None:
+        header, sections = read_sections(buf, MAGIC, VERSION)
+        self.header = header
+        self.columns: Tuple[str, ...] = tuple(header['columns'])
+        self.partitions: Tuple[str, ...] = tuple(header.get('partitions', ()))
+        self._sections = sections
+        self.keys = StringTable(sections['keys.offsets'], sections['keys.blob'])
+        self._starts = sections['keys.starts']
+        self.tables = {
+            name: StringTable(sections[f'table.{name}.offsets'], sections[f'table.{name}.blob'])
+            for name in header['tables']
+        }
+
+    def find(self, key: str) -> int:
+        """Return the position of ``key`` in the key table or ``-1``."""
+
+        return find_string(self.keys, key)
+
+    def __len__(self) -> int:
+        return len(self.keys)
+
+    def __contains__(self, key: object) -> bool:
+        return isinstance(key, str) and self.find(key) >= 0
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self.keys)
+
+    def items(self) -> Iterator[Tuple[str, Postings]]:
+        """Yield ``(key, postings)`` pairs in key order."""
+
+        starts = self._starts
+        for idx, key in enumerate(self.keys):
+            yield key, Postings(self, starts[idx], starts[idx + 1])
+
+    def __getitem__(self, key: str) -> Postings:
+        idx = self.find(key)
+        if idx < 0:
+            raise KeyError(key)
+        return Postings(self, self._starts[idx], self._starts[idx + 1])
+
+    @property
+    def starts(self) -> Sequence[int]:
+        """Return the first row of every key, followed by the number of rows."""
+
+        return self._starts
+
+    def column(self, name: str) -> Sequence[int]:
+        """Return the whole packed column ``name``."""
+
+        return self._sections[f'col.{name}']
+
+    def row(self, idx: int) -> Dict[str, Any]:
+        """Decode row ``idx`` into a dictionary."""
+
+        occ = {}
+        for name in self.columns:
+            value = self._sections[f'col.{name}'][idx]
+            table = self.tables.get(name)
+            occ[name] = table[value] if table is not None else value
+        return occ
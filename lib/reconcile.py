@@ -0,0 +1,213 @@
+"""Match corpus records against a fresh copy of the same texts by content.
+
+``宋词/UpdateCi.py`` compares every ci with the record at the same index of
+a newly crawled list, which breaks as soon as one side gains or loses a
+record.  This module finds each old record's best match wherever it is::
+
+    from lib.reconcile import plain_text, best_matches
+
+    old = [plain_text(ci['paragraphs']) for ci in old_data]
+    new = [plain_text(ci['paragraphs']) for ci in new_data]
+    match, ratio = best_matches(old, new, hint=range(len(old)))
+
+Texts are turned into character count vectors, stored sparsely as sorted
+``(text, character, count)`` arrays.  ``ratio`` is exactly
+``difflib.SequenceMatcher(a=old, b=new).quick_ratio()``, computed for all
+candidate pairs at once: twice the summed minimum counts of the characters
+two texts share, over their total length.  Candidates come from a MinHash
+signature of each text's character bigrams, split into LSH bands: two texts
+become candidates when all the hashes of one band agree, which is likely
+for near-duplicates and rare otherwise.  The ``hint`` pairs (by default
+none) are always scored and win ties.
+
+:class:`Replacer` applies a table of replacements such as
+``UpdateCi.char_dict`` in a single pass over each string.
+"""
+
+from __future__ import annotations
+
+import re
+from typing import Dict, Iterable, List, Sequence, Tuple
+
+import numpy as np
+
+from lib.phrases import is_punctuation
+
+#: Hash functions in a MinHash signature.
+NUM_PERM = 32
+#: Signature rows per LSH band.
+ROWS = 4
+#: Buckets holding more new texts than this yield no candidates.
+MAX_BUCKET = 64
+
+_PRIME = np.uint64(4294967311)  # smallest prime above 2**32
+_EMPTY = np.iinfo(np.uint64).max
+
+
+def plain_text(paragraphs: Iterable[str]) -> str:
+    """Return the characters of ``paragraphs`` without punctuation and spaces."""
+    return ''.join(ch for line in paragraphs for ch in line if not is_punctuation(ch))
+
+
+class CharCounts:
+    """Character counts of a list of texts, as sorted sparse arrays."""
+
+    def __init__(self, texts: Sequence[str]) -> None:
+        lengths = np.fromiter((len(text) for text in texts), dtype=np.int64, count=len(texts))
+        codes = np.frombuffer(''.join(texts).encode('utf-32-le'), dtype=np.uint32)
+        docs = np.repeat(np.arange(len(texts), dtype=np.int64), lengths)
+        keys, counts = np.unique((docs << 32) | codes, return_counts=True)
+        self.lengths = lengths
+        self.docs = keys >> 32
+        self.chars = keys & 0xFFFFFFFF
+        self.counts = counts
+        #: ``starts[i]:starts[i + 1]`` are the entries of text ``i``.
+        self.starts = np.searchsorted(self.docs, np.arange(len(texts) + 1))
+        self.codes = codes
+        self.offsets = np.concatenate(([0], np.cumsum(lengths)))
+
+
+def _expand(counts: CharCounts, docs: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Return, for each entry of the texts ``docs``, its pair number and position."""
+    sizes = counts.starts[docs + 1] - counts.starts[docs]
+    pair = np.repeat(np.arange(len(docs)), sizes)
+    first = np.repeat(counts.starts[docs] - np.concatenate(([0], np.cumsum(sizes)[:-1])), sizes)
+    return pair, first + np.arange(len(pair))
+
+
+def quick_ratios(old: CharCounts, new: CharCounts, pairs_old: np.ndarray,
+                 pairs_new: np.ndarray) -> np.ndarray:
+    """Return ``SequenceMatcher.quick_ratio()`` of every ``(old, new)`` text pair."""
+
+    pairs_old = np.asarray(pairs_old, dtype=np.int64)
+    pairs_new = np.asarray(pairs_new, dtype=np.int64)
+    pair_a, entry_a = _expand(old, pairs_old)
+    pair_b, entry_b = _expand(new, pairs_new)
+    keys_a = (pair_a << 32) | old.chars[entry_a]
+    keys_b = (pair_b << 32) | new.chars[entry_b]
+    _, idx_a, idx_b = np.intersect1d(keys_a, keys_b, assume_unique=True, return_indices=True)
+    shared = np.minimum(old.counts[entry_a[idx_a]], new.counts[entry_b[idx_b]])
+    matches = np.bincount(pair_a[idx_a], weights=shared, minlength=len(pairs_old))
+    total = old.lengths[pairs_old] + new.lengths[pairs_new]
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(total > 0, 2.0 * matches / total, 1.0)
+
+
+def signatures(counts: CharCounts, num_perm: int = NUM_PERM, seed: int = 0) -> np.ndarray:
+    """Return the ``(texts, num_perm)`` MinHash signatures of the texts' bigrams.
+
+    A text of one character is hashed as that character; an empty text gets
+    an all-ones signature.
+    """
+
+    codes = counts.codes.astype(np.uint64)
+    offsets = counts.offsets
+    n = len(counts.lengths)
+    # bigram i of the concatenated codes belongs to text d when both
+    # characters do; single characters stand for themselves
+    first = codes[:-1] * np.uint64(1000003) ^ codes[1:] if len(codes) > 1 else codes[:0]
+    owner = np.repeat(np.arange(n), counts.lengths)
+    keep = owner[:-1] == owner[1:] if len(codes) > 1 else np.zeros(0, dtype=bool)
+    shingles = [first[keep] & np.uint64(0xFFFFFFFF)]
+    docs = [owner[:-1][keep]]
+    single = np.flatnonzero(counts.lengths == 1)
+    shingles.append(codes[offsets[single]])
+    docs.append(single)
+    shingles_all = np.concatenate(shingles)
+    docs_all = np.concatenate(docs)
+    order = np.argsort(docs_all, kind='stable')
+    shingles_all, docs_all = shingles_all[order], docs_all[order]
+
+    rng = np.random.default_rng(seed)
+    a = rng.integers(1, 1 << 31, size=num_perm, dtype=np.uint64)
+    b = rng.integers(0, 1 << 31, size=num_perm, dtype=np.uint64)
+    result = np.full((n, num_perm), _EMPTY, dtype=np.uint64)
+    if not len(shingles_all):
+        return result
+    present, starts = np.unique(docs_all, return_index=True)
+    for k in range(num_perm):
+        hashed = (a[k] * shingles_all + b[k]) % _PRIME
+        result[present, k] = np.minimum.reduceat(hashed, starts)
+    return result
+
+
+def candidates(sig_old: np.ndarray, sig_new: np.ndarray, rows: int = ROWS,
+               max_bucket: int = MAX_BUCKET) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the ``(old, new)`` pairs sharing an LSH band, without duplicates."""
+
+    n_old, n_new = len(sig_old), len(sig_new)
+    found = []
+    for start in range(0, sig_old.shape[1] - rows + 1, rows):
+        band = np.ascontiguousarray(np.vstack((sig_old[:, start:start + rows],
+                                               sig_new[:, start:start + rows])))
+        _, bucket = np.unique(band.view([('', band.dtype)] * rows), return_inverse=True)
+        bucket = bucket.ravel()
+        old_bucket, new_bucket = bucket[:n_old], bucket[n_old:]
+        order = np.argsort(new_bucket, kind='stable')
+        sorted_buckets = new_bucket[order]
+        lo = np.searchsorted(sorted_buckets, old_bucket, 'left')
+        hi = np.searchsorted(sorted_buckets, old_bucket, 'right')
+        sizes = np.where(hi - lo <= max_bucket, hi - lo, 0)
+        olds = np.repeat(np.arange(n_old), sizes)
+        firsts = np.repeat(lo - np.concatenate(([0], np.cumsum(sizes)[:-1])), sizes)
+        found.append(olds * n_new + order[firsts + np.arange(len(olds))])
+    keys = np.unique(np.concatenate(found)) if found else np.zeros(0, dtype=np.int64)
+    return keys // max(n_new, 1), keys % max(n_new, 1)
+
+
+def best_matches(old: Sequence[str], new: Sequence[str], hint: Iterable[int] | None = None,
+                 rows: int = ROWS, num_perm: int = NUM_PERM) -> Tuple[np.ndarray, np.ndarray]:
+    """Return the best matching new text of every old one and its ratio.
+
+    ``hint[i]``, if given, is a new text always considered for old text
+    ``i`` (say the one at the same index) and preferred on ties; an index
+    outside ``new`` is ignored.  Old texts without any candidate get match
+    ``-1`` and ratio ``0``.
+    """
+
+    old_counts, new_counts = CharCounts(old), CharCounts(new)
+    pairs_old, pairs_new = candidates(signatures(old_counts, num_perm),
+                                      signatures(new_counts, num_perm), rows)
+    preferred = np.zeros(len(pairs_old), dtype=bool)
+    if hint is not None:
+        hinted = np.fromiter(hint, dtype=np.int64, count=len(old))
+        valid = np.flatnonzero((hinted >= 0) & (hinted < len(new)))
+        pairs_old = np.concatenate((valid, pairs_old))
+        pairs_new = np.concatenate((hinted[valid], pairs_new))
+        preferred = np.concatenate((np.ones(len(valid), dtype=bool), preferred))
+    ratios = quick_ratios(old_counts, new_counts, pairs_old, pairs_new)
+
+    match = np.full(len(old), -1, dtype=np.int64)
+    ratio = np.zeros(len(old))
+    if len(pairs_old):
+        order = np.lexsort((~preferred, -ratios, pairs_old))
+        first = order[np.r_[True, pairs_old[order][1:] != pairs_old[order][:-1]]]
+        match[pairs_old[first]] = pairs_new[first]
+        ratio[pairs_old[first]] = ratios[first]
+    return match, ratio
+
+
+class Replacer:
+    """Apply a table of replacements to strings in one pass.
+
+    A table of single characters is applied with ``str.translate``; longer
+    keys are matched by one regular expression, longest key first.
+    """
+
+    def __init__(self, table: Dict[str, str]) -> None:
+        self.table = dict(table)
+        if all(len(key) == 1 for key in self.table):
+            self._translation = str.maketrans(self.table)
+            self._pattern = None
+        else:
+            self._translation = None
+            keys = sorted(self.table, key=len, reverse=True)
+            self._pattern = re.compile('|'.join(map(re.escape, keys)))
+
+    def __call__(self, text: str) -> str:
+        if self._pattern is None:
+            return text.translate(self._translation)
+        return self._pattern.sub(lambda match: self.table[match.group()], text)
+
+    def lines(self, lines: Sequence[str]) -> List[str]:
+        return [self(line) for line in lines]
@@ -0,0 +1,269 @@
+"""Maintenance of a segmented index: tombstones, merge policy and compaction.
+
+Every binary build or incremental update of ``scripts/preprocess.py`` writes
+one immutable segment, ``segments/<name>/`` holding a ``char_index.bin``, a
+``docs.bin``, the ``bitmaps.bin`` paragraph sets, the ``paragraphs.bin``
+forward index and, when built with ``--cooccur-top`` or ``--phrase-index``,
+a ``cooccur.bin`` table or a ``bigrams.bin`` phrase index.  ``manifest.json``
+lists the segments oldest first together with the work ids later updates
+deleted from each of them, and records for every corpus file the segment and
+the range of work ids it contributed::
+
+    {"segments": [{"name": "000001", "size": 14063224, "works": 21050,
+                   "deleted": ["ci-17"]}, ...],
+     "files": {"ci.song.0.json": {"sha1": "...", "segment": "000001",
+                                  "works": [0, 1000], "shared": []}, ...}}
+
+Readers (:func:`lib.indexer.load_index`, :func:`lib.docstore.open_docstore`)
+merge the segments on the fly.  :func:`compact` merges them back together
+following a size-tiered policy, dropping deleted works::
+
+    from lib.segments import compact
+
+    compact('./index')             # merge runs of similar sized segments
+    compact('./index', full=True)  # merge everything into one segment
+
+Segments are never modified in place: a merge writes a new segment, swaps the
+manifest atomically and only then removes the segments it replaced, so
+searches running meanwhile keep reading a consistent index.  Only one
+process should update an index at a time.
+"""
+
+from __future__ import annotations
+
+import json
+import math
+import os
+import shutil
+from typing import Any, Dict, List, Sequence, Set, Tuple
+
+from lib.bitmaps import build_bitmaps
+from lib.cooccur import new_paragraphs, top_cooccurring
+from lib.docstore import DOCSTORE, DocStore, DocStoreBuilder
+from lib.indexer import (BINARY_INDEX, BITMAPS, COOCCUR, MANIFEST, PARAGRAPHS, PHRASES,
+                         SEGMENTS, BinaryIndex, new_builder, read_manifest, segment_dir)
+from lib.phrases import build_phrases
+from lib.postings import PostingsBuilder, PostingsFile
+
+#: Number of similar sized segments merged into one.
+MERGE_FACTOR = 4
+
+
+def next_segment(index_dir: str) -> str:
+    """Return an unused segment name, greater than every existing one."""
+
+    root = os.path.join(index_dir, SEGMENTS)
+    names = [int(name) for name in os.listdir(root) if name.isdigit()] if os.path.isdir(root) else []
+    return f'{max(names, default=0) + 1:06d}'
+
+
+def write_segment(index_dir: str, name: str, builder: PostingsBuilder, docs: DocStoreBuilder,
+                  paragraphs: PostingsBuilder | None = None, top: int = 0,
+                  phrases: bool = False) -> Dict[str, Any]:
+    """Write segment ``name`` and return its manifest entry.
+
+    With ``paragraphs`` the forward index is written too, with ``top`` the
+    table of the ``top`` characters co-occurring with each character, and
+    with ``phrases`` the bigram index.
+    """
+
+    path = segment_dir(index_dir, name)
+    os.makedirs(path)
+    builder.write(os.path.join(path, BINARY_INDEX))
+    with open(os.path.join(path, BINARY_INDEX), 'rb') as fh:
+        written = PostingsFile(fh.read())
+    build_bitmaps(written).write(os.path.join(path, BITMAPS))
+    if phrases:
+        build_phrases(written).write(os.path.join(path, PHRASES))
+    docs.write(os.path.join(path, DOCSTORE))
+    if paragraphs is not None:
+        paragraphs.write(os.path.join(path, PARAGRAPHS))
+        if top:
+            with open(os.path.join(path, PARAGRAPHS), 'rb') as fh:
+                forward = PostingsFile(fh.read())
+            top_cooccurring(forward, top).write(os.path.join(path, COOCCUR))
+    return {
+        'name': name,
+        'size': os.path.getsize(os.path.join(path, BINARY_INDEX)),
+        'works': len(builder.tables['work_id']),
+        'deleted': [],
+    }
+
+
+def open_segment(index_dir: str, name: str) -> Tuple[BinaryIndex, DocStore]:
+    """Memory-map the index and document store of segment ``name``."""
+
+    path = segment_dir(index_dir, name)
+    index = BinaryIndex.open(os.path.join(path, BINARY_INDEX), mmap=True)
+    return index, DocStore.open(os.path.join(path, DOCSTORE), 0)
+
+
+def write_manifest(index_dir: str, manifest: Dict[str, Any]) -> None:
+    """Replace ``manifest.json`` atomically."""
+
+    path = os.path.join(index_dir, MANIFEST)
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump(manifest, fh, ensure_ascii=False, indent=2)
+    os.replace(tmp_path, path)
+
+
+def remove_unused(index_dir: str, manifest: Dict[str, Any]) -> None:
+    """Delete segment directories that ``manifest`` no longer lists."""
+
+    root = os.path.join(index_dir, SEGMENTS)
+    if not os.path.isdir(root):
+        return
+    used = {segment['name'] for segment in manifest.get('segments', ())}
+    for name in os.listdir(root):
+        if name not in used:
+            shutil.rmtree(os.path.join(root, name))
+
+
+def file_works(record: Dict[str, Any], works: Sequence[str]) -> Set[str]:
+    """Return the work ids of a file record; ``works`` is its segment's table."""
+
+    start, stop = record['works']
+    return set(works[start:stop]) | set(record['shared'])
+
+
+def work_range(builder: PostingsBuilder, used: Sequence[int], start: int
+               ) -> Tuple[Dict[str, Any], int]:
+    """Describe the work ids ``used`` by a file that was added to ``builder``.
+
+    Works interned from ``start`` on were introduced by the file and form its
+    range; earlier ones are shared with previous files and kept by name.
+    Returns the ``works``/``shared`` fields of its record and the next start.
+    """
+
+    added = sum(1 for work in used if work >= start)
+    fields = {
+        'works': [start, start + added],
+        'shared': [builder.name('work_id', work) for work in used if work < start],
+    }
+    return fields, start + added
+
+
+def copy_file(record: Dict[str, Any], postings: PostingsFile, old_docs: DocStore,
+              builder: PostingsBuilder, docs: DocStoreBuilder, keep: Dict[int, int]) -> List[int]:
+    """Re-intern the works of a file record and copy their document records.
+
+    The postings rows are copied afterwards with
+    ``builder.merge(postings, keep={'work_id': keep})``; ``keep`` collects
+    the old to new work id translation.  Returns the new ids the file uses.
+    """
+
+    works = postings.tables['work_id']
+    used = []
+    start, stop = record['works']
+    for old in range(start, stop):
+        name = works[old]
+        keep[old] = builder.intern('work_id', name)
+        docs.add_raw(name, old_docs.raw(name))
+        used.append(keep[old])
+    used.extend(builder.intern('work_id', name) for name in record['shared'])
+    return used
+
+
+def plan_merges(segments: Sequence[Dict[str, Any]],
+                factor: int = MERGE_FACTOR) -> List[Tuple[int, int]]:
+    """Return the runs ``(start, stop)`` of adjacent segments to merge next.
+
+    Segments fall in size tiers that grow by ``factor``.  A run of at least
+    ``factor`` adjacent segments of one tier is merged into a segment of the
+    next tier, so each row is rewritten about ``log(size) / log(factor)``
+    times over the life of the index.  A segment with at least half of its
+    works deleted is rewritten on its own to reclaim their space.
+    """
+
+    tiers = [int(math.log(max(segment['size'], 1), factor)) for segment in segments]
+    runs = []
+    start = 0
+    while start < len(segments):
+        stop = start + 1
+        while stop < len(segments) and tiers[stop] == tiers[start]:
+            stop += 1
+        if stop - start >= factor:
+            runs.append((start, stop))
+        else:
+            runs.extend(
+                (idx, idx + 1) for idx in range(start, stop)
+                if segments[idx]['deleted'] and 2 * len(segments[idx]['deleted']) >= segments[idx]['works']
+            )
+        start = stop
+    return runs
+
+
+def merge_segments(index_dir: str, manifest: Dict[str, Any], start: int, stop: int
+                   ) -> Dict[str, Any]:
+    """Merge segments ``[start, stop)`` of ``manifest`` into a new segment.
+
+    Deleted works are dropped.  Works are interned file by file in corpus
+    order, so merging every segment writes the same files as a full build.
+    The forward index is kept only if every merged segment has one.
+    Returns the updated manifest; the caller writes it.
+    """
+
+    merged = manifest['segments'][start:stop]
+    opened = {segment['name']: open_segment(index_dir, segment['name']) for segment in merged}
+    keep: Dict[str, Dict[int, int]] = {name: {} for name in opened}
+    name = next_segment(index_dir)
+    options = manifest.get('options', {})
+    builder = new_builder(options.get('fold', False))
+    docs = DocStoreBuilder(spool_dir=index_dir)
+    forward = all(index.has_paragraphs for index, _ in opened.values())
+    paragraphs = new_paragraphs() if forward else None
+
+    files = dict(manifest['files'])
+    next_work = 0
+    for path in sorted(files):
+        record = files[path]
+        if record['segment'] not in opened:
+            continue
+        index, old_docs = opened[record['segment']]
+        used = copy_file(record, index.postings, old_docs, builder, docs, keep[record['segment']])
+        fields, next_work = work_range(builder, used, next_work)
+        files[path] = dict(record, segment=name, **fields)
+    for segment in merged:
+        index = opened[segment['name']][0]
+        builder.merge(index.postings, keep={'work_id': keep[segment['name']]})
+        if paragraphs is not None:
+            works = index.postings.tables['work_id']
+            live = {works[old] for old in keep[segment['name']]}
+            paragraphs.merge(index.paragraphs, keys=live)
+
+    segments = list(manifest['segments'])
+    segments[start:stop] = [write_segment(index_dir, name, builder, docs, paragraphs,
+                                          options.get('cooccur_top', 0),
+                                          options.get('phrases', False))]
+    return dict(manifest, segments=segments, files=files)
+
+
+def compact(index_dir: str, factor: int = MERGE_FACTOR, full: bool = False) -> int:
+    """Merge the segments of ``index_dir`` and return the number of merges.
+
+    By default :func:`plan_merges` is applied until it finds nothing to do;
+    ``full`` merges every segment into one and drops all deleted works.
+    """
+
+    manifest = read_manifest(index_dir)
+    if manifest is None or not manifest.get('segments'):
+        return 0
+    merges = 0
+    while True:
+        segments = manifest['segments']
+        if full:
+            needed = len(segments) > 1 or segments[0]['deleted']
+            runs = [(0, len(segments))] if needed and not merges else []
+        else:
+            runs = plan_merges(segments, factor)
+        if not runs:
+            break
+        # merge from the end so the positions of earlier runs stay valid
+        for start, stop in reversed(runs):
+            manifest = merge_segments(index_dir, manifest, start, stop)
+            merges += 1
+    if merges:
+        write_manifest(index_dir, manifest)
+        remove_unused(index_dir, manifest)
+    return merges
@@ -0,0 +1,158 @@
+"""Write a stream of records to numbered shard files.
+
+The corpus directories hold their texts in shards of a fixed number of
+records named after the index of their first one (``ci.song.0.json``,
+``ci.song.1000.json``, ...).  :func:`export_shards` writes such shards from
+any iterable of records, holding at most one shard in memory, so the
+records can come straight from a database cursor::
+
+    from lib.shards import export_shards, iter_rows
+
+    rows = iter_rows(conn, 'SELECT rhythmic, author, content FROM ci')
+    records = ({'rhythmic': r, 'author': a, 'paragraphs': c.split('\\n')} for r, a, c in rows)
+    export_shards(records, '宋词', 'ci.song', shard_size=1000, fmt='json')
+
+Formats are ``json`` (indented like the corpus files), ``jsonl`` (one
+compact record per line) and ``bin``, the :mod:`lib.corpuscache` format
+with the ``tag`` lines and the other string fields of every record.
+
+Each export saves the SHA-1 of every shard's records in a state file next
+to the shards, one per prefix and format.  With ``incremental=True`` shards
+whose records did not change are left untouched; records are assigned to
+shards by position, so inserting or deleting a record changes the shards
+after it.  Shards of a previous export past the new end are removed.
+"""
+
+from __future__ import annotations
+
+import hashlib
+import json
+import os
+import sqlite3
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Sequence
+
+from lib.corpuscache import write_corpus
+
+#: File extension of each format.
+FORMATS = {'json': '.json', 'jsonl': '.jsonl', 'bin': '.bin'}
+
+Record = Dict[str, Any]
+
+
+def iter_rows(conn: sqlite3.Connection, query: str, params: Sequence[Any] = (),
+              batch: int = 1000) -> Iterator[tuple]:
+    """Yield the rows of ``query``, fetching ``batch`` rows at a time."""
+
+    if batch < 1:
+        raise ValueError(f'batch must be at least 1, got {batch}')
+    cursor = conn.execute(query, params)
+    try:
+        while True:
+            rows = cursor.fetchmany(batch)
+            if not rows:
+                return
+            yield from rows
+    finally:
+        cursor.close()
+
+
+def state_path(out_dir: str, prefix: str, fmt: str) -> str:
+    return os.path.join(out_dir, f'.{prefix}.{fmt}.export.json')
+
+
+def records_digest(records: Sequence[Record]) -> str:
+    """Return the SHA-1 of ``records``, independent of the output format."""
+
+    data = json.dumps(records, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()
+
+
+def write_shard(path: str, records: Sequence[Record], fmt: str = 'json',
+                tag: str = 'paragraphs') -> None:
+    """Write ``records`` to ``path`` in ``fmt``, replacing it atomically."""
+
+    tmp_path = f'{path}.tmp'
+    if fmt == 'bin':
+        keys = sorted({key for record in records for key in record} - {tag})
+        write_corpus(tmp_path, (record[tag] for record in records),
+                     {'tag': tag, 'records': os.path.basename(path)},
+                     {key: [record.get(key) for record in records] for key in keys})
+    elif fmt == 'jsonl':
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            for record in records:
+                fh.write(json.dumps(record, ensure_ascii=False, sort_keys=True))
+                fh.write('\n')
+    elif fmt == 'json':
+        # the layout of json.dumps(records, indent=2) with the corpus files'
+        # separators, written a record at a time
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            fh.write('[\n' if records else '[')
+            for idx, record in enumerate(records):
+                text = json.dumps(record, ensure_ascii=False, sort_keys=True, indent=2,
+                                  separators=(', ', ': '))
+                fh.write(('  ' if not idx else ', \n  ') + text.replace('\n', '\n  '))
+            fh.write('\n]' if records else ']')
+    else:
+        raise ValueError(f'unknown format {fmt!r}, expected one of {", ".join(FORMATS)}')
+    os.replace(tmp_path, path)
+
+
+def _chunks(records: Iterable[Record], size: int) -> Iterator[List[Record]]:
+    records = iter(records)
+    while True:
+        chunk = list(islice(records, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def export_shards(records: Iterable[Record], out_dir: str, prefix: str, shard_size: int = 1000,
+                  fmt: str = 'json', tag: str = 'paragraphs',
+                  incremental: bool = False) -> Dict[str, Any]:
+    """Write ``records`` to ``{prefix}.{first index}`` shards under ``out_dir``.
+
+    A ``shard_size`` of 0 writes a single file named ``prefix`` plus the
+    format's extension, holding all the records in memory.  Returns the
+    number of records and the shard names written, left unchanged and
+    removed.
+    """
+
+    if fmt not in FORMATS:
+        raise ValueError(f'unknown format {fmt!r}, expected one of {", ".join(FORMATS)}')
+    os.makedirs(out_dir, exist_ok=True)
+    state_file = state_path(out_dir, prefix, fmt)
+    previous: Dict[str, Any] = {}
+    if os.path.exists(state_file):
+        with open(state_file, 'r', encoding='utf-8') as fh:
+            previous = json.load(fh)
+    same_layout = previous.get('shard_size') == shard_size
+    old_digests = previous.get('shards', {}) if incremental and same_layout else {}
+
+    chunks = _chunks(records, shard_size) if shard_size else iter([list(records)])
+    digests: Dict[str, str] = {}
+    written: List[str] = []
+    unchanged: List[str] = []
+    count = 0
+    for chunk in chunks:
+        name = f'{prefix}.{count}{FORMATS[fmt]}' if shard_size else f'{prefix}{FORMATS[fmt]}'
+        count += len(chunk)
+        digest = records_digest(chunk)
+        digests[name] = digest
+        path = os.path.join(out_dir, name)
+        if old_digests.get(name) == digest and os.path.exists(path):
+            unchanged.append(name)
+            continue
+        write_shard(path, chunk, fmt, tag)
+        written.append(name)
+
+    removed = sorted(name for name in previous.get('shards', {}) if name not in digests
+                     and os.path.exists(os.path.join(out_dir, name)))
+    for name in removed:
+        os.remove(os.path.join(out_dir, name))
+    tmp_path = f'{state_file}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as fh:
+        json.dump({'format': fmt, 'shard_size': shard_size, 'records': count,
+                   'shards': digests}, fh, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, state_file)
+    return {'records': count, 'written': written, 'unchanged': unchanged, 'removed': removed}
@@ -0,0 +1,313 @@
+"""Character, tone and bigram counts of the corpus, as NumPy arrays.
+
+``preprocess.py --stats`` counts every indexed file once and saves the
+totals in ``stats.npz``.  Questions that used to need a scan of the corpus
+become array lookups::
+
+    from lib.stats import load_stats
+
+    stats = load_stats('./index')
+    stats.count('月', collection='宋词')                  # occurrences of 月 in 宋词
+    stats.frequency('月', collection=['宋词', '全唐诗'])   # share of all characters
+    stats.most_common(10, dynasty='唐')
+    stats.top_bigrams(10, collection='宋词')
+    stats.tone_distribution(collection='宋词')           # tones 0 (none) to 4
+
+The counts form a dense cube ``counts[char, collection, dynasty]``: a
+character is interned as its index in the sorted array of the code points
+seen, a collection is the top directory of a file under the data directory
+and a dynasty is taken from ``loader/datas.json`` and the file name (see
+:func:`lib.corpusdb.file_dynasty`), empty when unknown.  Alongside are the
+counts of each character per tone, the tone distribution of each
+collection and dynasty, punctuation left out, and the counts of every
+bigram, two adjacent characters of a line without punctuation, per
+collection and dynasty.  The ``collection`` and ``dynasty`` arguments take a name, a list
+of names or ``None`` for all.
+
+Every file's counts are also kept on their own under ``stats/``, named
+after the file's SHA-1.  An incremental build counts the changed files only
+and adds up the kept counts of the others with :func:`merge_stats`.
+"""
+
+from __future__ import annotations
+
+import functools
+import json
+import os
+from array import array
+from typing import Dict, Iterable, List, Sequence, Tuple, Union
+
+import numpy as np
+
+from lib.corpusdb import file_dynasty
+from lib.phrases import is_punctuation
+
+STATS = 'stats.npz'
+STATS_DIR = 'stats'
+#: Tones 0 (neutral or unknown) to 4.
+NUM_TONES = 5
+
+Names = Union[str, Sequence[str], None]
+
+_CHAR, _PUNCTUATION, _SPACE = 1, 2, 3
+
+
+@functools.lru_cache(maxsize=None)
+def _kind(code: int) -> int:
+    ch = chr(code)
+    return _SPACE if ch.isspace() else _PUNCTUATION if is_punctuation(ch) else _CHAR
+
+
+def _smallest(values: np.ndarray) -> np.ndarray:
+    """Return ``values`` as ``uint32`` when they fit, to keep saved files small."""
+    if not len(values) or (values.min() >= 0 and values.max() < 1 << 32):
+        return values.astype(np.uint32)
+    return values
+
+
+class FileStats:
+    """Counts of one file: characters by tone and bigrams."""
+
+    def __init__(self, chars: np.ndarray, char_tones: np.ndarray, bigrams: np.ndarray,
+                 bigram_counts: np.ndarray) -> None:
+        #: Sorted code points and, per code point, the count of each tone.
+        self.chars = chars
+        self.char_tones = char_tones
+        #: Sorted ``first << 21 | second`` code point pairs and their counts.
+        self.bigrams = bigrams
+        self.bigram_counts = bigram_counts
+
+    def save(self, path: str) -> None:
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(tmp_path, chars=self.chars, char_tones=self.char_tones, bigrams=self.bigrams,
+                 bigram_counts=self.bigram_counts)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'FileStats':
+        with np.load(path) as data:
+            return cls(data['chars'], data['char_tones'], data['bigrams'], data['bigram_counts'])
+
+
+class StatsBuilder:
+    """Collect the characters and tones of one file's lines."""
+
+    def __init__(self) -> None:
+        self._codes = array('I')
+        self._tones = array('B')
+        self._line_starts = array('Q')
+
+    def add_line(self, line: str, tones: Sequence[int]) -> None:
+        """Add ``line`` with the tone of each of its characters."""
+        self._line_starts.append(len(self._codes))
+        self._codes.frombytes(line.encode('utf-32-le'))
+        self._tones.extend(tones)
+
+    def build(self) -> FileStats:
+        codes = np.frombuffer(self._codes, dtype=np.uint32).astype(np.int64)
+        tones = np.frombuffer(self._tones, dtype=np.uint8).astype(np.int64)
+        tones[tones >= NUM_TONES] = 0
+        uniq, inverse = np.unique(codes, return_inverse=True)
+        kinds = np.array([_kind(code) for code in uniq.tolist()], dtype=np.int8)
+        kind = kinds[inverse] if len(codes) else np.zeros(0, dtype=np.int8)
+
+        # spaces are not counted, like in the index
+        counted = kind != _SPACE
+        keys, counts = np.unique(inverse[counted] * NUM_TONES + tones[counted], return_counts=True)
+        present, slot = np.unique(keys // NUM_TONES, return_inverse=True)
+        char_tones = np.zeros((len(present), NUM_TONES), dtype=np.int64)
+        char_tones[slot, keys % NUM_TONES] = counts
+
+        # bigrams: both characters in one line and neither punctuation
+        starts = np.frombuffer(self._line_starts, dtype=np.uint64).astype(np.int64)
+        line_of = np.searchsorted(starts, np.arange(len(codes)), 'right')
+        pair = (kind[:-1] == _CHAR) & (kind[1:] == _CHAR) & (line_of[:-1] == line_of[1:])
+        first, second = codes[:-1][pair], codes[1:][pair]
+        bigrams, bigram_counts = np.unique((first << 21) | second, return_counts=True)
+        return FileStats(uniq[present].astype(np.uint32), char_tones,
+                         bigrams.astype(np.uint64), bigram_counts.astype(np.int64))
+
+
+def _select(names: List[str], selected: Names) -> List[int] | slice:
+    if selected is None:
+        return slice(None)
+    if isinstance(selected, str):
+        selected = [selected]
+    missing = [name for name in selected if name not in names]
+    if missing:
+        raise KeyError(f"unknown {', '.join(missing)}; expected one of {', '.join(names)}")
+    return [names.index(name) for name in selected]
+
+
+class CharStats:
+    """Counts of the whole corpus, by character, collection and dynasty."""
+
+    def __init__(self, chars: np.ndarray, collections: List[str], dynasties: List[str],
+                 counts: np.ndarray, char_tones: np.ndarray, tones: np.ndarray,
+                 bigrams: np.ndarray, bigram_cells: np.ndarray,
+                 bigram_counts: np.ndarray) -> None:
+        self.chars = chars
+        self.collections = collections
+        self.dynasties = dynasties
+        #: ``counts[char, collection, dynasty]``.
+        self.counts = counts
+        #: ``char_tones[char, tone]`` over the whole corpus.
+        self.char_tones = char_tones
+        #: ``tones[collection, dynasty, tone]``.
+        self.tones = tones
+        #: Sparse bigram counts sorted by bigram, then cell
+        #: ``collection * len(dynasties) + dynasty``.
+        self.bigrams = bigrams
+        self.bigram_cells = bigram_cells
+        self.bigram_counts = bigram_counts
+
+    def char_id(self, ch: str) -> int:
+        """Return the interned id of ``ch``, -1 if it never occurs."""
+        idx = int(np.searchsorted(self.chars, ord(ch)))
+        return idx if idx < len(self.chars) and self.chars[idx] == ord(ch) else -1
+
+    def _cells(self, collection: Names, dynasty: Names) -> Tuple[List[int] | slice,
+                                                                 List[int] | slice]:
+        return _select(self.collections, collection), _select(self.dynasties, dynasty)
+
+    def slice(self, collection: Names = None, dynasty: Names = None) -> np.ndarray:
+        """Return the count of every character within the selected cells."""
+        rows, cols = self._cells(collection, dynasty)
+        return self.counts[:, rows][:, :, cols].sum(axis=(1, 2))
+
+    def count(self, ch: str, collection: Names = None, dynasty: Names = None) -> int:
+        idx = self.char_id(ch)
+        if idx < 0:
+            return 0
+        rows, cols = self._cells(collection, dynasty)
+        return int(self.counts[idx][rows][:, cols].sum())
+
+    def total(self, collection: Names = None, dynasty: Names = None) -> int:
+        rows, cols = self._cells(collection, dynasty)
+        return int(self.counts[:, rows][:, :, cols].sum())
+
+    def frequency(self, ch: str, collection: Names = None, dynasty: Names = None) -> float:
+        """Return the share of ``ch`` among the characters of the selected cells."""
+        total = self.total(collection, dynasty)
+        return self.count(ch, collection, dynasty) / total if total else 0.0
+
+    def most_common(self, n: int = 10, collection: Names = None,
+                    dynasty: Names = None) -> List[Tuple[str, int]]:
+        counts = self.slice(collection, dynasty)
+        top = np.argsort(-counts, kind='stable')[:n]
+        return [(chr(self.chars[idx]), int(counts[idx])) for idx in top if counts[idx]]
+
+    def tone_distribution(self, collection: Names = None, dynasty: Names = None) -> np.ndarray:
+        """Return the share of each tone among the selected characters."""
+        rows, cols = self._cells(collection, dynasty)
+        counts = self.tones[rows][:, cols].sum(axis=(0, 1))
+        total = counts.sum()
+        return counts / total if total else counts.astype(float)
+
+    def char_tone_counts(self, ch: str) -> np.ndarray:
+        """Return how often ``ch`` is read in each tone."""
+        idx = self.char_id(ch)
+        return self.char_tones[idx] if idx >= 0 else np.zeros(NUM_TONES, dtype=np.int64)
+
+    def top_bigrams(self, n: int = 10, collection: Names = None,
+                    dynasty: Names = None) -> List[Tuple[str, int]]:
+        rows, cols = self._cells(collection, dynasty)
+        cells = np.zeros((len(self.collections), len(self.dynasties)), dtype=bool)
+        cells[np.ix_(np.arange(len(self.collections))[rows], np.arange(len(self.dynasties))[cols])] = True
+        keep = cells.ravel()[self.bigram_cells]
+        keys, counts = self.bigrams[keep], self.bigram_counts[keep]
+        if not len(keys):
+            return []
+        starts = np.flatnonzero(np.r_[True, keys[1:] != keys[:-1]])
+        keys, counts = keys[starts], np.add.reduceat(counts, starts)
+        top = np.argsort(-counts, kind='stable')[:n]
+        return [(chr(int(keys[idx]) >> 21) + chr(int(keys[idx]) & 0x1FFFFF), int(counts[idx]))
+                for idx in top]
+
+    def save(self, path: str) -> None:
+        tmp_path = f'{path}.tmp.npz'
+        np.savez_compressed(
+            tmp_path, chars=self.chars, counts=_smallest(self.counts),
+            char_tones=_smallest(self.char_tones), tones=self.tones, bigrams=self.bigrams,
+            bigram_cells=self.bigram_cells, bigram_counts=_smallest(self.bigram_counts),
+            names=np.array(json.dumps({'collections': self.collections,
+                                       'dynasties': self.dynasties}, ensure_ascii=False)))
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CharStats':
+        with np.load(path) as data:
+            names = json.loads(str(data['names']))
+            return cls(data['chars'], names['collections'], names['dynasties'],
+                       data['counts'].astype(np.int64), data['char_tones'].astype(np.int64),
+                       data['tones'], data['bigrams'], data['bigram_cells'],
+                       data['bigram_counts'].astype(np.int64))
+
+
+def merge_stats(files: Iterable[Tuple[str, str, FileStats]]) -> CharStats:
+    """Add up the counts of ``(collection, dynasty, file counts)`` triples."""
+
+    files = list(files)
+    collections = sorted({collection for collection, _, _ in files})
+    dynasties = sorted({dynasty for _, dynasty, _ in files})
+    chars = np.unique(np.concatenate([stats.chars for _, _, stats in files]
+                                     or [np.zeros(0, dtype=np.uint32)]))
+    # tone distributions leave punctuation out
+    spoken = np.array([_kind(code) == _CHAR for code in chars.tolist()], dtype=bool)
+    counts = np.zeros((len(chars), len(collections), len(dynasties)), dtype=np.int64)
+    char_tones = np.zeros((len(chars), NUM_TONES), dtype=np.int64)
+    tones = np.zeros((len(collections), len(dynasties), NUM_TONES), dtype=np.int64)
+    cell_bits = max(1, (len(collections) * len(dynasties) - 1).bit_length())
+    keys = []
+    values = []
+    for collection, dynasty, stats in files:
+        row, col = collections.index(collection), dynasties.index(dynasty)
+        ids = np.searchsorted(chars, stats.chars)
+        counts[ids, row, col] += stats.char_tones.sum(axis=1)
+        char_tones[ids] += stats.char_tones
+        tones[row, col] += stats.char_tones[spoken[ids]].sum(axis=0)
+        # a bigram takes 42 bits, leaving room for the cell in one sort key
+        keys.append((stats.bigrams.astype(np.uint64) << np.uint64(cell_bits))
+                    | np.uint64(row * len(dynasties) + col))
+        values.append(stats.bigram_counts)
+    key = np.concatenate(keys) if keys else np.zeros(0, dtype=np.uint64)
+    bigram_counts = np.concatenate(values) if values else np.zeros(0, dtype=np.int64)
+    order = np.argsort(key, kind='stable')
+    key, bigram_counts = key[order], bigram_counts[order]
+    if len(key):
+        starts = np.flatnonzero(np.r_[True, key[1:] != key[:-1]])
+        key, bigram_counts = key[starts], np.add.reduceat(bigram_counts, starts)
+    cells = (key & np.uint64((1 << cell_bits) - 1)).astype(np.int64)
+    cell_type = np.uint16 if cell_bits <= 16 else np.uint32
+    return CharStats(chars, collections, dynasties, counts, char_tones, tones,
+                     key >> np.uint64(cell_bits), cells.astype(cell_type), bigram_counts)
+
+
+def collection_of(relpath: str) -> str:
+    """Return the collection of a file: its top directory under the data directory."""
+    parts = os.path.normpath(relpath).split(os.sep)
+    return parts[0] if len(parts) > 1 else ''
+
+
+def dynasty_of(relpath: str, datasets: Dict[str, Dict[str, str]] | None = None) -> str:
+    """Return the dynasty of the works of a file, ``''`` if unknown.
+
+    ``datasets`` is the ``datasets`` object of ``loader/datas.json``; the
+    dataset whose path contains ``relpath`` names the dynasty if it has one.
+    """
+
+    relpath = os.path.normpath(relpath)
+    for name, configs in (datasets or {}).items():
+        path = os.path.normpath(configs['path'])
+        if relpath == path or relpath.startswith(path + os.sep):
+            return file_dynasty(name, relpath) or ''
+    return file_dynasty('', relpath) or ''
+
+
+def delta_path(index_dir: str, digest: str) -> str:
+    """Return the path of the counts of the file with SHA-1 ``digest``."""
+    return os.path.join(index_dir, STATS_DIR, f'{digest}.npz')
+
+
+def load_stats(index_dir: str) -> CharStats:
+    return CharStats.load(os.path.join(index_dir, STATS))
@@ -0,0 +1,109 @@
+"""Memoized pinyin and tone lookup for index building.
+
+A corpus has a few thousand distinct characters but millions of
+occurrences, so pypinyin is consulted once per character and the answer is
+kept in a :class:`ToneTable`.  The table is saved as ``tones.json`` next to
+the index and reused by later builds::
+
+    from lib.tones import ToneTable
+
+    tones = ToneTable.load('./index/tones.json')
+    tones.tone('月')           # 4
+    tones.lookup('乐')         # ('le4', 4, ['le4', 'yue4'])
+    tones.line_tones('音乐')   # [1, 4], read with the whole line as context
+    tones.save('./index/tones.json')
+"""
+
+from __future__ import annotations
+
+import json
+import os
+from typing import Dict, List, Tuple
+
+from pypinyin import Style, lazy_pinyin, pinyin
+
+TONES = 'tones.json'
+
+#: ``(pinyin, tone, heteronym readings)`` for one character.
+Reading = Tuple[str, int, List[str]]
+
+
+def tone_digit(reading: str) -> int:
+    """Return the tone number of a ``Style.TONE3`` reading, 0 if it has none."""
+
+    for c in reading:
+        if c.isdigit():
+            try:
+                return int(c)
+            except ValueError:
+                return 0
+    return 0
+
+
+class ToneTable:
+    """Character to reading table filled lazily from pypinyin."""
+
+    def __init__(self, entries: Dict[str, Reading] | None = None) -> None:
+        self.entries: Dict[str, Reading] = dict(entries or {})
+        self.added: Dict[str, Reading] = {}
+
+    @classmethod
+    def load(cls, path: str) -> 'ToneTable':
+        """Load a saved table, or return an empty one if ``path`` is missing."""
+
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'r', encoding='utf-8') as fh:
+            data = json.load(fh)
+        return cls({ch: (py, tone, list(readings)) for ch, (py, tone, readings) in data.items()})
+
+    def save(self, path: str) -> None:
+        """Write the table as JSON sorted by character."""
+
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(dict(sorted(self.entries.items())), fh, ensure_ascii=False, indent=0)
+        os.replace(tmp_path, path)
+
+    def update(self, entries: Dict[str, Reading]) -> None:
+        """Merge readings computed elsewhere, e.g. by a worker process."""
+
+        for ch, reading in entries.items():
+            if ch not in self.entries:
+                self.entries[ch] = self.added[ch] = reading
+
+    def lookup(self, ch: str) -> Reading:
+        """Return ``(pinyin, tone, heteronyms)`` for ``ch``."""
+
+        reading = self.entries.get(ch)
+        if reading is None:
+            py = pinyin(ch, style=Style.TONE3, heteronym=True)
+            readings = list(py[0]) if py and py[0] else ['']
+            reading = (readings[0], tone_digit(readings[0]), readings)
+            self.entries[ch] = self.added[ch] = reading
+        return reading
+
+    def tone(self, ch: str) -> int:
+        """Return the default tone of ``ch``."""
+
+        return self.lookup(ch)[1]
+
+    def line_tones(self, line: str) -> List[int]:
+        """Return one tone per character of ``line``, using it as context.
+
+        Only heteronyms depend on context; pypinyin is called once for the
+        whole line when the line contains any, and every other character is
+        answered from the table.
+        """
+
+        readings = [self.lookup(ch) for ch in line]
+        tones = [reading[1] for reading in readings]
+        if not any(len(reading[2]) > 1 for reading in readings):
+            return tones
+        contextual = lazy_pinyin(line, style=Style.TONE3, errors=lambda text: [''] * len(text))
+        if len(contextual) != len(line):
+            return tones
+        for idx, reading in enumerate(readings):
+            if len(reading[2]) > 1 and contextual[idx]:
+                tones[idx] = tone_digit(contextual[idx])
+        return tones
@@ -0,0 +1,213 @@
+"""Check that the corpus JSON files parse and hold the expected fields.
+
+Every ``.json`` file under the book directories, ``strains/`` and ``rank/``
+is parsed.  Files belonging to a dataset of ``loader/datas.json`` are also
+checked against its schema: the dataset's ``tag`` field must be a list of
+lines, and an optional ``schema`` object names further required fields and
+their types (``str``, ``int``, ``list``, ``lines``, ``dict``; a trailing
+``?`` also allows ``null``)::
+
+    "songci": {"path": "宋词/", "tag": "paragraphs", "schema": {"rhythmic": "str"}, ...}
+
+Files are checked in worker processes.  Results are cached by file content:
+a file whose size and modification time are unchanged is skipped, and one
+that was only touched is hashed and skipped if its SHA-1 matches::
+
+    from lib.validate import validate
+
+    report = validate('.', jobs=4, cache_path='.validate-cache.json')
+    report['failed']   # paths of the files with errors
+"""
+
+from __future__ import annotations
+
+import fnmatch
+import hashlib
+import json
+import multiprocessing
+import os
+from typing import Any, Dict, Iterator, List, Sequence, Tuple
+
+from lib.corpuscache import file_digest
+from loader.data_loader import DATAS_CONFIG
+
+#: Schemas of the directories parallel to the texts, by path pattern.
+EXTRA_SCHEMAS = {
+    'strains/json/*.json': {'id': 'str', 'strains': 'lines'},
+    'rank/*/*.json': {'author': 'str'},
+}
+
+#: Errors reported per file before the rest are counted only.
+MAX_ERRORS = 10
+
+_TYPES = {
+    'str': lambda value: isinstance(value, str),
+    'int': lambda value: isinstance(value, int) and not isinstance(value, bool),
+    'list': lambda value: isinstance(value, list),
+    'dict': lambda value: isinstance(value, dict),
+    'lines': lambda value: isinstance(value, list) and all(isinstance(v, str) for v in value),
+}
+
+Schema = Dict[str, str]
+
+
+def is_book_directory(name: str) -> bool:
+    """Return whether ``name`` is a directory of the corpus, named in Chinese."""
+    return any('一' < ch < '鿿' for ch in name)
+
+
+def schemas(root: str, config_path: str = DATAS_CONFIG) -> List[Tuple[str, Schema | None]]:
+    """Return ``(path pattern, schema)`` pairs, most specific first."""
+
+    with open(config_path, 'r', encoding='utf-8') as fh:
+        datasets = json.load(fh)['datasets']
+    found = []
+    for configs in datasets.values():
+        schema = {configs['tag']: 'lines', **configs.get('schema', {})}
+        path = os.path.normpath(configs['path'])
+        if os.path.isdir(os.path.join(root, path)):
+            found.append((os.path.join(path, '*'), schema, configs.get('excludes', [])))
+        else:
+            found.append((path, schema, []))
+    found.extend((pattern, schema, []) for pattern, schema in EXTRA_SCHEMAS.items())
+    # the excluded files of a dataset only need to parse
+    ordered: List[Tuple[str, Schema | None]] = []
+    for pattern, schema, excludes in found:
+        ordered.extend((os.path.join(os.path.dirname(pattern), name), None) for name in excludes)
+        ordered.append((pattern, schema))
+    return ordered
+
+
+def schema_for(relpath: str, patterns: Sequence[Tuple[str, Schema | None]]) -> Schema | None:
+    """Return the schema of the file at ``relpath``, ``None`` if it only needs to parse."""
+    for pattern, schema in patterns:
+        if fnmatch.fnmatchcase(relpath, pattern) or relpath.startswith(pattern + os.sep):
+            return schema
+    return None
+
+
+def corpus_files(root: str) -> Iterator[str]:
+    """Yield the relative paths of the corpus JSON files under ``root``, sorted."""
+    tops = sorted(name for name in os.listdir(root) if os.path.isdir(os.path.join(root, name))
+                  and (is_book_directory(name) or name in ('strains', 'rank')))
+    for top in tops:
+        for dirpath, dirnames, filenames in os.walk(os.path.join(root, top)):
+            dirnames.sort()
+            for name in sorted(filenames):
+                if name.endswith('.json'):
+                    yield os.path.relpath(os.path.join(dirpath, name), root)
+
+
+def check_entries(data: Any, schema: Schema) -> List[str]:
+    """Return the schema errors of the parsed file ``data``."""
+
+    if not isinstance(data, list):
+        return ['not a JSON array']
+    errors = []
+    for idx, entry in enumerate(data):
+        if not isinstance(entry, dict):
+            errors.append(f'entry {idx}: not an object')
+            continue
+        for field, kind in schema.items():
+            if field not in entry:
+                errors.append(f'entry {idx}: missing {field!r}')
+            elif kind.endswith('?') and entry[field] is None:
+                continue
+            elif not _TYPES[kind.rstrip('?')](entry[field]):
+                errors.append(f'entry {idx}: {field!r} is not {kind}')
+    return errors
+
+
+def check_file(args: Tuple[str, str, Schema | None]) -> Dict[str, Any]:
+    """Parse one file and check it against its schema.  Runs in a worker."""
+
+    root, relpath, schema = args
+    path = os.path.join(root, relpath)
+    stat = os.stat(path)
+    with open(path, 'rb') as fh:
+        data = fh.read()
+    result: Dict[str, Any] = {
+        'sha1': hashlib.sha1(data).hexdigest(), 'size': stat.st_size,
+        'mtime_ns': stat.st_mtime_ns, 'schema': schema,
+    }
+    try:
+        parsed = json.loads(data.decode('utf-8'))
+    except ValueError as exc:
+        result['errors'] = [f'invalid JSON: {exc}']
+        return result
+    errors = check_entries(parsed, schema) if schema is not None else []
+    result['entries'] = len(parsed) if isinstance(parsed, list) else None
+    result['errors'] = errors[:MAX_ERRORS]
+    if len(errors) > MAX_ERRORS:
+        result['errors'].append(f'... {len(errors) - MAX_ERRORS} more')
+    return result
+
+
+def _cached(root: str, relpath: str, schema: Schema | None,
+            previous: Dict[str, Any] | None) -> Dict[str, Any] | None:
+    """Return the previous result of ``relpath`` if the file and schema are unchanged."""
+
+    if previous is None or previous.get('schema') != schema:
+        return None
+    stat = os.stat(os.path.join(root, relpath))
+    if stat.st_size != previous['size']:
+        return None
+    if stat.st_mtime_ns == previous['mtime_ns']:
+        return previous
+    if file_digest(os.path.join(root, relpath)) == previous['sha1']:
+        return dict(previous, mtime_ns=stat.st_mtime_ns)
+    return None
+
+
+def validate(root: str = '.', config_path: str = DATAS_CONFIG, jobs: int = 1,
+             cache_path: str | None = None, paths: Sequence[str] = ()) -> Dict[str, Any]:
+    """Validate the corpus under ``root`` and return the report.
+
+    ``paths`` restricts the run to the files under these relative paths.
+    With ``cache_path`` the results of unchanged files are reused from the
+    previous run and the new results saved there.
+    """
+
+    patterns = schemas(root, config_path)
+    files = [relpath for relpath in corpus_files(root)
+             if not paths or any(relpath == p or relpath.startswith(p.rstrip('/') + os.sep)
+                                 for p in paths)]
+    previous: Dict[str, Any] = {}
+    if cache_path and os.path.exists(cache_path):
+        with open(cache_path, 'r', encoding='utf-8') as fh:
+            previous = json.load(fh)
+
+    results: Dict[str, Dict[str, Any]] = {}
+    todo = []
+    for relpath in files:
+        schema = schema_for(relpath, patterns)
+        cached = _cached(root, relpath, schema, previous.get(relpath))
+        if cached is not None:
+            results[relpath] = cached
+        else:
+            todo.append((root, relpath, schema))
+    reused = len(results)
+    if jobs > 1 and len(todo) > 1:
+        with multiprocessing.Pool(jobs) as pool:
+            checked = pool.map(check_file, todo, chunksize=max(1, len(todo) // (jobs * 8)))
+    else:
+        checked = [check_file(task) for task in todo]
+    for (_, relpath, _), result in zip(todo, checked):
+        results[relpath] = result
+
+    if cache_path:
+        cache = dict(previous)
+        cache.update(results)
+        tmp_path = f'{cache_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as fh:
+            json.dump(cache, fh, ensure_ascii=False, sort_keys=True)
+        os.replace(tmp_path, cache_path)
+
+    results = dict(sorted(results.items()))
+    return {
+        'files': len(results),
+        'checked': len(todo),
+        'cached': reused,
+        'failed': [relpath for relpath, result in results.items() if result['errors']],
+        'results': results,
+    }
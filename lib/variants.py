@@ -0,0 +1,62 @@
+"""Fold traditional and variant characters to one canonical form.
+
+``variants.txt`` maps some 2,800 traditional and variant characters to
+their simplified form, leaving out those whose simplified form is a
+different character in classical text (乾 is not 干).  ``preprocess.py --fold-variants`` indexes every
+occurrence under its canonical character and keeps the character as written
+in the ``surface`` column, so one postings list answers for all forms of a
+character and a search can still ask for a single form::
+
+    from lib.variants import fold, fold_text, variants
+
+    fold('樂')          # '乐'
+    fold_text('明月樓')  # '明月楼'
+    variants('乐')      # ['乐', '樂']
+"""
+
+from __future__ import annotations
+
+import os
+from functools import lru_cache
+from typing import Dict, List
+
+VARIANTS = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'variants.txt')
+
+
+@lru_cache(maxsize=None)
+def load_variants(path: str = VARIANTS) -> Dict[str, str]:
+    """Return the variant to canonical character table stored at ``path``."""
+
+    table = {}
+    with open(path, 'r', encoding='utf-8') as fh:
+        for line in fh:
+            if line.startswith('#') or not line.strip():
+                continue
+            variant, canonical = line.split()
+            table[variant] = canonical
+    return table
+
+
+@lru_cache(maxsize=None)
+def _forms() -> Dict[str, List[str]]:
+    forms: Dict[str, List[str]] = {}
+    for variant, canonical in sorted(load_variants().items()):
+        forms.setdefault(canonical, [canonical]).append(variant)
+    return forms
+
+
+def fold(ch: str) -> str:
+    """Return the canonical form of the character ``ch``."""
+    return load_variants().get(ch, ch)
+
+
+def fold_text(text: str) -> str:
+    """Return ``text`` with every character folded."""
+    table = load_variants()
+    return ''.join(table.get(ch, ch) for ch in text)
+
+
+def variants(ch: str) -> List[str]:
+    """Return every form folding together with ``ch``, the canonical one first."""
+    canonical = fold(ch)
+    return list(_forms().get(canonical, [canonical]))
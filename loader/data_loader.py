@@ -1,13 +1,30 @@
 import json
 import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from itertools import islice
+from typing import Iterator, List, Tuple
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.jsonstream import entry_lines, iter_array  # noqa: E402
 
 
 DATAS_CONFIG = "./loader/datas.json"
 
 
 class PlainDataLoader():
-    def __init__(self, config_path: str=DATAS_CONFIG) -> None:
+    def __init__(self, config_path: str=DATAS_CONFIG, cache_dir: str=None,
+                 db_path: str=None) -> None:
+        """With ``cache_dir`` lines are read from a binary cache of each file,
+        built by ``lib.corpuscache`` on first use.  With ``db_path`` they are
+        read from a database written by ``scripts/export_db.py`` instead."""
         self._path = config_path
+        self.cache_dir = cache_dir
+        self.db = None
+        if db_path:
+            from lib.corpusdb import CorpusDB
+            self.db = CorpusDB(db_path)
         with open(config_path, 'r', encoding='utf-8') as config:
             data = json.load(config)
             self.top_level_path:str = data["cp_path"]
@@ -20,41 +37,115 @@ class PlainDataLoader():
         if target not in self.datasets:
             print(f"{target} is not included in datas.json as a dataset")
             return None
+        return list(self.iter_body(target))
+
+    def extract_from_multiple(self, targets: list) -> list:
+        return list(self.iter_multiple(targets))
+
+    def extract_with_ids(self, ids: list) -> list:
+        return list(self.iter_with_ids(ids))
+
+    def files(self, target: str) -> List[Tuple[str, str]]:
+        """Return the ``(path, tag)`` of every file of ``target``, in reading order."""
         configs = self.datasets[target]
         tag = configs["tag"]
-        body = []  # may get a bit huge... 
         full_path = os.path.join(self.top_level_path, configs["path"])
         if os.path.isfile(full_path):  # single file json
-            with open(full_path, mode='r', encoding='utf-8') as file:
-                data = json.load(file)
-                for poem in data:
-                    body += poem[tag]
-            return body
+            return [(full_path, tag)]
         # a dir, probably with a skip list
-        subpaths = os.listdir(full_path)
-        for filename in subpaths:
-            if filename in configs["excludes"]:
+        return [
+            (os.path.join(full_path, filename), tag)
+            for filename in sorted(os.listdir(full_path))
+            if filename not in configs.get("excludes", ())
+        ]
+
+    def iter_body(self, target: str, workers: int = 0, processes: bool = False) -> Iterator[str]:
+        """Yield the lines of ``target`` lazily.
+
+        With ``workers`` a thread pool (a process pool with ``processes``)
+        reads and decodes the next files while the current one is consumed;
+        the lines come in the same order either way.
+        """
+        return self.iter_multiple([target], workers, processes)
+
+    def iter_multiple(self, targets: list, workers: int = 0,
+                      processes: bool = False) -> Iterator[str]:
+        if self.db is not None:
+            return (line for target in targets for line in self.db.iter_lines(target))
+        files = [
+            (path, tag, self.cache_dir)
+            for target in targets for path, tag in self.files(target)
+        ]
+        if workers:
+            return _prefetch(files, workers, processes)
+        return (line for file in files for line in _iter_lines(*file))
+
+    def iter_with_ids(self, ids: list, workers: int = 0,
+                      processes: bool = False) -> Iterator[str]:
+        return self.iter_multiple([self.id_table[id] for id in ids], workers, processes)
+
+    def poem(self, target: str, index: int) -> list:
+        """Return the lines of poem ``index`` of ``target``, counted across its files.
+
+        Every backend reads a string under the tag as one line and skips the
+        entries without the tag, so an ``index`` names the same poem in the
+        files, the cache and the database.  With a cache only the poem counts
+        of the files before it are read.
+        """
+        if self.db is not None:
+            lines = self.db.poem(target, index)
+            if lines is None:
+                raise IndexError(index)
+            return lines
+        for path, tag in self.files(target):
+            if self.cache_dir:
+                from lib.corpuscache import open_cached
+                corpus = open_cached(path, tag, self.cache_dir)
+                if index < len(corpus):
+                    return corpus.poem(index)
+                index -= len(corpus)
                 continue
-            with open(os.path.join(full_path, filename), mode='r', encoding='utf-8') as file:
-                data = json.load(file)
-                for poem in data:
-                    body += poem[tag]
-        return body
+            for entry in iter_array(path):
+                lines = entry_lines(entry, tag)
+                if lines is None:
+                    continue
+                if index == 0:
+                    return lines
+                index -= 1
+        raise IndexError(index)
+
+
+def _iter_lines(path: str, tag: str, cache_dir: str=None) -> Iterator[str]:
+    if cache_dir:
+        from lib.corpuscache import open_cached
+        yield from open_cached(path, tag, cache_dir).lines()
+        return
+    for entry in iter_array(path):
+        yield from entry_lines(entry, tag) or ()
+
+
+def _read_lines(path: str, tag: str, cache_dir: str=None) -> List[str]:
+    return list(_iter_lines(path, tag, cache_dir))
 
-    def extract_from_multiple(self, targets: list) -> list:
-        results = []
-        for target in targets:
-            results += self.body_extractor(target)
-        return results
-    
-    def extract_with_ids(self, ids: list) -> list:
-        results = []
-        for id in ids:
-            results += self.body_extractor(
-                self.id_table[id]
-            )
-        return results
 
+def _prefetch(files: List[Tuple[str, str, str]], workers: int,
+              processes: bool) -> Iterator[str]:
+    """Yield the lines of ``files`` in order, reading up to ``2 * workers`` files ahead."""
+    executor = ProcessPoolExecutor if processes else ThreadPoolExecutor
+    files = iter(files)
+    pending = deque()
+    with executor(workers) as pool:
+        try:
+            for file in islice(files, 2 * workers):
+                pending.append(pool.submit(_read_lines, *file))
+            while pending:
+                lines = pending.popleft().result()
+                for file in islice(files, 1):
+                    pending.append(pool.submit(_read_lines, *file))
+                yield from lines
+        finally:
+            for future in pending:
+                future.cancel()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,37 @@
+"""Merge the segments of an index built by ``preprocess.py``."""
+
+from __future__ import annotations
+
+import os
+import sys
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.indexer import read_manifest  # noqa: E402
+from lib.segments import MERGE_FACTOR, compact  # noqa: E402
+
+
+@click.command()
+@click.option('--index-dir', default='./index', show_default=True,
+              help='Directory containing the segmented index.')
+@click.option('--factor', default=MERGE_FACTOR, show_default=True, type=click.IntRange(min=2),
+              help='Number of similar sized segments merged into one.')
+@click.option('--full', is_flag=True,
+              help='Merge every segment into one and drop all deleted works.')
+def main(index_dir: str, factor: int = MERGE_FACTOR, full: bool = False) -> None:
+    """Merge small index segments and apply deletions.
+
+    Safe to run while searches are served from the same index: segments are
+    replaced only after the merged one is complete.  Do not run it while
+    ``preprocess.py`` is updating the index.
+    """
+
+    merges = compact(index_dir, factor=factor, full=full)
+    manifest = read_manifest(index_dir) or {}
+    segments = manifest.get('segments', [])
+    click.echo(f'{merges} merges, {len(segments)} segments left')
+
+
+if __name__ == '__main__':
+    main()
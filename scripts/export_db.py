@@ -0,0 +1,51 @@
+"""Export the datasets of ``loader/datas.json`` to a SQLite database."""
+
+from __future__ import annotations
+
+import os
+import sys
+import time
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.corpusdb import build_database  # noqa: E402
+from loader.data_loader import DATAS_CONFIG, PlainDataLoader  # noqa: E402
+
+
+@click.command()
+@click.option('--config', default=DATAS_CONFIG, show_default=True,
+              help='Datasets config listing the files to export.')
+@click.option('--output', default='./corpus.db', show_default=True,
+              help='Database file to write; replaced atomically.')
+@click.option('--dataset', 'datasets', multiple=True,
+              help='Export only this dataset; can be given multiple times.')
+def main(config: str, output: str, datasets: tuple[str, ...] = ()) -> None:
+    """Write every work with its authors, strains and rank data to one database.
+
+    The database has indexes on author, title, rhythmic and dynasty and a
+    character-level full-text index; ``search.py --db`` and
+    ``PlainDataLoader(db_path=...)`` read from it.
+    """
+
+    loader = PlainDataLoader(config)
+    unknown = [name for name in datasets if name not in loader.datasets]
+    if unknown:
+        raise click.BadParameter(f"unknown dataset {', '.join(unknown)}", param_hint='--dataset')
+    files = {}
+    for name in datasets or loader.datasets:
+        try:
+            files[name] = loader.files(name)
+        except OSError as exc:
+            click.echo(f'Skipping {name}: {exc}', err=True)
+    start = time.perf_counter()
+    counts = build_database(output, loader.top_level_path, loader.datasets, files)
+    for name, count in counts.items():
+        click.echo(f'{name}: {count} works')
+    size = os.path.getsize(output) / (1 << 20)
+    click.echo(f'{sum(counts.values())} works written to {output} '
+               f'({size:.1f} MB) in {time.perf_counter() - start:.1f}s')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,40 @@
+"""Print poems joined with their strains and rank records."""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.joins import build_join, open_join  # noqa: E402
+
+
+@click.command()
+@click.option('--root', default='.', show_default=True, help='Corpus root directory.')
+@click.option('--join', 'join_path', default='./index/join.bin', show_default=True,
+              help='Join file; built or refreshed when missing or stale.')
+@click.option('--id', 'work_ids', multiple=True,
+              help='Work id to print; can be given multiple times.')
+@click.option('--rebuild', is_flag=True, help='Rebuild the join even if it is up to date.')
+def main(root: str, join_path: str, work_ids: tuple[str, ...] = (), rebuild: bool = False) -> None:
+    """Print the text, strains and rank of each ``--id`` as a JSON line.
+
+    Only the shards holding the requested works are read.
+    """
+
+    if rebuild:
+        click.echo(f'{build_join(root, join_path)} works joined', err=True)
+    join = open_join(root, join_path)
+    for work_id in work_ids:
+        record = join.get(work_id)
+        if record is None:
+            click.echo(f'Unknown work id {work_id}', err=True)
+            continue
+        click.echo(json.dumps(record, ensure_ascii=False))
+
+
+if __name__ == '__main__':
+    main()
@@ -4,12 +4,33 @@ from __future__ import annotations
 
 import glob
 import json
+import multiprocessing
 import os
-from collections import defaultdict
-from typing import Any, Dict, Iterable, List
+import shutil
+import sys
+import tempfile
+from typing import Any, Dict, Iterable, Iterator, List, Sequence, Set, Tuple
 
 import click
-from pypinyin import Style, pinyin
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.cooccur import add_paragraph, new_paragraphs  # noqa: E402
+from lib.corpuscache import file_digest  # noqa: E402
+from lib.docstore import DOCSTORE, DocStore, DocStoreBuilder  # noqa: E402
+from lib.indexer import JSON_INDEX, MANIFEST_VERSION, new_builder, read_manifest  # noqa: E402
+from lib.jsonstream import NotAnArray, iter_array  # noqa: E402
+from lib.postings import PostingsBuilder, PostingsFile  # noqa: E402
+from lib.segments import (  # noqa: E402
+    compact, file_works, next_segment, open_segment, remove_unused, work_range, write_manifest,
+    write_segment)
+from lib.stats import (  # noqa: E402
+    STATS, STATS_DIR, FileStats, StatsBuilder, collection_of, delta_path, dynasty_of, merge_stats)
+from lib.tones import TONES, Reading, ToneTable  # noqa: E402
+from lib.variants import fold as fold_char  # noqa: E402
+
+#: The datasets config of this checkout, found wherever the script runs from.
+DATAS_PATH = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                          'loader', 'datas.json')
 
 
 def _extract_lines(entry: Dict[str, Any]) -> Iterable[str]:
@@ -22,87 +43,390 @@ def _extract_lines(entry: Dict[str, Any]) -> Iterable[str]:
     return []
 
 
+def _entries(json_path: str) -> Iterator[Any]:
+    """Yield the entries of a corpus file one at a time.
+
+    A file that is not a JSON array yields nothing.  A read or decoding
+    error is logged and ends the file; the entries before it are kept.
+    """
+
+    try:
+        yield from iter_array(json_path)
+    except NotAnArray:
+        return
+    except (OSError, ValueError) as exc:  # pragma: no cover - errors are logged
+        click.echo(f'Failed to load {json_path}: {exc}', err=True)
+
+
+def _index_file(json_path: str, char_index: PostingsBuilder, docs: DocStoreBuilder,
+                tones: ToneTable, tone_context: bool = False,
+                paragraphs: PostingsBuilder | None = None, fold: bool = False,
+                stats: StatsBuilder | None = None) -> List[int]:
+    """Add the postings and work records of one JSON file to the builders.
+
+    Tones come from the memoized ``tones`` table; with ``tone_context`` the
+    readings of heteronyms are resolved per line.  ``paragraphs`` receives
+    the distinct characters of every paragraph.  With ``fold`` characters
+    are indexed under their canonical form, the written one going to the
+    ``surface`` column of a builder made by ``new_builder(fold=True)``.
+    ``stats`` receives every line with its tones.  Returns the ids of the
+    works the file contains, in the order they first appear.
+    """
+
+    used: Dict[int, None] = {}
+    for para_idx, entry in enumerate(_entries(json_path), start=1):
+        lines = _extract_lines(entry)
+        if not isinstance(lines, Iterable):
+            continue
+
+        work_id = (
+            entry.get('id')
+            or entry.get('uuid')
+            or (
+                f"{os.path.splitext(os.path.basename(json_path))[0]}-"
+                f"{para_idx}"
+            )
+        )
+        entry_type = 'ci' if 'rhythmic' in entry else 'poetry'
+        work = char_index.intern('work_id', work_id)
+        kind = char_index.intern('type', entry_type)
+        used[work] = None
+        docs.add(work_id, entry, (line for line in lines if isinstance(line, str)))
+
+        chars: Set[str] = set()
+        for line_idx, line in enumerate(lines, start=1):
+            if not isinstance(line, str):
+                continue
+            if tone_context:
+                line_tones = tones.line_tones(line)
+            else:
+                line_tones = [tones.tone(ch) for ch in line]
+            if stats is not None:
+                stats.add_line(line, line_tones)
+            for pos_idx, (ch, tone) in enumerate(zip(line, line_tones), start=1):
+                if ch.isspace():
+                    continue
+                row = (work, kind, para_idx, line_idx, pos_idx, tone)
+                if fold:
+                    key = fold_char(ch)
+                    row += (ord(ch),)
+                else:
+                    key = ch
+                chars.add(key)
+                char_index.append(key, row)
+        if paragraphs is not None:
+            add_paragraph(paragraphs, work_id, para_idx, chars)
+    return list(used)
+
+
+def _index_shard(args: Tuple[int, List[str], str, Dict[str, Reading], bool, bool,
+                             List[str] | None]
+                 ) -> Tuple[str, str, str, List[List[int]], Dict[str, Reading]]:
+    """Index a contiguous shard of files into partial files under ``tmp_dir``.
+
+    Runs in a worker process.  Only the paths of the partial postings and
+    document store files travel back to the parent, which merges them,
+    together with the work ids of every file and the few tone readings the
+    worker had to compute.  The counts of each file are saved to its path
+    in ``stats_paths``, if given.
+    """
+
+    shard, paths, tmp_dir, known_tones, tone_context, fold, stats_paths = args
+    char_index = new_builder(fold)
+    paragraphs = new_paragraphs()
+    docs = DocStoreBuilder(spool_dir=tmp_dir)
+    tones = ToneTable(known_tones)
+    used = [
+        _index_and_count(json_path, char_index, docs, tones, tone_context, paragraphs, fold,
+                         stats_paths[idx] if stats_paths else None)
+        for idx, json_path in enumerate(paths)
+    ]
+    postings_path = os.path.join(tmp_dir, f'shard-{shard:05d}.bin')
+    paragraphs_path = os.path.join(tmp_dir, f'shard-{shard:05d}.para')
+    docs_path = os.path.join(tmp_dir, f'shard-{shard:05d}.docs')
+    char_index.write(postings_path)
+    paragraphs.write(paragraphs_path)
+    docs.write(docs_path)
+    return postings_path, paragraphs_path, docs_path, used, tones.added
+
+
+def _index_and_count(json_path: str, char_index: PostingsBuilder, docs: DocStoreBuilder,
+                     tones: ToneTable, tone_context: bool, paragraphs: PostingsBuilder,
+                     fold: bool, stats_path: str | None) -> List[int]:
+    """Index one file and, with ``stats_path``, save its counts there."""
+
+    stats = StatsBuilder() if stats_path else None
+    used = _index_file(json_path, char_index, docs, tones, tone_context, paragraphs, fold, stats)
+    if stats is not None:
+        stats.build().save(stats_path)
+    return used
+
+
+def _count_file(json_path: str, tones: ToneTable, tone_context: bool) -> FileStats:
+    """Return the counts of a file without indexing it."""
+
+    stats = StatsBuilder()
+    for entry in _entries(json_path):
+        lines = _extract_lines(entry)
+        if not isinstance(lines, Iterable):
+            continue
+        for line in lines:
+            if isinstance(line, str):
+                stats.add_line(line, tones.line_tones(line) if tone_context
+                               else [tones.tone(ch) for ch in line])
+    return stats.build()
+
+
+def _tokenize(paths: List[str], jobs: int, index_dir: str, char_index: PostingsBuilder,
+              paragraphs: PostingsBuilder, docs: DocStoreBuilder, tones: ToneTable,
+              tone_context: bool, fold: bool = False,
+              stats_paths: Dict[str, str] | None = None) -> Iterator[List[int]]:
+    """Tokenize ``paths`` in order, yielding the work ids of each file.
+
+    With several jobs the files are split into contiguous shards for a
+    process pool and the partial results are merged in shard order.  With
+    ``stats_paths`` the counts of every file are saved to its path there.
+    """
+
+    if jobs <= 1 or len(paths) <= 1:
+        for json_path in paths:
+            yield _index_and_count(json_path, char_index, docs, tones, tone_context, paragraphs,
+                                   fold, stats_paths[json_path] if stats_paths else None)
+        return
+
+    # Several shards per worker keep the pool busy when file sizes vary;
+    # merging the shards in order gives the same output as a serial run.
+    size = max(1, -(-len(paths) // (jobs * 4)))
+    shards = [paths[start:start + size] for start in range(0, len(paths), size)]
+    with tempfile.TemporaryDirectory(dir=index_dir) as tmp_dir, multiprocessing.Pool(jobs) as pool:
+        tasks = [
+            (shard, shard_paths, tmp_dir, tones.entries, tone_context, fold,
+             [stats_paths[path] for path in shard_paths] if stats_paths else None)
+            for shard, shard_paths in enumerate(shards)
+        ]
+        for postings_path, paragraphs_path, docs_path, used, added in pool.imap(_index_shard, tasks):
+            tones.update(added)
+            with open(postings_path, 'rb') as fh:
+                partial = PostingsFile(fh.read())
+            remap = [char_index.intern('work_id', name) for name in partial.tables['work_id']]
+            char_index.merge(partial)
+            with open(paragraphs_path, 'rb') as fh:
+                paragraphs.merge(PostingsFile(fh.read()))
+            docs.merge(DocStore.open(docs_path))
+            os.remove(postings_path)
+            os.remove(paragraphs_path)
+            os.remove(docs_path)
+            for file_used in used:
+                yield [remap[work] for work in file_used]
+
+
+def _previous_build(index_dir: str, options: Dict[str, Any]
+                    ) -> Tuple[Dict[str, Any], Dict[str, Sequence[str]]] | None:
+    """Return the manifest of a compatible earlier build and its segments' work ids."""
+
+    manifest = read_manifest(index_dir)
+    if (manifest is None or manifest.get('version') != MANIFEST_VERSION
+            or manifest.get('options') != options or not manifest.get('segments')):
+        return None
+    try:
+        works = {
+            segment['name']: open_segment(index_dir, segment['name'])[0].postings.tables['work_id']
+            for segment in manifest['segments']
+        }
+    except FileNotFoundError:
+        return None
+    return manifest, works
+
+
+def _clean_files(digests: Dict[str, str], manifest: Dict[str, Any],
+                 works: Dict[str, Sequence[str]]) -> Set[str]:
+    """Return the files whose postings in the previous build are still valid.
+
+    A file is clean when its content hash is unchanged and it shares no work
+    id with a changed or removed file; rows of a shared work id cannot be
+    told apart by file, so both sides are re-indexed.
+    """
+
+    previous = manifest['files']
+
+    def names(record: Dict[str, Any]) -> Set[str]:
+        return file_works(record, works[record['segment']])
+
+    clean = {
+        name for name, digest in digests.items()
+        if name in previous and previous[name]['sha1'] == digest
+    }
+    while True:
+        dirty: Set[str] = set()
+        for name, record in previous.items():
+            if name not in clean:
+                dirty |= names(record)
+        stale = {name for name in clean if names(previous[name]) & dirty}
+        if not stale:
+            return clean
+        clean -= stale
+
+
+def _write_stats(index_dir: str, json_files: List[str], names: Dict[str, str],
+                 digests: Dict[str, str], datasets: Dict[str, Dict[str, Any]],
+                 tones: ToneTable, tone_context: bool) -> None:
+    """Add up the counts of every file into ``stats.npz``; drop unused counts.
+
+    ``datasets`` is the ``datasets`` object of ``loader/datas.json``, which
+    gives the dynasty of each file.
+    """
+
+    counted = []
+    used = set()
+    for json_path in json_files:
+        name = names[json_path]
+        path = delta_path(index_dir, digests[name])
+        if not os.path.exists(path):
+            # a file left unchanged whose counts were removed
+            _count_file(json_path, tones, tone_context).save(path)
+        used.add(os.path.basename(path))
+        counted.append((collection_of(name), dynasty_of(name, datasets), FileStats.load(path)))
+    merge_stats(counted).save(os.path.join(index_dir, STATS))
+    stats_dir = os.path.join(index_dir, STATS_DIR)
+    for name in os.listdir(stats_dir):
+        if name not in used:
+            os.remove(os.path.join(stats_dir, name))
+
+
 @click.command()
 @click.option('--data-dir', default='./data', show_default=True,
               help='Directory containing poetry JSON files.')
 @click.option('--index-dir', default='./index', show_default=True,
               help='Directory to store generated index files.')
-def main(data_dir: str, index_dir: str) -> None:
-    """Build the inverted index from Chinese poetry JSON files."""
+@click.option('--format', 'index_format', type=click.Choice(['binary', 'json']),
+              default='binary', show_default=True,
+              help='binary writes char_index.bin; json exports char_index.json.')
+@click.option('--jobs', '-j', default=1, show_default=True, type=click.IntRange(min=1),
+              help='Number of worker processes used to tokenize the corpus.')
+@click.option('--tone-context/--no-tone-context', default=False, show_default=True,
+              help='Resolve tones of heteronyms from the whole line instead of per character.')
+@click.option('--incremental', is_flag=True,
+              help='Only re-index files whose content changed since the last build.')
+@click.option('--cooccur-top', default=0, show_default=True, type=click.IntRange(min=0),
+              help='Also store the N characters sharing the most paragraphs with each character.')
+@click.option('--phrase-index', is_flag=True,
+              help='Also store a positional bigram index for search.py --phrase.')
+@click.option('--fold-variants', is_flag=True,
+              help='Index traditional and variant characters under their simplified form.')
+@click.option('--stats', 'with_stats', is_flag=True,
+              help='Also store character, tone and bigram counts in stats.npz.')
+@click.option('--config', default=DATAS_PATH, show_default=True,
+              type=click.Path(exists=True, dir_okay=False),
+              help='Datasets config giving the dynasty of each file for --stats.')
+def main(data_dir: str, index_dir: str, index_format: str = 'binary', jobs: int = 1,
+         tone_context: bool = False, incremental: bool = False, cooccur_top: int = 0,
+         phrase_index: bool = False, fold_variants: bool = False,
+         with_stats: bool = False, config: str = DATAS_PATH) -> None:
+    """Build the inverted index from Chinese poetry JSON files.
 
+    A binary build writes the index as a segment under ``segments/`` and
+    records ``manifest.json``: the segments, and the content hash of each
+    file with the range of work ids it contributed.  With ``--incremental``
+    only added and changed files are tokenized again, into a new segment;
+    the works they replace are marked deleted in the older segments, and
+    small segments are then merged following :func:`lib.segments.compact`.
+
+    Every segment also gets ``paragraphs.bin``, the characters of each
+    paragraph, used by ``search.py --any-char3``; ``--cooccur-top`` adds the
+    ``cooccur.bin`` table ranking the characters found together, and
+    ``--phrase-index`` the ``bigrams.bin`` index of ``search.py --phrase``.
+    ``--fold-variants`` indexes each occurrence under its canonical
+    character, keeping the written form (see :mod:`lib.variants`).
+    ``--stats`` writes ``stats.npz``, the counts of :mod:`lib.stats`.
+    """
+
+    if fold_variants and index_format == 'json':
+        raise click.UsageError('--fold-variants needs the binary index format')
+    datasets: Dict[str, Dict[str, Any]] = {}
+    if with_stats:
+        # read before anything is written, so a bad config leaves the index as it was
+        with open(config, 'r', encoding='utf-8') as fh:
+            datasets = json.load(fh)['datasets']
     os.makedirs(index_dir, exist_ok=True)
+    tones_path = os.path.join(index_dir, TONES)
+    tones = ToneTable.load(tones_path)
 
-    char_index: Dict[str, List[Dict[str, Any]]] = defaultdict(list)
+    char_index = new_builder(fold_variants)
+    paragraphs = new_paragraphs()
+    docs = DocStoreBuilder(spool_dir=index_dir)
 
     json_pattern = os.path.join(data_dir, '**', '*.json')
-    json_files = glob.glob(json_pattern, recursive=True)
+    json_files = sorted(glob.glob(json_pattern, recursive=True))
+    names = {path: os.path.relpath(path, data_dir) for path in json_files}
+    digests = {names[path]: file_digest(path) for path in json_files}
 
-    for json_path in json_files:
-        try:
-            with open(json_path, 'r', encoding='utf-8') as fh:
-                data = json.load(fh)
-        except Exception as exc:  # pragma: no cover - errors are logged
-            click.echo(f'Failed to load {json_path}: {exc}', err=True)
-            continue
+    options = {'format': index_format, 'tone_context': tone_context, 'cooccur_top': cooccur_top,
+               'phrases': phrase_index, 'fold': fold_variants, 'stats': with_stats}
+    previous = _previous_build(index_dir, options) if incremental else None
+    clean: Set[str] = set()
+    segments: List[Dict[str, Any]] = []
+    if previous is not None:
+        manifest, works = previous
+        clean = _clean_files(digests, manifest, works)
+        deleted: Dict[str, Set[str]] = {
+            segment['name']: set(segment['deleted']) for segment in manifest['segments']
+        }
+        for name, record in manifest['files'].items():
+            if name not in clean:
+                deleted[record['segment']] |= file_works(record, works[record['segment']])
+        segments = [dict(segment, deleted=sorted(deleted[segment['name']]))
+                    for segment in manifest['segments']]
 
-        if not isinstance(data, list):
+    dirty = [path for path in json_files if names[path] not in clean]
+    stats_paths = None
+    if with_stats:
+        os.makedirs(os.path.join(index_dir, STATS_DIR), exist_ok=True)
+        stats_paths = {path: delta_path(index_dir, digests[names[path]]) for path in dirty}
+    segment = next_segment(index_dir) if index_format == 'binary' else None
+    tokenized = _tokenize(dirty, jobs, index_dir, char_index, paragraphs, docs, tones,
+                          tone_context, fold_variants, stats_paths)
+    files: Dict[str, Dict[str, Any]] = {}
+    start = 0
+    for json_path in json_files:
+        name = names[json_path]
+        if name in clean:
+            files[name] = previous[0]['files'][name]
             continue
+        fields, start = work_range(char_index, next(tokenized), start)
+        files[name] = {'sha1': digests[name], **fields}
+        if segment is not None:
+            files[name]['segment'] = segment
 
-        for para_idx, entry in enumerate(data, start=1):
-            lines = _extract_lines(entry)
-            if not isinstance(lines, Iterable):
-                continue
-
-            work_id = (
-                entry.get('id')
-                or entry.get('uuid')
-                or (
-                    f"{os.path.splitext(os.path.basename(json_path))[0]}-"
-                    f"{para_idx}"
-                )
-            )
-            entry_type = 'ci' if 'rhythmic' in entry else 'poetry'
-
-            for line_idx, line in enumerate(lines, start=1):
-                if not isinstance(line, str):
-                    continue
-                for pos_idx, ch in enumerate(line, start=1):
-                    if ch.isspace():
-                        continue
-
-                    tone_digit = 0
-                    py = pinyin(ch, style=Style.TONE3, heteronym=False)
-                    if py and py[0]:
-                        tone_str = py[0][0]
-                        digit = next(
-                            (c for c in tone_str if c.isdigit()),
-                            None,
-                        )
-                        if digit:
-                            try:
-                                tone_digit = int(digit)
-                            except ValueError:
-                                import unicodedata
-                                try:
-                                    tone_digit = int(unicodedata.digit(digit))
-                                except Exception:
-                                    tone_digit = 0
-
-                    char_index[ch].append(
-                        {
-                            'work_id': work_id,
-                            'type': entry_type,
-                            'paragraph': para_idx,
-                            'line': line_idx,
-                            'pos': pos_idx,
-                            'tone': tone_digit,
-                        }
-                    )
-
-    index_path = os.path.join(index_dir, 'char_index.json')
-    with open(index_path, 'w', encoding='utf-8') as fh:
-        json.dump(char_index, fh, ensure_ascii=False, indent=2)
+    manifest = {'version': MANIFEST_VERSION, 'options': options}
+    if index_format == 'json':
+        index_path = os.path.join(index_dir, JSON_INDEX)
+        with open(index_path, 'w', encoding='utf-8') as fh:
+            json.dump(char_index.to_dict(), fh, ensure_ascii=False, indent=2)
+        docs.write(os.path.join(index_dir, DOCSTORE))
+    else:
+        index_path = index_dir
+        if dirty or previous is None:
+            segments.append(write_segment(index_dir, segment, char_index, docs, paragraphs,
+                                          cooccur_top, phrase_index))
+        else:
+            docs.close()
+        manifest['segments'] = segments
+    manifest['files'] = files
+    if with_stats:
+        _write_stats(index_dir, json_files, names, digests, datasets, tones, tone_context)
+    else:
+        # counts of an earlier build would no longer match the index
+        shutil.rmtree(os.path.join(index_dir, STATS_DIR), ignore_errors=True)
+        if os.path.exists(os.path.join(index_dir, STATS)):
+            os.remove(os.path.join(index_dir, STATS))
+    tones.save(tones_path)
+    write_manifest(index_dir, manifest)
+    remove_unused(index_dir, manifest)
+    if incremental:
+        compact(index_dir)
 
+    if incremental:
+        click.echo(f'Re-indexed {len(dirty)} of {len(json_files)} files')
     click.echo(f'Char index saved to {index_path}')
 
 
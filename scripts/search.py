@@ -4,11 +4,411 @@ from __future__ import annotations
 
 import click
 
+import base64
+import hashlib
 import json
 import os
 import glob
+import sys
+from collections import Counter
+from itertools import islice
+from typing import Iterator, Mapping, Sequence, Tuple
 
-from lib.indexer import load_index
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.corpusdb import CorpusDB  # noqa: E402
+from lib.docstore import DocStore, open_docstore  # noqa: E402
+from lib.indexer import load_index  # noqa: E402
+from lib.jsonstream import iter_array  # noqa: E402
+from lib.matcher import has_rows, merge_join, sorted_keys  # noqa: E402
+from lib.phrases import is_punctuation, phrase_chars  # noqa: E402
+from lib.variants import fold_text, variants  # noqa: E402
+from lib.query import evaluate, parse, terms  # noqa: E402
+
+#: ``(char2 candidate, char3 candidate, key of char2, key of char3, swapped)``
+Position = Tuple[int, int, int, int, int]
+
+
+def extract_lines(entry: dict) -> list[str]:
+    for key in ("paragraphs", "paragraph", "para", "content"):
+        lines = entry.get(key)
+        if lines:
+            return lines
+    return []
+
+
+def load_work(work_id: str, docs: DocStore | None = None) -> dict | None:
+    if docs is not None:
+        return docs.get(work_id)
+    if '-' in work_id and work_id.rsplit('-', 1)[1].isdigit():
+        base, num = work_id.rsplit('-', 1)
+        pattern = os.path.join('.', '**', f'{base}.json')
+        idx = int(num) - 1
+        for path in glob.glob(pattern, recursive=True):
+            if idx < 0:
+                break
+            try:
+                entry = next(islice(iter_array(path), idx, None), None)
+            except Exception:
+                continue
+            if entry is not None:
+                return entry
+    for path in glob.glob('./**/*.json', recursive=True):
+        try:
+            for entry in iter_array(path):
+                if (
+                    isinstance(entry, dict)
+                    and (entry.get('id') == work_id or entry.get('uuid') == work_id)
+                ):
+                    return entry
+        except Exception:
+            continue
+    return None
+
+
+def highlight_line(line: str, pos: set[int]) -> str:
+    result = []
+    for idx, ch in enumerate(line, start=1):
+        if idx in pos:
+            result.append(click.style(ch, fg='red'))
+        else:
+            result.append(ch)
+    return ''.join(result)
+
+
+def join_matches(occs2: Sequence[dict], keyed2: tuple[list, list], occs3: Sequence[dict],
+                 keyed3: tuple[list, list], dist: str | None, rev: bool,
+                 after: tuple[int, int, int] | None = None
+                 ) -> Iterator[tuple[tuple[int, int, int], tuple[dict, dict]]]:
+    """Yield the matches of two postings lists from their :func:`sorted_keys`."""
+    keys2, rows2 = keyed2
+    keys3, rows3 = keyed3
+    start = after[:2] if after else (0, 0)
+    for i, j in merge_join(keys2, keys3, dist, rev, start):
+        o2 = occs2[rows2[i]]
+        o3 = occs3[rows3[j]]
+        pairs = [(o2, o3)] if not rev else [(o2, o3), (o3, o2)]
+        for swapped, pair in enumerate(pairs):
+            position = (i, j, swapped)
+            if after is None or position > after:
+                yield position, pair
+
+
+def iter_matches(idx: Mapping, c2: str, c3: str, src: tuple[str, ...], dist: str | None,
+                 rev: bool, after: tuple[int, int, int] | None = None,
+                 tones2: Sequence[int] = (), tones3: Sequence[int] = ()
+                 ) -> Iterator[tuple[tuple[int, int, int], tuple[dict, dict]]]:
+    """Yield ``(position, match)`` pairs, optionally resuming after ``after``.
+
+    A position is ``(i, j, swapped)``: the matched keys of ``c2`` and ``c3``
+    and, with ``rev``, whether the pair is reported in reverse order.  Only
+    occurrences read with one of ``tones2``/``tones3`` take part when given.
+    """
+    occs2 = idx.get(c2, [])
+    occs3 = idx.get(c3, [])
+    return join_matches(occs2, sorted_keys(occs2, src, tones2),
+                        occs3, sorted_keys(occs3, src, tones3), dist, rev, after)
+
+
+def find_matches(idx: Mapping, c2: str, c3: str, src: tuple[str, ...], dist: str | None,
+                 rev: bool) -> Iterator[tuple[dict, dict]]:
+    """Yield the occurrence pairs of ``c2`` and ``c3`` matching the constraints."""
+    for _, match in iter_matches(idx, c2, c3, src, dist, rev):
+        yield match
+
+
+def match_record(match: tuple[dict, dict], docs: DocStore | None = None) -> dict | None:
+    """Return the work of a match with the matched positions, or ``None``."""
+    occ_a, occ_b = match
+    entry = load_work(occ_a['work_id'], docs)
+    if not entry:
+        return None
+    lines = extract_lines(entry)
+    if not lines:
+        return None
+    return {
+        'work_id': occ_a['work_id'],
+        'type': occ_a['type'],
+        'title': entry.get('title') or entry.get('rhythmic') or 'Untitled',
+        'lines': list(lines),
+        'highlights': [[occ_a['line'], occ_a['pos']], [occ_b['line'], occ_b['pos']]],
+    }
+
+
+def print_match(match: tuple[dict, dict], docs: DocStore | None = None) -> None:
+    record = match_record(match, docs)
+    if record is None:
+        return
+    marks: dict[int, set[int]] = {}
+    for line_idx, pos in record['highlights']:
+        marks.setdefault(line_idx, set()).add(pos)
+    print(f"{record['title']} ({record['type']})")
+    for idx, line in enumerate(record['lines'], start=1):
+        if idx in marks:
+            print(highlight_line(line, marks[idx]))
+        else:
+            print(line)
+    print()
+
+
+def print_query_match(work_id: str, chars: set[str], docs: DocStore | None = None) -> None:
+    """Print a work matched by a boolean query, highlighting the query's characters."""
+    entry = load_work(work_id, docs)
+    if not entry:
+        return
+    print(f"{entry.get('title') or entry.get('rhythmic') or 'Untitled'} ({work_id})")
+    for line in extract_lines(entry):
+        print(highlight_line(line, {pos for pos, ch in enumerate(line, start=1) if ch in chars}))
+    print()
+
+
+def print_work(entry: dict) -> None:
+    """Print a work found by author or title."""
+    heading = entry.get('title') or entry.get('rhythmic') or 'Untitled'
+    print(f"{heading} ({entry.get('author') or 'Anonymous'}, {entry['id']})")
+    for line in extract_lines(entry):
+        print(line)
+    print()
+
+
+def scan_phrase(index: Mapping, text: str, loose: bool = False,
+                source: Sequence[str] = ()) -> Iterator[tuple[str, int, int, int]]:
+    """Yield ``(work_id, paragraph, line, pos)`` of each occurrence of a phrase.
+
+    Uses the bigram index when the index has one; otherwise chains the
+    adjacent positions of the phrase's characters, which only finds phrases
+    standing on one line.
+    """
+    if getattr(index, 'has_phrases', False):
+        yield from index.find_phrase(text, loose, source)
+        return
+    if loose:
+        raise ValueError('matching across punctuation needs an index built with --phrase-index')
+    chars = phrase_chars(text)
+    if not chars:
+        raise ValueError('the phrase has no characters')
+    if getattr(index, 'folded', False):
+        chars = fold_text(chars)
+    if any(ch not in index for ch in chars):
+        return
+    keys, rows = sorted_keys(index[chars[0]], source)
+    following = [set(sorted_keys(index[ch], source)[0]) for ch in chars[1:]]
+    for (work, paragraph, line, pos), row in zip(keys, rows):
+        if all((work, paragraph, line, pos + shift) in found
+               for shift, found in enumerate(following, start=1)):
+            yield index[chars[0]][row]['work_id'], paragraph, line, pos
+
+
+def print_phrase_match(work_id: str, line_idx: int, pos: int, length: int,
+                       docs: DocStore | None = None) -> None:
+    """Print a work with the ``length`` characters of a phrase highlighted from ``line_idx``/``pos``."""
+    entry = load_work(work_id, docs)
+    if not entry:
+        return
+    marks: dict[int, set[int]] = {}
+    lines = extract_lines(entry)
+    for idx in range(line_idx, len(lines) + 1):
+        for col, ch in enumerate(lines[idx - 1], start=1):
+            if length and (idx, col) >= (line_idx, pos) and not is_punctuation(ch):
+                marks.setdefault(idx, set()).add(col)
+                length -= 1
+    print(f"{entry.get('title') or entry.get('rhythmic') or 'Untitled'} ({work_id})")
+    for idx, line in enumerate(lines, start=1):
+        print(highlight_line(line, marks[idx]) if idx in marks else line)
+    print()
+
+
+def cooccurrence_counts(index: Mapping, chars: Sequence[str],
+                        source: Sequence[str]) -> Counter[str]:
+    """Count, for every character, the paragraphs it shares with ``chars``.
+
+    With the forward index of ``paragraphs.bin`` only the paragraphs holding
+    ``chars`` are read; older indexes are scanned in full.
+    """
+
+    paragraphs = dict.fromkeys(
+        (occ['work_id'], occ['paragraph'])
+        for c in chars for occ in index.get(c, [])
+        if (not source or occ['type'] in source) and occ['paragraph'] is not None
+    )
+    counts: Counter[str] = Counter()
+    if getattr(index, 'has_paragraphs', False):
+        for work_id, paragraph in paragraphs:
+            counts.update(index.paragraph_chars(work_id, paragraph))
+        return counts
+
+    para_chars: dict[tuple[str, int], set[str]] = {}
+    for ch, occs in index.items():
+        for occ in occs:
+            key = (occ['work_id'], occ['paragraph'])
+            para_chars.setdefault(key, set()).add(ch)
+    for key in paragraphs:
+        counts.update(para_chars.get(key, set()))
+    return counts
+
+
+def ranked_cooccurring(index: Mapping, chars: Sequence[str], source: Sequence[str],
+                       top: int) -> list[str]:
+    """Return the ``top`` characters other than ``chars`` sharing the most paragraphs with them.
+
+    Ordered by count, then by character.  The precomputed ``cooccur.bin``
+    table answers directly when it covers the query.
+    """
+
+    if len(chars) == 1 and not source and hasattr(index, 'cooccurring'):
+        table = index.cooccurring(chars[0])
+        if table is not None and len(table) >= top:
+            return [ch for ch, _ in table[:top]]
+    counts = cooccurrence_counts(index, chars, source)
+    ranked = sorted((c for c in counts if c not in chars), key=lambda c: (-counts[c], c))
+    return ranked[:top]
+
+
+def char_forms(index: Mapping, char: str,
+               fold: bool | None = None) -> tuple[list[str], tuple[str, ...]]:
+    """Return the index keys to look ``char`` up under and the written forms to keep.
+
+    A folded index holds every form of a character under its canonical
+    key; without ``fold`` only the rows written as ``char`` are kept.  In
+    an unfolded index ``fold`` looks up every variant of ``char`` instead.
+    ``fold`` defaults to whether the index was built with ``--fold-variants``.
+    """
+    folded = getattr(index, 'folded', False)
+    if fold is None:
+        fold = folded
+    if folded:
+        return [fold_text(char)], () if fold else (char,)
+    return variants(char) if fold else [char], ()
+
+
+def candidate_chars(index: Mapping, char2: str, char3: str | None, any_char3: bool,
+                    tone2: int | None, tone3: Sequence[int],
+                    source: Sequence[str], top: int | None = None,
+                    fold: bool | None = None) -> tuple[list[str], list[str]]:
+    """Return the characters to search for in the second and third place.
+
+    With ``top`` the third characters are the ``top`` ones most often found
+    in a paragraph with ``char2`` (after the ``tone3`` filter), best first.
+    ``fold`` includes the traditional and variant forms of ``char2`` and
+    ``char3``, see :func:`char_forms`.
+    """
+
+    char2_list, surfaces2 = char_forms(index, char2, fold)
+
+    # Determine possible third characters
+    if top and not tone3:
+        char3_list = ranked_cooccurring(index, char2_list, source, top)
+    elif any_char3 or top:
+        counts = cooccurrence_counts(index, char2_list, source)
+        if top:
+            char3_list = sorted((c for c in counts if c not in char2_list),
+                                key=lambda c: (-counts[c], c))
+        else:
+            char3_list = sorted(counts)
+    else:
+        if not char3:
+            return char2_list, []
+        char3_list = char_forms(index, char3, fold)[0]
+
+    # Filter char2 by tone2 if provided
+    if tone2 is not None:
+        char2_list = [c for c in char2_list
+                      if has_rows(index.get(c, []), source, (tone2,), surfaces2)]
+
+    # Filter char3 by tone3 if provided, keeping the order of the candidates
+    if tone3:
+        filtered = [c for c in char3_list if has_rows(index.get(c, []), source, tone3)]
+        char3_list = filtered[:top] if top else filtered
+    return char2_list, char3_list
+
+
+def search(index: Mapping, char2: str, char3: str | None = None, any_char3: bool = False,
+           tone2: int | None = None, tone3: Sequence[int] = (), source: Sequence[str] = (),
+           distance: str | None = None, reversible: bool = False, top: int | None = None,
+           fold: bool | None = None,
+           after: Position | None = None) -> Iterator[tuple[Position, tuple[dict, dict]]]:
+    """Yield ``(position, match)`` for a query described by the command line options.
+
+    Matches are produced lazily in a fixed order.  Passing the position of
+    the last match seen as ``after`` resumes the search behind it without
+    enumerating the earlier matches again.  ``tone2`` and ``tone3`` select
+    the occurrences that are matched, not only the candidate characters.
+    Without ``fold`` only the forms of ``char2`` and ``char3`` as written
+    are matched.
+    """
+
+    source = tuple(source)
+    tones2 = () if tone2 is None else (tone2,)
+    char2_list, char3_list = candidate_chars(index, char2, char3, any_char3, tone2, tone3, source,
+                                             top, fold)
+    surfaces2 = char_forms(index, char2, fold)[1]
+    surfaces3 = char_forms(index, char3, fold)[1] if char3 and not (any_char3 or top) else ()
+    # Perform search for each pair within paragraph distance
+    for n2, c2 in enumerate(char2_list):
+        if after is not None and n2 < after[0]:
+            continue
+        # the keys of char2 are shared by every third character
+        occs2 = index.get(c2, [])
+        keyed2 = sorted_keys(occs2, source, tones2, surfaces2)
+        if not keyed2[0]:
+            continue
+        for n3, c3 in enumerate(char3_list):
+            if after is not None and (n2, n3) < after[:2]:
+                continue
+            resume = after[2:] if after is not None and (n2, n3) == after[:2] else None
+            occs3 = index.get(c3, [])
+            matches = join_matches(occs2, keyed2, occs3,
+                                   sorted_keys(occs3, source, tone3, surfaces3),
+                                   distance or 'paragraph', reversible, resume)
+            for (i, j, swapped), match in matches:
+                yield (n2, n3, i, j, swapped), match
+
+
+def query_params(char2: str, char3: str | None = None, any_char3: bool = False,
+                 tone2: int | None = None, tone3: Sequence[int] = (), source: Sequence[str] = (),
+                 distance: str | None = None, reversible: bool = False,
+                 top: int | None = None, fold: bool | None = None) -> dict:
+    """Return the keyword arguments of :func:`search` in a canonical form."""
+
+    return {
+        'char2': char2, 'char3': char3 or None, 'any_char3': bool(any_char3),
+        'tone2': tone2, 'tone3': tuple(tone3), 'source': tuple(source),
+        'distance': distance, 'reversible': bool(reversible), 'top': top or None,
+        'fold': None if fold is None else bool(fold),
+    }
+
+
+def _query_digest(query: dict) -> str:
+    data = json.dumps(query, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha1(data.encode('utf-8')).hexdigest()[:12]
+
+
+def encode_cursor(query: dict, position: Position) -> str:
+    """Return an opaque token resuming ``query`` after ``position``."""
+
+    data = json.dumps({'q': _query_digest(query), 'p': list(position)}, separators=(',', ':'))
+    return base64.urlsafe_b64encode(data.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(query: dict, token: str) -> Position:
+    """Return the position stored in ``token``; ``ValueError`` if it is not for ``query``."""
+
+    try:
+        data = json.loads(base64.urlsafe_b64decode(token + '=' * (-len(token) % 4)))
+        position = tuple(int(value) for value in data['p'])
+        digest = data['q']
+    except (ValueError, TypeError, KeyError):
+        raise ValueError('malformed cursor') from None
+    if len(position) != 5 or digest != _query_digest(query):
+        raise ValueError('cursor does not belong to this query')
+    return position  # type: ignore[return-value]
+
+
+def paginate(matches: Iterator[tuple[Position, tuple[dict, dict]]], offset: int = 0,
+             limit: int | None = None) -> Iterator[tuple[Position, tuple[dict, dict]]]:
+    """Skip ``offset`` matches and stop after ``limit``, consuming no more than needed."""
+
+    stop = None if limit is None else offset + limit
+    return islice(matches, offset, stop)
 
 
 @click.command()
@@ -16,6 +416,8 @@ from lib.indexer import load_index
 @click.option('--char3', type=str, help='third character')
 @click.option('--any-char3', is_flag=True,
               help='Match all possible third characters X that co-occur with --char2 in the same paragraph')
+@click.option('--top', type=click.IntRange(min=1),
+              help='Like --any-char3, but only the N characters sharing the most paragraphs with --char2')
 @click.option('--tone2', type=int, help='tone number for second character')
 @click.option('--tone3', type=int, multiple=True,
               help='Third character tone filter; can specify multiple times, e.g. --tone3 1 --tone3 2')
@@ -42,183 +444,102 @@ from lib.indexer import load_index
     show_default=True,
     help='directory containing the built index'
 )
-
+@click.option('--limit', type=click.IntRange(min=1), help='print at most this many matches')
+@click.option('--offset', type=click.IntRange(min=0), default=0, show_default=True,
+              help='skip this many matches first')
+@click.option('--cursor', help='resume after the last match of a previous page')
+@click.option('--query', 'query_text',
+              help="boolean query such as '月 & 霜 & !秋', matched per paragraph or with "
+                   "--distance work per work")
+@click.option('--phrase', help='exact phrase such as 明月光, matched with the bigram index')
+@click.option('--ignore-punctuation', is_flag=True,
+              help='let --phrase run across punctuation and line breaks')
+@click.option('--fold/--no-fold', default=None,
+              help='match traditional and variant forms of --char2 and --char3 as well '
+                   '(default: only on an index built with --fold-variants)')
+@click.option('--db', 'db_path', type=click.Path(exists=True, dir_okay=False),
+              help='corpus database written by export_db.py; --phrase then uses its '
+                   'full-text index')
+@click.option('--author', help='list the works of this author (needs --db)')
+@click.option('--title', help='list the works with this title or rhythmic (needs --db)')
 def main(char2: str | None, char3: str | None, any_char3: bool, tone2: int | None, tone3: tuple[int, ...],
-         source: tuple[str, ...], distance: str | None, reversible: bool, index_dir: str) -> None:
-    """Search the character index using various options."""
-
-    index = load_index(index_dir)
-
-    def in_distance(o2: dict, o3: dict, dist: str) -> bool:
-        if dist == 'adjacent':
-            return (
-                o2['work_id'] == o3['work_id']
-                and o2['paragraph'] == o3['paragraph']
-                and o2['line'] == o3['line']
-                and abs(o2['pos'] - o3['pos']) == 1
-            )
-        if dist == 'sentence':
-            return (
-                o2['work_id'] == o3['work_id']
-                and o2['paragraph'] == o3['paragraph']
-                and o2['line'] == o3['line']
-            )
-        if dist == 'paragraph':
-            return (
-                o2['work_id'] == o3['work_id']
-                and o2['paragraph'] == o3['paragraph']
-            )
-        if dist == 'work':
-            return o2['work_id'] == o3['work_id']
-        return True
-
-    def occurs_before(a: dict, b: dict) -> bool:
-        if a['work_id'] != b['work_id']:
-            return False
-        if a['paragraph'] != b['paragraph']:
-            return a['paragraph'] < b['paragraph']
-        if a['line'] != b['line']:
-            return a['line'] < b['line']
-        return a['pos'] < b['pos']
-
-    def extract_lines(entry: dict) -> list[str]:
-        for key in ("paragraphs", "paragraph", "para", "content"):
-            lines = entry.get(key)
-            if lines:
-                return lines
-        return []
-
-    def load_work(work_id: str) -> dict | None:
-        if '-' in work_id and work_id.rsplit('-', 1)[1].isdigit():
-            base, num = work_id.rsplit('-', 1)
-            pattern = os.path.join('.', '**', f'{base}.json')
-            for path in glob.glob(pattern, recursive=True):
-                try:
-                    with open(path, 'r', encoding='utf-8') as fh:
-                        data = json.load(fh)
-                    idx = int(num) - 1
-                    if 0 <= idx < len(data):
-                        return data[idx]
-                except Exception:
-                    continue
-        for path in glob.glob('./**/*.json', recursive=True):
-            try:
-                with open(path, 'r', encoding='utf-8') as fh:
-                    data = json.load(fh)
-                if not isinstance(data, list):
-                    continue
-                for entry in data:
-                    if (
-                        isinstance(entry, dict)
-                        and (entry.get('id') == work_id or entry.get('uuid') == work_id)
-                    ):
-                        return entry
-            except Exception:
-                continue
-        return None
+         source: tuple[str, ...], distance: str | None, reversible: bool, index_dir: str,
+         limit: int | None = None, offset: int = 0, cursor: str | None = None,
+         top: int | None = None, query_text: str | None = None, phrase: str | None = None,
+         ignore_punctuation: bool = False, fold: bool | None = None, db_path: str | None = None,
+         author: str | None = None, title: str | None = None) -> None:
+    """Search the character index using various options.
 
-    def highlight_line(line: str, pos: set[int]) -> str:
-        result = []
-        for idx, ch in enumerate(line, start=1):
-            if idx in pos:
-                result.append(click.style(ch, fg='red'))
-            else:
-                result.append(ch)
-        return ''.join(result)
-
-    def find_matches(idx: dict, c2: str, c3: str, src: tuple[str, ...], dist: str, rev: bool) -> list[tuple[dict, dict]]:
-        occs2 = [o for o in idx.get(c2, []) if not src or o['type'] in src]
-        occs3 = [o for o in idx.get(c3, []) if not src or o['type'] in src]
-        results: list[tuple[dict, dict]] = []
-        for o2 in occs2:
-            for o3 in occs3:
-                if not in_distance(o2, o3, dist):
-                    continue
-                if not rev and not occurs_before(o2, o3):
-                    continue
-                pairs = [(o2, o3)] if not rev else [(o2, o3), (o3, o2)]
-                results.extend(pairs)
-        return results
-
-    def print_match(match: tuple[dict, dict]) -> None:
-        occ_a, occ_b = match
-        entry = load_work(occ_a['work_id'])
-        if not entry:
-            return
-        lines = extract_lines(entry)
-        if not lines:
-            return
-        title = entry.get('title') or entry.get('rhythmic') or 'Untitled'
-        print(f"{title} ({occ_a['type']})")
-        for idx, line in enumerate(lines, start=1):
-            if idx == occ_a['line'] == occ_b['line']:
-                print(highlight_line(line, {occ_a['pos'], occ_b['pos']}))
-            elif idx == occ_a['line']:
-                print(highlight_line(line, {occ_a['pos']}))
-            elif idx == occ_b['line']:
-                print(highlight_line(line, {occ_b['pos']}))
-            else:
-                print(line)
-        print()
+    Matches are printed as they are found.  With ``--limit`` the command
+    ends with a cursor for the next page on stderr; pass it back with
+    ``--cursor`` to continue where the page stopped.
+    """
 
-    # Build char2 list supporting simplified/traditional forms
+    db = CorpusDB(db_path) if db_path else None
+    if author is not None or title is not None:
+        if db is None:
+            raise click.UsageError('--author and --title need --db')
+        works = db.by_author(author) if author is not None else db.by_title(title)
+        if author is not None and title is not None:
+            works = [work for work in works if title in (work.get('title'), work.get('rhythmic'))]
+        for work in paginate(iter(works), offset, limit):
+            print_work(work)
+        return
+    if phrase is not None:
+        if char2 or query_text is not None:
+            raise click.UsageError('--phrase cannot be combined with --char2 or --query')
+        if cursor:
+            raise click.UsageError('--cursor is not supported with --phrase; use --offset')
+        try:
+            if db is not None:
+                matches = db.find_phrase(phrase, ignore_punctuation, source)
+                docs = db
+            else:
+                index = load_index(index_dir, mmap=True)
+                matches = scan_phrase(index, phrase, ignore_punctuation, source)
+                docs = open_docstore(index_dir)
+            for work_id, _, line, pos in paginate(matches, offset, limit):
+                print_phrase_match(work_id, line, pos, len(phrase_chars(phrase)), docs)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint='--phrase')
+        return
+    if query_text is not None:
+        if char2:
+            raise click.UsageError('--query cannot be combined with --char2')
+        if cursor:
+            raise click.UsageError('--cursor is not supported with --query; use --offset')
+        if distance not in (None, 'paragraph', 'work'):
+            raise click.BadParameter('--query matches per paragraph or work',
+                                     param_hint='--distance')
+        try:
+            node = parse(query_text)
+            index = load_index(index_dir, mmap=True)
+            matches = evaluate(index, node, source, distance or 'paragraph')
+            docs = open_docstore(index_dir)
+            chars = terms(node)
+            for work_id, _ in paginate(matches, offset, limit):
+                print_query_match(work_id, chars, docs)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint='--query')
+        return
     if not char2:
         return
-    if char2 == '乐':
-        char2_list = ['乐', '樂']
-    else:
-        char2_list = [char2]
-
-    # Determine possible third characters
-    if any_char3:
-        para_chars: dict[tuple[str, int], set[str]] = {}
-        for ch, occs in index.items():
-            for occ in occs:
-                key = (occ['work_id'], occ['paragraph'])
-                para_chars.setdefault(key, set()).add(ch)
-
-        char3_set = set()
-        for c2 in char2_list:
-            for occ in index.get(c2, []):
-                if source and occ['type'] not in source:
-                    continue
-                if occ['paragraph'] is not None:
-                    char3_set.update(para_chars.get((occ['work_id'], occ['paragraph']), set()))
-        char3_list = sorted(char3_set)
-    else:
-        if not char3:
-            return
-        if char3 == '乐':
-            char3_list = ['乐', '樂']
-        else:
-            char3_list = [char3]
-
-    # Filter char2 by tone2 if provided
-    if tone2 is not None:
-        filtered = []
-        for c in char2_list:
-            for occ in index.get(c, []):
-                if occ['tone'] == tone2 and (not source or occ['type'] in source):
-                    filtered.append(c)
-                    break
-        char2_list = sorted(set(filtered))
-
-    # Filter char3 by tone3 if provided
-    if tone3:
-        filtered = []
-        for c in char3_list:
-            for occ in index.get(c, []):
-                if occ['tone'] in tone3 and (not source or occ['type'] in source):
-                    filtered.append(c)
-                    break
-        char3_list = sorted(set(filtered))
-
-    # Perform search for each pair within paragraph distance
-    for c2 in char2_list:
-        for c3 in char3_list:
-            matches = find_matches(index, c2, c3, source, 'paragraph', reversible)
-            for match in matches:
-                print_match(match)
+    query = query_params(char2, char3, any_char3, tone2, tone3, source, distance, reversible, top,
+                         fold)
+    after = None
+    if cursor:
+        try:
+            after = decode_cursor(query, cursor)
+        except ValueError as exc:
+            raise click.BadParameter(str(exc), param_hint='--cursor')
+    index = load_index(index_dir, mmap=True)
+    docs = open_docstore(index_dir)
+    matches = search(index, **query, after=after)
+    last = None
+    for last, match in paginate(matches, offset, limit):
+        print_match(match, docs)
+    if limit is not None and last is not None and next(matches, None) is not None:
+        click.echo(f'Next page: --cursor {encode_cursor(query, last)}', err=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,292 @@
+"""Serve character searches over a local HTTP JSON API.
+
+The index is opened once per worker process and kept warm, so a query only
+pays for the matching itself::
+
+    python scripts/serve.py --index-dir ./index --port 8000
+    curl 'http://127.0.0.1:8000/search?char2=清&char3=风&distance=adjacent'
+
+``GET /search`` takes the options of ``scripts/search.py`` as query
+parameters (``tone3`` and ``source`` may repeat); ``POST /search`` takes
+them as a JSON object, plus ``limit``, ``offset`` and ``cursor``.  The
+response lists the matched works of one page and a cursor for the next one,
+``null`` on the last page::
+
+    {"results": [{"work_id": ..., "type": "poetry", "title": ...,
+                  "lines": [...], "highlights": [[line, pos], [line, pos]]}],
+     "cursor": "eyJxIjoi..."}
+
+Passing the cursor back continues the search where the page ended instead
+of recomputing the earlier pages.
+
+Connections are handled by an asyncio event loop; matching runs in a pool
+of worker processes so a slow query never blocks other requests.
+"""
+
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import sys
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Any, Dict, List, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.docstore import open_docstore  # noqa: E402
+from lib.indexer import MANIFEST, load_index  # noqa: E402
+from scripts.search import (  # noqa: E402
+    decode_cursor, encode_cursor, match_record, paginate, query_params, search)
+
+DISTANCES = ('adjacent', 'sentence', 'paragraph', 'work')
+#: Results returned when a request does not give ``limit``.
+DEFAULT_LIMIT = 100
+MAX_LIMIT = 1000
+#: Largest request body accepted, in bytes.
+MAX_BODY = 1 << 20
+
+REASONS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed',
+           413: 'Payload Too Large', 500: 'Internal Server Error'}
+
+_state: Dict[str, Any] = {}
+
+
+def _open_index(index_dir: str) -> None:
+    """Open the index of ``index_dir`` for the queries of this process."""
+
+    manifest = os.path.join(index_dir, MANIFEST)
+    _state['index_dir'] = index_dir
+    _state['version'] = os.stat(manifest).st_mtime_ns if os.path.exists(manifest) else None
+    _state['index'] = load_index(index_dir, mmap=True)
+    _state['docs'] = open_docstore(index_dir)
+
+
+def _current_index() -> Tuple[Any, Any]:
+    """Return the open index, reopening it if a build replaced the manifest."""
+
+    manifest = os.path.join(_state['index_dir'], MANIFEST)
+    version = os.stat(manifest).st_mtime_ns if os.path.exists(manifest) else None
+    if version != _state['version']:
+        _open_index(_state['index_dir'])
+    return _state['index'], _state['docs']
+
+
+def run_query(params: Dict[str, Any]) -> Dict[str, Any]:
+    """Run a parsed query against the index of this process and return one page."""
+
+    index, docs = _current_index()
+    query = params['query']
+    matches = search(index, **query, after=params['after'])
+    results: List[Dict[str, Any]] = []
+    last = None
+    for last, match in paginate(matches, params['offset'], params['limit']):
+        record = match_record(match, docs)
+        if record is not None:
+            results.append(record)
+    more = last is not None and next(matches, None) is not None
+    return {'results': results, 'cursor': encode_cursor(query, last) if more else None}
+
+
+def _flag(value: Any) -> bool:
+    if isinstance(value, bool):
+        return value
+    return str(value).lower() in ('1', 'true', 'yes', 'on')
+
+
+def parse_params(raw: Dict[str, Any]) -> Dict[str, Any]:
+    """Validate request parameters and return the arguments of :func:`run_query`.
+
+    Values may be lists, as produced by ``parse_qs``; options that take a
+    single value use the last one.  Raises ``ValueError`` on bad input.
+    """
+
+    def many(name: str) -> List[Any]:
+        value = raw.get(name, [])
+        return list(value) if isinstance(value, (list, tuple)) else [value]
+
+    def one(name: str) -> Any:
+        values = many(name)
+        return values[-1] if values else None
+
+    unknown = set(raw) - {'char2', 'char3', 'any_char3', 'tone2', 'tone3', 'source',
+                          'distance', 'reversible', 'top', 'fold', 'limit', 'offset', 'cursor'}
+    if unknown:
+        raise ValueError(f'unknown parameters: {", ".join(sorted(unknown))}')
+    char2 = one('char2')
+    if not char2 or not isinstance(char2, str):
+        raise ValueError('char2 is required')
+    distance = one('distance')
+    if distance is not None and distance not in DISTANCES:
+        raise ValueError(f'distance must be one of {", ".join(DISTANCES)}')
+    try:
+        tone2 = one('tone2')
+        top = one('top')
+        limit = one('limit')
+        limit = DEFAULT_LIMIT if limit in (None, '') else int(limit)
+        offset = int(one('offset') or 0)
+        query = query_params(
+            char2, one('char3'), _flag(one('any_char3') or False),
+            None if tone2 in (None, '') else int(tone2),
+            [int(tone) for tone in many('tone3')], [str(src) for src in many('source')],
+            distance, _flag(one('reversible') or False),
+            None if top in (None, '') else int(top),
+            None if one('fold') is None else _flag(one('fold')),
+        )
+    except (TypeError, ValueError):
+        raise ValueError('tone2, tone3, top, limit and offset must be integers') from None
+    if query['top'] is not None and query['top'] < 1:
+        raise ValueError('top must be positive')
+    if not 0 < limit <= MAX_LIMIT:
+        raise ValueError(f'limit must be between 1 and {MAX_LIMIT}')
+    if offset < 0:
+        raise ValueError('offset must not be negative')
+    cursor = one('cursor')
+    after = decode_cursor(query, cursor) if cursor else None
+    return {'query': query, 'after': after, 'offset': offset, 'limit': limit}
+
+
+class SearchServer:
+    """Answer HTTP requests, running queries on ``executor``."""
+
+    def __init__(self, executor: Executor) -> None:
+        self.executor = executor
+
+    async def dispatch(self, method: str, target: str, body: bytes) -> Tuple[int, Dict[str, Any]]:
+        """Return the status and JSON payload answering one request."""
+
+        url = urlsplit(target)
+        if url.path == '/health':
+            return 200, {'status': 'ok'}
+        if url.path != '/search':
+            return 404, {'error': f'no route {url.path}'}
+        try:
+            if method == 'GET':
+                params = parse_params(parse_qs(url.query))
+            elif method == 'POST':
+                raw = json.loads(body or b'{}')
+                if not isinstance(raw, dict):
+                    raise ValueError('the request body must be a JSON object')
+                params = parse_params(raw)
+            else:
+                return 405, {'error': f'method {method} not allowed'}
+        except ValueError as exc:
+            return 400, {'error': str(exc)}
+        loop = asyncio.get_running_loop()
+        return 200, await loop.run_in_executor(self.executor, run_query, params)
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        """Serve the requests of one connection, keeping it alive when asked to."""
+
+        try:
+            while True:
+                request_line = await reader.readline()
+                if not request_line.strip():
+                    break
+                try:
+                    method, target, version = request_line.decode('latin-1').split()
+                except ValueError:
+                    break
+                headers = {}
+                while True:
+                    line = await reader.readline()
+                    if line in (b'\r\n', b'\n', b''):
+                        break
+                    name, _, value = line.decode('latin-1').partition(':')
+                    headers[name.strip().lower()] = value.strip()
+                keep_alive = (version == 'HTTP/1.1'
+                              and headers.get('connection', '').lower() != 'close')
+                try:
+                    length = int(headers.get('content-length', 0))
+                except ValueError:
+                    length = -1
+                if 0 <= length <= MAX_BODY:
+                    body = await reader.readexactly(length)
+                    try:
+                        status, payload = await self.dispatch(method, target, body)
+                    except Exception as exc:  # pragma: no cover - reported to the client
+                        status, payload = 500, {'error': repr(exc)}
+                else:
+                    if length < 0:
+                        status, payload = 400, {'error': 'invalid Content-Length'}
+                    else:
+                        status, payload = 413, {'error': f'request body over {MAX_BODY} bytes'}
+                    # the body is left unread, so the next request cannot be found
+                    keep_alive = False
+                data = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+                head = [
+                    f'HTTP/1.1 {status} {REASONS[status]}',
+                    'Content-Type: application/json; charset=utf-8',
+                    f'Content-Length: {len(data)}',
+                ]
+                if not keep_alive:
+                    head.append('Connection: close')
+                writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + data)
+                await writer.drain()
+                if not keep_alive:
+                    break
+        except (asyncio.IncompleteReadError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def make_executor(index_dir: str, workers: int) -> Executor:
+    """Return the pool running queries; ``workers=0`` runs them in this process."""
+
+    if workers:
+        executor = ProcessPoolExecutor(workers, initializer=_open_index, initargs=(index_dir,))
+        # Start the workers, and open the index in them, before any connection
+        # is accepted: a worker forked later would inherit the client sockets.
+        executor.submit(os.getpid).result()
+        return executor
+    _open_index(index_dir)
+    return ThreadPoolExecutor(1)
+
+
+async def serve(index_dir: str, host: str = '127.0.0.1', port: int = 8000,
+                socket_path: str | None = None, workers: int = 1,
+                started: asyncio.Future | None = None) -> None:
+    """Serve queries until cancelled; ``started`` receives the listening server."""
+
+    executor = make_executor(index_dir, workers)
+    handler = SearchServer(executor).handle
+    try:
+        if socket_path:
+            server = await asyncio.start_unix_server(handler, path=socket_path)
+        else:
+            server = await asyncio.start_server(handler, host, port)
+        async with server:
+            if started is not None:
+                started.set_result(server)
+            await server.serve_forever()
+    finally:
+        executor.shutdown(cancel_futures=True)
+
+
+@click.command()
+@click.option('--index-dir', default='./index', show_default=True,
+              help='Directory containing the built index.')
+@click.option('--host', default='127.0.0.1', show_default=True, help='Address to listen on.')
+@click.option('--port', default=8000, show_default=True, type=int, help='Port to listen on.')
+@click.option('--socket', 'socket_path', type=click.Path(),
+              help='Listen on this Unix socket instead of a TCP port.')
+@click.option('--workers', default=os.cpu_count() or 1, show_default=True,
+              type=click.IntRange(min=0),
+              help='Worker processes running queries; 0 runs them in the server process.')
+def main(index_dir: str, host: str = '127.0.0.1', port: int = 8000, socket_path: str | None = None,
+         workers: int = 1) -> None:
+    """Serve searches of the character index over HTTP."""
+
+    where = socket_path or f'http://{host}:{port}'
+    click.echo(f'Serving {index_dir} on {where} with {workers} workers')
+    try:
+        asyncio.run(serve(index_dir, host, port, socket_path, workers))
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
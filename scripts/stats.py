@@ -0,0 +1,75 @@
+"""Print character, bigram and tone counts from ``preprocess.py --stats``.
+
+    python scripts/stats.py --char 月 --collection 宋词 --collection 全唐诗
+    python scripts/stats.py --top 20 --dynasty 唐
+    python scripts/stats.py --bigrams 20 --collection 宋词
+    python scripts/stats.py --tones --collection 宋词
+"""
+
+from __future__ import annotations
+
+import os
+import sys
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.stats import STATS, load_stats  # noqa: E402
+
+
+@click.command()
+@click.option('--index-dir', default='./index', show_default=True,
+              help='Directory containing stats.npz.')
+@click.option('--char', 'chars', multiple=True,
+              help='Print the count and frequency of this character per collection.')
+@click.option('--collection', 'collections', multiple=True,
+              help='Only count this collection (a top directory); can be repeated.')
+@click.option('--dynasty', 'dynasties', multiple=True,
+              help='Only count works of this dynasty; can be repeated.')
+@click.option('--top', default=0, show_default=True, type=click.IntRange(min=0),
+              help='Print the N most common characters.')
+@click.option('--bigrams', default=0, show_default=True, type=click.IntRange(min=0),
+              help='Print the N most common bigrams.')
+@click.option('--tones', is_flag=True, help='Print the share of each tone.')
+def main(index_dir: str, chars: tuple[str, ...] = (), collections: tuple[str, ...] = (),
+         dynasties: tuple[str, ...] = (), top: int = 0, bigrams: int = 0,
+         tones: bool = False) -> None:
+    """Answer frequency questions from the saved counts, without reading the corpus.
+
+    ``--char`` prints one row per selected collection (every collection by
+    default) with the count and the frequency per 10,000 characters; the
+    other options print totals over the selected collections and dynasties.
+    """
+
+    path = os.path.join(index_dir, STATS)
+    if not os.path.exists(path):
+        raise click.UsageError(f'{path} not found; build it with preprocess.py --stats')
+    stats = load_stats(index_dir)
+    for name, selected, known in (('--collection', collections, stats.collections),
+                                  ('--dynasty', dynasties, stats.dynasties)):
+        unknown = [value for value in selected if value not in known]
+        if unknown:
+            raise click.BadParameter(f"unknown {', '.join(unknown)}", param_hint=name)
+    collection = list(collections) or None
+    dynasty = list(dynasties) or None
+
+    for ch in chars:
+        for row in collections or stats.collections:
+            total = stats.total(row, dynasty)
+            if not total:
+                continue
+            count = stats.count(ch, row, dynasty)
+            click.echo(f'{ch}\t{row or "."}\t{count}\t{count * 10000 / total:.2f}')
+    if top:
+        for ch, count in stats.most_common(top, collection, dynasty):
+            click.echo(f'{ch}\t{count}')
+    if bigrams:
+        for pair, count in stats.top_bigrams(bigrams, collection, dynasty):
+            click.echo(f'{pair}\t{count}')
+    if tones:
+        shares = stats.tone_distribution(collection, dynasty)
+        click.echo('\t'.join(f'{tone}:{share:.3f}' for tone, share in enumerate(shares)))
+
+
+if __name__ == '__main__':
+    main()
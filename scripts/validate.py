@@ -0,0 +1,52 @@
+"""Validate the corpus JSON files against the dataset schemas."""
+
+from __future__ import annotations
+
+import json
+import os
+import sys
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.validate import validate  # noqa: E402
+from loader.data_loader import DATAS_CONFIG  # noqa: E402
+
+CACHE = '.validate-cache.json'
+
+
+@click.command()
+@click.argument('paths', nargs=-1)
+@click.option('--root', default='.', show_default=True, help='Corpus root directory.')
+@click.option('--config', default=DATAS_CONFIG, show_default=True,
+              help='Datasets config holding the schemas.')
+@click.option('--jobs', default=os.cpu_count() or 1, show_default=True,
+              type=click.IntRange(min=1), help='Number of worker processes.')
+@click.option('--cache', 'cache_path', default=CACHE, show_default=True,
+              help='Results of the previous run; unchanged files are skipped.')
+@click.option('--no-cache', is_flag=True, help='Check every file and keep no results.')
+@click.option('--report', type=click.Path(dir_okay=False, writable=True),
+              help='Write the full report as JSON to this file.')
+def main(paths: tuple[str, ...], root: str, config: str, jobs: int, cache_path: str,
+         no_cache: bool = False, report: str | None = None) -> None:
+    """Check that the corpus files under PATHS (default: all) parse and match their schema.
+
+    Exits with status 1 if any file fails.
+    """
+
+    result = validate(root, config, jobs, None if no_cache else cache_path, paths)
+    if report:
+        with open(report, 'w', encoding='utf-8') as fh:
+            json.dump(result, fh, ensure_ascii=False, indent=2)
+    for relpath in result['failed']:
+        click.echo(f'{relpath}:', err=True)
+        for error in result['results'][relpath]['errors']:
+            click.echo(f'  {error}', err=True)
+    click.echo(f"{result['files']} files, {result['checked']} checked, "
+               f"{result['cached']} unchanged, {len(result['failed'])} failed")
+    if result['failed']:
+        raise SystemExit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,47 +1,36 @@
 # -*- coding: utf-8 -*-
-import os
-import json
-import sys
-import traceback
-import functools
+"""校验 语料目录 中的 json 文件, one test per directory.
 
-namespace = locals()
+All files are validated once, in parallel, by ``lib.validate``; results of
+unchanged files are reused from ``.validate-cache.json`` (set
+``POETRY_VALIDATE_CACHE`` to another file, or to an empty string to check
+every file).
+"""
+import functools
+import os
 
+from lib.validate import is_book_directory, validate
 
-def check_json(f, _dir):
-    filepath = os.path.join(_dir, f)
+namespace = locals()
 
-    if os.path.isdir(filepath):
-        [check_json(f, filepath) for f in os.listdir(filepath)]
+CACHE = os.environ.get('POETRY_VALIDATE_CACHE', '.validate-cache.json')
 
-    if not f.endswith('.json'):
-        return True
 
-    with open(filepath) as file:
-        try:
-            _ = json.loads(file.read())
-            sys.stdout.write(f"{filepath} 校验成功")
-            return True
-        except Exception as e:
-            sys.stderr.write(traceback.format_exc())
-            print(dir(e))
-            assert False, f"{filepath} 校验失败, {e}"
+@functools.lru_cache(maxsize=None)
+def report():
+    return validate('.', jobs=os.cpu_count() or 1, cache_path=CACHE or None)
 
 
 def check_path(path):
     """校验 指定目录 中的 json 文件"""
-    [check_json(f, path) for f in os.listdir(path)]
-
-
-def is_book_directory(book):
-    if not os.path.isdir(book):
-        return False
-
-    for i in book:
-        if i > u'\u4e00' and i < u'\u9fff':
-            return True
-    return False
+    results = report()['results']
+    errors = {
+        relpath: result['errors'] for relpath, result in results.items()
+        if relpath.startswith(path + os.sep) and result['errors']
+    }
+    assert not errors, f"{path} 校验失败: {errors}"
 
 
-for path in [i for i in os.listdir('.') if is_book_directory(i)]:
-    namespace[f'test_{path}'] = functools.partial(check_path, f'{path}')
+for path in sorted(i for i in os.listdir('.') if os.path.isdir(i)
+                   and (is_book_directory(i) or i in ('strains', 'rank'))):
+    namespace[f'test_{path}'] = functools.partial(check_path, path)
@@ -0,0 +1,80 @@
+import json
+from collections import Counter
+from itertools import combinations
+
+import pytest
+
+from lib.indexer import load_index
+from scripts import preprocess
+from scripts.search import candidate_chars, ranked_cooccurring
+
+POEMS = [
+    {"title": "春晓", "paragraphs": ["春眠不觉晓", "处处闻啼鸟"]},
+    {"title": "静夜思", "paragraphs": ["床前明月光", "疑是地上霜", "举头望明月", "低头思故乡"]},
+    {"rhythmic": "水调歌头", "paragraphs": ["明月几时有", "把酒问青天"]},
+    {"title": "春夜", "paragraphs": ["春宵一刻值千金", "花有清香月有阴"]},
+]
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    with open(data_dir / "a.json", "w", encoding="utf-8") as fh:
+        json.dump(POEMS, fh, ensure_ascii=False)
+
+    def build(name, **options):
+        preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / name), **options)
+        return load_index(str(tmp_path / name), mmap=True)
+
+    return build
+
+
+def _expected_counts():
+    counts = Counter()
+    for poem in POEMS:
+        chars = set("".join(poem["paragraphs"]))
+        counts.update(combinations(sorted(chars), 2))
+    return counts
+
+
+def test_forward_index_and_table(corpus):
+    index = corpus("index", cooccur_top=3)
+    assert index.has_paragraphs
+    assert index.paragraph_chars("a-2", 2) == sorted(set("床前明月光疑是地上霜举头望明月低头思故乡"))
+    assert index.paragraph_chars("a-2", 1) == []
+
+    pairs = _expected_counts()
+    for char in "春月明有":
+        counts = Counter()
+        for (a, b), n in pairs.items():
+            if char in (a, b):
+                counts[b if a == char else a] = n
+        expected = sorted(counts.items(), key=lambda item: (-item[1], item[0]))[:3]
+        assert index.cooccurring(char) == expected
+
+
+def test_any_char3_reads_only_char2_paragraphs(corpus):
+    binary = corpus("binary")
+    scanned = corpus("json", index_format="json")
+    assert not getattr(scanned, "has_paragraphs", False)
+    assert binary.cooccurring("明") is None
+    for source in ((), ("ci",)):
+        assert (candidate_chars(binary, "明", None, True, None, (), source)
+                == candidate_chars(scanned, "明", None, True, None, (), source))
+    assert candidate_chars(binary, "明", None, True, None, (), ("ci",))[1] == sorted(
+        set("明月几时有把酒问青天"))
+
+
+def test_top_uses_table_or_counts(corpus):
+    with_table = corpus("table", cooccur_top=4)
+    without = corpus("plain")
+    # 月 shares two works with 明, every other candidate at most one
+    assert ranked_cooccurring(with_table, ["明"], (), 2) == ranked_cooccurring(without, ["明"], (), 2)
+    assert ranked_cooccurring(without, ["明"], (), 2)[0] == "月"
+    assert (candidate_chars(with_table, "春", None, False, None, (), (), top=3)
+            == candidate_chars(without, "春", None, False, None, (), (), top=3))
+
+    # the table only holds 4 characters; asking for more counts paragraphs
+    assert len(with_table.cooccurring("明")) == 4
+    assert ranked_cooccurring(with_table, ["明"], (), 6) == ranked_cooccurring(without, ["明"], (), 6)
@@ -0,0 +1,65 @@
+import json
+import os
+
+import pytest
+
+from lib import corpuscache
+from lib.corpuscache import cache_path, open_cached
+
+POEMS = [
+    {"paragraphs": ["床前明月光，疑是地上霜。", "举头望明月，低头思故乡。"]},
+    {"paragraphs": []},
+    {"paragraphs": ["", "a"]},
+    {"paragraphs": ["春眠不觉晓"]},
+]
+
+
+def _write(path, poems):
+    with open(path, "w", encoding="utf-8") as fh:
+        json.dump(poems, fh, ensure_ascii=False, indent=2)
+
+
+def test_cache_matches_source(tmp_path):
+    _write(tmp_path / "a.json", POEMS)
+    corpus = open_cached(str(tmp_path / "a.json"), "paragraphs", str(tmp_path / "cache"))
+    assert len(corpus) == len(POEMS)
+    assert [corpus.poem(idx) for idx in range(len(POEMS))] == [p["paragraphs"] for p in POEMS]
+    assert corpus[-1] == ["春眠不觉晓"]
+    assert corpus.lines() == [line for p in POEMS for line in p["paragraphs"]]
+    with pytest.raises(IndexError):
+        corpus.poem(len(POEMS))
+
+    poems = [{"content": ["two\nlines", "x"]}, {"content": ["\n"]}]
+    _write(tmp_path / "b.json", poems)
+    corpus = open_cached(str(tmp_path / "b.json"), "content", str(tmp_path / "cache"))
+    assert corpus.lines() == ["two\nlines", "x", "\n"]
+    assert corpus.poem(1) == ["\n"]
+
+
+def test_cache_invalidation(tmp_path, monkeypatch):
+    source = str(tmp_path / "a.json")
+    cache_dir = str(tmp_path / "cache")
+    _write(source, POEMS)
+    open_cached(source, "paragraphs", cache_dir)
+    cached = cache_path(cache_dir, source, "paragraphs")
+    built = os.stat(cached).st_mtime_ns
+
+    calls = []
+    build = corpuscache.build_cache
+    monkeypatch.setattr(corpuscache, "build_cache", lambda *args: calls.append(args) or build(*args))
+    assert open_cached(source, "paragraphs", cache_dir).poem(3) == ["春眠不觉晓"]
+    assert calls == [] and os.stat(cached).st_mtime_ns == built
+
+    # touched but unchanged: the header is restamped without converting again
+    os.utime(source, ns=(1, 1))
+    assert open_cached(source, "paragraphs", cache_dir).header["mtime_ns"] == 1
+    assert calls == []
+
+    _write(source, POEMS[:1])
+    assert len(open_cached(source, "paragraphs", cache_dir)) == 1
+    assert len(calls) == 1
+
+    with open(cached, "wb"):
+        pass
+    assert len(open_cached(source, "paragraphs", cache_dir)) == 1
+    assert len(calls) == 2
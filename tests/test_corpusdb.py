@@ -0,0 +1,95 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from lib.corpusdb import CorpusDB
+from loader.data_loader import PlainDataLoader
+from scripts import export_db, search
+
+POEMS = [
+    {"author": "李白", "title": "静夜思", "id": "p-1",
+     "paragraphs": ["床前明月光，疑是地上霜。", "舉頭望明月，低头思故乡。"]},
+    {"author": "张九龄", "title": "望月怀远", "id": "p-2",
+     "paragraphs": ["海上生明月，天涯共此时。"]},
+    {"author": "李白", "title": "月下独酌", "id": "p-3", "paragraphs": ["明", "月光"]},
+]
+RANKS = [{"author": "李白", "title": "月下独酌", "baidu": 3},
+         {"author": "李白", "title": "静夜思", "baidu": 1},
+         {"author": "王维", "title": "望月怀远", "baidu": 2}]
+CI = [{"author": "苏轼", "rhythmic": "水调歌头", "paragraphs": ["明月几时有？把酒问青天。"]}]
+
+
+def _dump(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+@pytest.fixture
+def db_path(tmp_path):
+    _dump(tmp_path / "全唐诗" / "poet.song.0.json", POEMS)
+    _dump(tmp_path / "全唐诗" / "authors.song.json", [{"name": "李白", "desc": "字太白"}])
+    _dump(tmp_path / "strains" / "json" / "poet.song.0.json",
+          [{"id": "p-1", "strains": ["平平平仄平"]}, {"id": "other", "strains": []}])
+    _dump(tmp_path / "rank" / "poet" / "poet.song.rank.0.json", RANKS)
+    _dump(tmp_path / "宋词" / "ci.song.0.json", CI)
+    _dump(tmp_path / "宋词" / "README.md", "")
+    _dump(tmp_path / "datas.json", {"cp_path": str(tmp_path), "datasets": {
+        "tangsong": {"id": 3, "path": "全唐诗/", "tag": "paragraphs",
+                     "excludes": ["authors.song.json"]},
+        "songci": {"id": 5, "path": "宋词/", "tag": "paragraphs", "excludes": ["README.md"]},
+    }})
+    result = CliRunner().invoke(export_db.main, ["--config", str(tmp_path / "datas.json"),
+                                                 "--output", str(tmp_path / "corpus.db")])
+    assert result.exit_code == 0, result.output
+    return tmp_path / "corpus.db"
+
+
+def test_lookups(db_path):
+    db = CorpusDB(str(db_path))
+    assert [work["title"] for work in db.by_author("李白")] == ["静夜思", "月下独酌"]
+    assert db.by_title("水调歌头") == [{"id": "ci.song.0-1", "rhythmic": "水调歌头", "author": "苏轼",
+                                       "dynasty": "宋", "paragraphs": CI[0]["paragraphs"]}]
+    work = db.get("p-1")
+    assert work["paragraphs"] == POEMS[0]["paragraphs"]
+    assert work["strains"] == ["平平平仄平"] and work["rank"] == RANKS[1]
+    assert "strains" not in db.get("p-2")
+    assert db.get("missing") is None
+    assert db.author("李白") == [{"name": "李白", "dynasty": "宋", "description": "字太白",
+                                 "short_description": None}]
+
+
+def test_rank_alignment(db_path):
+    # The rank shard is shuffled and one record belongs to another author.
+    db = CorpusDB(str(db_path))
+    assert db.get("p-1")["rank"] == RANKS[1]
+    assert db.get("p-3")["rank"] == RANKS[0]
+    assert "rank" not in db.get("p-2")
+
+
+def test_find_phrase(db_path):
+    db = CorpusDB(str(db_path))
+    assert list(db.find_phrase("明月")) == [
+        ("p-1", 1, 1, 3), ("p-1", 1, 2, 4), ("p-2", 2, 1, 4), ("ci.song.0-1", 1, 1, 1)]
+    assert list(db.find_phrase("举头")) == [("p-1", 1, 2, 1)]
+    assert list(db.find_phrase("明月光", loose=True)) == [("p-1", 1, 1, 3), ("p-3", 3, 1, 1)]
+    assert list(db.find_phrase("明月光")) == [("p-1", 1, 1, 3)]
+    assert list(db.find_phrase("明月", source=["ci"])) == [("ci.song.0-1", 1, 1, 1)]
+    with pytest.raises(ValueError):
+        list(db.find_phrase("，"))
+
+
+def test_backends(db_path, tmp_path):
+    config = str(tmp_path / "datas.json")
+    loader = PlainDataLoader(config, db_path=str(db_path))
+    assert list(loader.iter_body("tangsong")) == PlainDataLoader(config).body_extractor("tangsong")
+    assert loader.poem("songci", 0) == CI[0]["paragraphs"]
+    with pytest.raises(IndexError):
+        loader.poem("songci", 1)
+
+    runner = CliRunner()
+    result = runner.invoke(search.main, ["--db", str(db_path), "--author", "李白", "--limit", "1"])
+    assert result.exit_code == 0
+    assert result.output.startswith("静夜思 (李白, p-1)\n")
+    result = runner.invoke(search.main, ["--db", str(db_path), "--phrase", "天涯"])
+    assert result.output.count("(p-2)") == 1
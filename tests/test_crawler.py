@@ -0,0 +1,227 @@
+import asyncio
+import gzip
+import json
+import time
+from urllib.parse import urlsplit
+
+import pytest
+
+from lib.crawler import Checkpoint, Fetcher, FetchError, RateLimiter, crawl
+
+# recorded responses, by form
+RECORDED = {f"pageno={page}": json.dumps({"page": page, "items": [page * 10, page * 10 + 1]})
+            for page in range(1, 7)}
+
+
+@pytest.fixture(autouse=True)
+def no_proxy(monkeypatch):
+    for name in ("http_proxy", "https_proxy", "all_proxy", "no_proxy"):
+        monkeypatch.delenv(name, raising=False)
+        monkeypatch.delenv(name.upper(), raising=False)
+
+
+class StubServer:
+    """Replay RECORDED over keep-alive connections, failing on demand."""
+
+    def __init__(self, delay=0.0, failures=None, chunked=False, redirects=None, compress=False):
+        self.delay = delay
+        # form -> statuses to answer before the recorded response
+        self.failures = dict(failures or {})
+        self.chunked = chunked
+        # path -> (status, location)
+        self.redirects = dict(redirects or {})
+        self.compress = compress
+        self.requests = []
+        self.lines = []
+        self.connections = 0
+        self.active = self.peak = 0
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                method, target = line.decode("latin-1").split()[:2]
+                self.lines.append(f"{method} {target}")
+                length = 0
+                while (header := await reader.readline()) not in (b"\r\n", b""):
+                    name, _, value = header.decode("latin-1").partition(":")
+                    if name.lower() == "content-length":
+                        length = int(value)
+                form = (await reader.readexactly(length)).decode("ascii")
+                if method == "GET":
+                    form = urlsplit(target).query
+                self.requests.append(form)
+                self.active += 1
+                self.peak = max(self.peak, self.active)
+                await asyncio.sleep(self.delay)
+                self.active -= 1
+                pending = self.failures.get(form)
+                if pending and pending[0] == "drop":
+                    pending.pop(0)
+                    break
+                redirect = self.redirects.get(urlsplit(target).path)
+                if redirect:
+                    status, location = redirect
+                    writer.write(f"HTTP/1.1 {status} X\r\nLocation: {location}\r\n"
+                                 "Content-Length: 0\r\n\r\n".encode("latin-1"))
+                    await writer.drain()
+                    continue
+                if pending:
+                    status, body = pending.pop(0), b"busy"
+                elif form in RECORDED:
+                    status, body = 200, RECORDED[form].encode("utf-8")
+                else:
+                    status, body = 404, b"missing"
+                head = ""
+                if self.compress:
+                    body, head = gzip.compress(body), "Content-Encoding: gzip\r\n"
+                if self.chunked:
+                    framed = b"".join(b"%x\r\n%s\r\n" % (len(body[i:i + 7]), body[i:i + 7])
+                                      for i in range(0, len(body), 7)) + b"0\r\n\r\n"
+                    head += "Transfer-Encoding: chunked"
+                else:
+                    framed, head = body, head + f"Content-Length: {len(body)}"
+                writer.write(f"HTTP/1.1 {status} X\r\n{head}\r\n\r\n".encode("latin-1") + framed)
+                await writer.drain()
+        finally:
+            writer.close()
+
+    def run(self, client):
+        async def main():
+            server = await asyncio.start_server(self.handle, "127.0.0.1", 0)
+            port = server.sockets[0].getsockname()[1]
+            async with server:
+                return await client(f"http://127.0.0.1:{port}/getdata.asp")
+        return asyncio.run(main())
+
+
+async def _fetch_page(fetcher, page):
+    data = json.loads(await fetcher.post({"pageno": page}))
+    return data["items"]
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_fetch_reuses_connections(chunked):
+    stub = StubServer(chunked=chunked)
+
+    async def client(url):
+        async with Fetcher(url, concurrency=2) as fetcher:
+            return [await fetcher.post({"pageno": page}) for page in (1, 2, 3)]
+
+    bodies = stub.run(client)
+    assert [json.loads(body)["page"] for body in bodies] == [1, 2, 3]
+    assert stub.connections == 1
+
+
+@pytest.mark.parametrize("status, method", [(301, "GET"), (302, "GET"), (303, "GET"),
+                                            (307, "POST"), (308, "POST")])
+def test_follows_redirects(status, method):
+    # a GET carries the form in the query string of the new location
+    location = "/getdata.asp?pageno=2" if method == "GET" else "/getdata.asp"
+    stub = StubServer(redirects={"/old.asp": (status, location)})
+
+    async def client(url):
+        async with Fetcher(url.replace("getdata", "old")) as fetcher:
+            return await fetcher.post({"pageno": 2}), fetcher.requests
+
+    body, requests = stub.run(client)
+    assert json.loads(body)["page"] == 2 and requests == 2
+    assert stub.lines == ["POST /old.asp", f"{method} {location}"]
+    assert stub.requests == ["pageno=2"] * 2
+
+
+def test_redirect_loop():
+    stub = StubServer(redirects={"/getdata.asp": (307, "/getdata.asp")})
+
+    async def client(url):
+        async with Fetcher(url, retries=3, backoff=0.01) as fetcher:
+            with pytest.raises(FetchError, match="HTTP 307 after 10 redirects"):
+                await fetcher.post({"pageno": 1})
+
+    stub.run(client)
+    assert len(stub.requests) == 11
+
+
+@pytest.mark.parametrize("chunked", [False, True])
+def test_decodes_compressed_bodies(chunked):
+    stub = StubServer(compress=True, chunked=chunked)
+
+    async def client(url):
+        async with Fetcher(url) as fetcher:
+            return await fetcher.post({"pageno": 3})
+
+    assert json.loads(stub.run(client))["page"] == 3
+
+
+def test_environment_proxy(monkeypatch):
+    stub = StubServer()
+
+    async def client(url):
+        monkeypatch.setenv("http_proxy", url.rsplit("/", 1)[0])
+        async with Fetcher("http://ci.example/getdata.asp") as fetcher:
+            return await fetcher.post({"pageno": 4})
+
+    assert json.loads(stub.run(client))["page"] == 4
+    assert stub.lines == ["POST http://ci.example/getdata.asp"]
+
+
+def test_retries_with_backoff():
+    stub = StubServer(failures={"pageno=1": [503, "drop", 429], "pageno=2": [500] * 5})
+
+    async def client(url):
+        async with Fetcher(url, retries=3, backoff=0.01) as fetcher:
+            first = await fetcher.post({"pageno": 1})
+            with pytest.raises(FetchError, match="HTTP 500"):
+                await fetcher.post({"pageno": 2})
+            with pytest.raises(FetchError, match="HTTP 404"):
+                await fetcher.post({"pageno": 99})
+            return first
+
+    assert json.loads(stub.run(client))["page"] == 1
+    assert stub.requests == ["pageno=1"] * 4 + ["pageno=2"] * 4 + ["pageno=99"]
+
+
+def test_concurrency_limit():
+    stub = StubServer(delay=0.02)
+
+    async def client(url):
+        async with Fetcher(url, concurrency=3) as fetcher:
+            return await crawl(range(1, 7), lambda page: _fetch_page(fetcher, page), workers=6)
+
+    pages = stub.run(client)
+    assert pages == {page: [page * 10, page * 10 + 1] for page in range(1, 7)}
+    assert stub.peak == 3
+
+
+def test_rate_limiter():
+    async def main():
+        limiter = RateLimiter(50)
+        start = time.monotonic()
+        for _ in range(6):
+            await limiter.wait()
+        return time.monotonic() - start
+
+    assert asyncio.run(main()) >= 0.1
+    assert asyncio.run(asyncio.wait_for(RateLimiter().wait(), 1)) is None
+
+
+def test_crawl_resumes_from_checkpoint(tmp_path):
+    checkpoint = Checkpoint(str(tmp_path / "pages"))
+    stub = StubServer(failures={"pageno=4": [503] * 2})
+
+    async def client(url):
+        async with Fetcher(url, retries=1, backoff=0.01) as fetcher:
+            return await crawl(range(1, 7), lambda page: _fetch_page(fetcher, page), checkpoint)
+
+    first = stub.run(client)
+    assert sorted(first) == [1, 2, 3, 5, 6]
+    assert checkpoint.done() == [1, 2, 3, 5, 6]
+
+    stub.requests.clear()
+    second = stub.run(client)
+    assert stub.requests == ["pageno=4"]
+    assert second == {page: [page * 10, page * 10 + 1] for page in range(1, 7)}
+    assert list(second) == [1, 2, 3, 4, 5, 6]
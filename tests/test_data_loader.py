@@ -0,0 +1,86 @@
+import json
+import os
+
+import pytest
+
+from lib.corpusdb import build_database
+from loader.data_loader import PlainDataLoader
+
+
+@pytest.fixture
+def loader(tmp_path):
+    poems = tmp_path / "poems"
+    poems.mkdir()
+    for idx in range(5):
+        with open(poems / f"p.{idx}.json", "w", encoding="utf-8") as fh:
+            json.dump([{"paragraphs": [f"{idx}-{n}-a", f"{idx}-{n}-b"]} for n in range(3)], fh)
+    (poems / "README.md").write_text("not json", encoding="utf-8")
+    with open(tmp_path / "single.json", "w", encoding="utf-8") as fh:
+        json.dump([{"content": ["x", "y"]}, {"content": ["z"]}], fh)
+    config = {
+        "cp_path": str(tmp_path),
+        "datasets": {
+            "dir": {"id": 0, "path": "poems/", "excludes": ["README.md"], "tag": "paragraphs"},
+            "file": {"id": 1, "path": "single.json", "tag": "content"},
+        },
+    }
+    with open(tmp_path / "datas.json", "w", encoding="utf-8") as fh:
+        json.dump(config, fh)
+    return PlainDataLoader(str(tmp_path / "datas.json"))
+
+
+def test_iterators_match_lists(loader):
+    expected = [f"{idx}-{n}-{part}" for idx in range(5) for n in range(3) for part in "ab"]
+    assert loader.body_extractor("dir") == expected
+    assert list(loader.iter_body("dir")) == expected
+    assert loader.extract_from_multiple(["file", "dir"]) == ["x", "y", "z"] + expected
+    assert list(loader.iter_with_ids([1, 0])) == ["x", "y", "z"] + expected
+    assert loader.body_extractor("missing") is None
+
+
+@pytest.mark.parametrize("processes", [False, True])
+@pytest.mark.parametrize("workers", [1, 2, 8])
+def test_prefetch_keeps_order(loader, workers, processes):
+    expected = loader.extract_from_multiple(["dir", "file"])
+    assert list(loader.iter_multiple(["dir", "file"], workers, processes)) == expected
+
+    lines = loader.iter_body("dir", workers, processes)
+    assert next(lines) == "0-0-a"
+    lines.close()
+
+
+def test_cached_loader(loader, tmp_path):
+    cached = PlainDataLoader(loader._path, str(tmp_path / "cache"))
+    for _ in range(2):
+        assert cached.extract_from_multiple(["dir", "file"]) == loader.extract_from_multiple(
+            ["dir", "file"])
+        assert list(cached.iter_body("dir", 2)) == loader.body_extractor("dir")
+    assert len(os.listdir(tmp_path / "cache")) == 6
+    for use in (loader, cached):
+        assert use.poem("dir", 7) == ["2-1-a", "2-1-b"]
+        assert use.poem("file", 1) == ["z"]
+        with pytest.raises(IndexError):
+            use.poem("file", 2)
+
+
+def test_backends_agree(tmp_path):
+    entries = [{"content": "一段文字。"}, "not an object", {"comment": ["no tag"]},
+               {"content": ["甲", "乙"]}, {"content": "再一段。"}]
+    with open(tmp_path / "mixed.json", "w", encoding="utf-8") as fh:
+        json.dump(entries, fh, ensure_ascii=False)
+    datasets = {"mixed": {"id": 0, "path": "mixed.json", "tag": "content"}}
+    with open(tmp_path / "datas.json", "w", encoding="utf-8") as fh:
+        json.dump({"cp_path": str(tmp_path), "datasets": datasets}, fh)
+    config = str(tmp_path / "datas.json")
+    files = PlainDataLoader(config)
+    build_database(str(tmp_path / "corpus.db"), str(tmp_path), datasets,
+                   {"mixed": files.files("mixed")})
+
+    # a string is one line, and entries without the tag are not poems
+    for use in (files, PlainDataLoader(config, str(tmp_path / "cache")),
+                PlainDataLoader(config, db_path=str(tmp_path / "corpus.db"))):
+        assert list(use.iter_body("mixed")) == ["一段文字。", "甲", "乙", "再一段。"]
+        assert [use.poem("mixed", idx) for idx in range(3)] == [
+            ["一段文字。"], ["甲", "乙"], ["再一段。"]]
+        with pytest.raises(IndexError):
+            use.poem("mixed", 3)
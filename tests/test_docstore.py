@@ -0,0 +1,28 @@
+import os
+
+from lib.docstore import DOCSTORE, DocStoreBuilder, open_docstore
+
+
+def test_docstore_roundtrip(tmp_path):
+    builder = DocStoreBuilder(spool_dir=tmp_path)
+    builder.add('ci-1', {'rhythmic': '如梦令', 'author': '李清照', 'notes': 'x'},
+                ['昨夜雨疏风骤', '浓睡不消残酒'])
+    builder.add('poem-1', {'title': '春晓'}, ['春眠不觉晓'])
+    builder.add('ci-1', {'rhythmic': 'duplicate'}, ['ignored'])
+    builder.write(os.path.join(tmp_path, DOCSTORE))
+    assert sorted(os.listdir(tmp_path)) == [DOCSTORE]
+
+    docs = open_docstore(tmp_path)
+    assert len(docs) == 2
+    assert 'poem-1' in docs and 'poem-2' not in docs
+    assert docs.get('ci-1') == {
+        'rhythmic': '如梦令', 'author': '李清照', 'paragraphs': ['昨夜雨疏风骤', '浓睡不消残酒']
+    }
+    assert docs.get('poem-1')['paragraphs'] == ['春眠不觉晓']
+    assert docs.get('missing') is None
+    docs.get('ci-1')
+    assert docs.get.cache_info().hits == 1
+
+
+def test_open_docstore_missing(tmp_path):
+    assert open_docstore(tmp_path) is None
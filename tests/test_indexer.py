@@ -1,6 +1,7 @@
 import json
 import os
-from lib.indexer import load_index, query_char
+from lib.indexer import BinaryIndex, COLUMNS, TABLES, load_index, query_char
+from lib.postings import PostingsBuilder
 
 
 def test_load_and_query(tmp_path):
@@ -24,3 +25,44 @@ def test_load_and_query(tmp_path):
 
     unknown_hits = query_char('王', index)
     assert unknown_hits == []
+
+
+def test_binary_index_roundtrip(tmp_path):
+    builder = PostingsBuilder(COLUMNS, tables=TABLES)
+    w1 = builder.intern('work_id', 'w1')
+    w2 = builder.intern('work_id', 'w2')
+    poetry = builder.intern('type', 'poetry')
+    builder.append('李', (w1, poetry, 1, 1, 1, 3))
+    builder.append('白', (w2, poetry, 2, 3, 2, 2))
+    builder.append('白', (w2, poetry, 2, 3, 70000, 2))
+    builder.write(os.path.join(tmp_path, 'char_index.bin'))
+
+    index = load_index(tmp_path)
+    assert isinstance(index, BinaryIndex)
+    assert sorted(index) == ['李', '白']
+    assert list(query_char('李', index)) == [
+        {'work_id': 'w1', 'type': 'poetry', 'paragraph': 1, 'line': 1, 'pos': 1, 'tone': 3}
+    ]
+    bai = query_char('白', index)
+    assert len(bai) == 2
+    assert bai[-1]['pos'] == 70000
+    assert list(bai.column('line')) == [3, 3]
+    assert query_char('王', index) == []
+
+
+def test_binary_index_mmap(tmp_path):
+    builder = PostingsBuilder(COLUMNS, tables=TABLES)
+    work = builder.intern('work_id', 'w1')
+    ci = builder.intern('type', 'ci')
+    for pos, ch in enumerate('明月几时有', start=1):
+        builder.append(ch, (work, ci, 1, 1, pos, 0))
+    builder.write(os.path.join(tmp_path, 'char_index.bin'))
+
+    in_memory = load_index(tmp_path)
+    mapped = load_index(tmp_path, mmap=True)
+    assert '月' in mapped and '日' not in mapped
+    assert len(mapped) == 5
+    for ch in '明月几时有':
+        assert list(mapped[ch]) == list(in_memory[ch])
+    assert query_char('月', mapped)[0]['pos'] == 2
+    assert query_char('日', mapped) == []
@@ -0,0 +1,77 @@
+import json
+import os
+
+from click.testing import CliRunner
+
+from lib.joins import array_spans, build_join, open_join
+from scripts import join as join_script
+
+POEMS = [
+    {"author": "李白", "title": "静夜思", "id": "p-1", "paragraphs": ["床前明月光，疑是地上霜。"]},
+    {"author": "李白", "title": "月下独酌", "id": "p-2", "paragraphs": ["花间一壶酒"]},
+    {"author": "杜甫", "title": "春望", "id": "p-3", "paragraphs": ["国破山河在"]},
+]
+CI = [{"author": "苏轼", "rhythmic": "水调歌头", "paragraphs": ["明月几时有"]}]
+
+
+def _dump(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False, indent=2), encoding="utf-8")
+
+
+def _corpus(root):
+    _dump(root / "全唐诗" / "poet.tang.0.json", POEMS)
+    # strains are matched by id, even when they sit in another shard
+    _dump(root / "strains" / "json" / "poet.tang.0.json",
+          [{"id": "p-2", "strains": ["平平仄仄仄"]}, {"id": "p-1", "strains": ["仄"]}])
+    _dump(root / "strains" / "json" / "poet.tang.1000.json", [{"id": "p-3", "strains": ["平"]}])
+    # rank records follow the shard order except where author and title disagree
+    _dump(root / "rank" / "poet" / "poet.tang.rank.0.json", [
+        {"author": "李白", "title": "静夜思", "baidu": 1},
+        {"author": "杜甫", "title": "春望", "baidu": 3},
+        {"author": "李白", "title": "月下独酌", "baidu": 2},
+    ])
+    _dump(root / "宋词" / "ci.song.0.json", CI)
+    _dump(root / "rank" / "ci" / "ci.song.rank.0.json", [{"author": "苏轼", "rhythmic": "水调歌头",
+                                                           "baidu": 9}])
+
+
+def test_array_spans(tmp_path):
+    path = tmp_path / "a.json"
+    _dump(path, POEMS)
+    data = path.read_bytes()
+    spans = list(array_spans(str(path)))
+    assert [value for _, _, value in spans] == POEMS
+    assert [json.loads(data[offset:offset + size]) for offset, size, _ in spans] == POEMS
+
+
+def test_join(tmp_path):
+    _corpus(tmp_path)
+    path = str(tmp_path / "index" / "join.bin")
+    assert build_join(str(tmp_path), path) == 4
+    join = open_join(str(tmp_path), path)
+    assert sorted(join) == ["ci.song.0-1", "p-1", "p-2", "p-3"]
+    assert join.get("p-1") == dict(POEMS[0], strains=["仄"],
+                                   rank={"author": "李白", "title": "静夜思", "baidu": 1})
+    assert join.get("p-2")["strains"] == ["平平仄仄仄"] and join.get("p-2")["rank"]["baidu"] == 2
+    assert join.get("p-3")["strains"] == ["平"] and join.get("p-3")["rank"]["baidu"] == 3
+    assert join.get("ci.song.0-1") == dict(CI[0], rank={"author": "苏轼", "rhythmic": "水调歌头",
+                                                         "baidu": 9})
+    assert join.locate("ci.song.0-1")["strains"] is None
+    assert join.get("missing") is None
+    assert not join.stale()
+
+    _dump(tmp_path / "宋词" / "ci.song.1000.json", CI)
+    assert join.stale()
+    join = open_join(str(tmp_path), path)
+    assert "ci.song.1000-1" in join and not join.stale()
+
+
+def test_cli(tmp_path):
+    _corpus(tmp_path)
+    path = str(tmp_path / "join.bin")
+    result = CliRunner().invoke(join_script.main, ["--root", str(tmp_path), "--join", path,
+                                                   "--id", "p-3", "--id", "nope"])
+    assert result.exit_code == 0
+    assert json.loads(result.stdout.splitlines()[0])["rank"]["baidu"] == 3
+    assert os.path.exists(path)
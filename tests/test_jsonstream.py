@@ -0,0 +1,62 @@
+import io
+import json
+
+import pytest
+
+from lib.jsonstream import NotAnArray, iter_array
+from scripts import preprocess, search
+
+ENTRIES = [
+    {"title": "静夜思", "paragraphs": ["床前明月光，疑是地上霜。", "举头望明月，低头思故乡。"]},
+    {"title": "x]", "paragraphs": ["a,b", "[{"], "id": 12345678},
+    "text, with ] and \" escapes",
+    [[], {}, [1, 2]],
+    -2.5e-3,
+    1234567890,
+    True,
+    None,
+    {"title": "长" * 5000, "paragraphs": []},
+]
+
+
+@pytest.mark.parametrize("chunk_size", [1, 2, 3, 7, 64, 1 << 16])
+@pytest.mark.parametrize("indent", [None, 2])
+def test_iter_array_matches_json_load(chunk_size, indent):
+    text = json.dumps(ENTRIES, ensure_ascii=False, indent=indent)
+    assert list(iter_array(io.StringIO(text), chunk_size)) == ENTRIES
+    assert list(iter_array(io.StringIO(" [ ] "), chunk_size)) == []
+
+
+def test_iter_array_errors(tmp_path):
+    with pytest.raises(NotAnArray):
+        list(iter_array(io.StringIO('{"a": [1]}')))
+    with pytest.raises(NotAnArray):
+        list(iter_array(io.StringIO("")))
+
+    entries = iter_array(io.StringIO('[1, {"a": 2} 3]'), 4)
+    assert next(entries) == 1
+    assert next(entries) == {"a": 2}
+    with pytest.raises(json.JSONDecodeError):
+        next(entries)
+    with pytest.raises(json.JSONDecodeError):
+        list(iter_array(io.StringIO('[1, {"a": '), 4))
+
+    path = tmp_path / "a.json"
+    path.write_text(json.dumps(ENTRIES, ensure_ascii=False), encoding="utf-8")
+    assert list(iter_array(str(path))) == ENTRIES
+
+
+def test_truncated_file_keeps_earlier_entries(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    text = json.dumps(ENTRIES[:2], ensure_ascii=False)
+    (data_dir / "a.json").write_text(text[:-30], encoding="utf-8")
+    (data_dir / "b.json").write_text('{"paragraphs": ["明月"]}', encoding="utf-8")
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / "index"))
+
+    monkeypatch.chdir(data_dir)
+    docs = search.open_docstore(str(tmp_path / "index"))
+    assert docs.get("a-1")["title"] == "静夜思"
+    assert docs.get("a-2") is None
+    assert search.load_work("a-1")["title"] == "静夜思"
+    assert search.load_work("a-2") is None
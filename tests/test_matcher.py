@@ -0,0 +1,122 @@
+import os
+import random
+
+import pytest
+
+from lib.indexer import COLUMNS, PARTITIONS, TABLES, load_index
+from lib.matcher import (has_rows, in_distance, merge_join, occurs_before, partition_rows,
+                         sorted_keys)
+from lib.postings import PostingsBuilder
+
+
+def nested_loop(occs2, occs3, dist, rev):
+    results = []
+    for o2 in occs2:
+        for o3 in occs3:
+            if not in_distance(o2, o3, dist):
+                continue
+            if not rev and not occurs_before(o2, o3):
+                continue
+            results.extend([(o2, o3)] if not rev else [(o2, o3), (o3, o2)])
+    return results
+
+
+def merged(occs2, occs3, dist, rev, sources=(), tones=()):
+    keys2, rows2 = sorted_keys(occs2, sources, tones)
+    keys3, rows3 = sorted_keys(occs3, sources, tones)
+    results = []
+    for i, j in merge_join(keys2, keys3, dist, rev):
+        o2, o3 = occs2[rows2[i]], occs3[rows3[j]]
+        results.extend([(o2, o3)] if not rev else [(o2, o3), (o3, o2)])
+    return results
+
+
+def random_occs(rng, n):
+    occs = []
+    for _ in range(n):
+        occs.append({
+            'work_id': f'w{rng.randint(1, 4)}',
+            'type': rng.choice(['poetry', 'ci']),
+            'paragraph': rng.randint(1, 2),
+            'line': rng.randint(1, 3),
+            'pos': rng.randint(1, 5),
+            'tone': rng.randint(0, 4),
+        })
+    return occs
+
+
+def sorted_keys_order(o):
+    return o['work_id'], o['paragraph'], o['line'], o['pos']
+
+
+def key(pair):
+    return tuple(tuple(sorted(o.items())) for o in pair)
+
+
+@pytest.mark.parametrize('dist', ['adjacent', 'sentence', 'paragraph', 'work', None])
+@pytest.mark.parametrize('rev', [False, True])
+def test_merge_join_matches_nested_loop(dist, rev):
+    rng = random.Random(f'{dist}-{rev}')
+    for _ in range(20):
+        occs2 = random_occs(rng, rng.randint(0, 30))
+        occs3 = random_occs(rng, rng.randint(0, 30))
+        expected = nested_loop(sorted(occs2, key=sorted_keys_order),
+                               sorted(occs3, key=sorted_keys_order), dist, rev)
+        assert merged(occs2, occs3, dist, rev) == expected
+
+
+@pytest.mark.parametrize('partitions', [(), PARTITIONS])
+def test_merge_join_on_binary_postings(tmp_path, partitions):
+    rng = random.Random(7)
+    occs = {'不': random_occs(rng, 60), '人': random_occs(rng, 60)}
+    builder = PostingsBuilder(COLUMNS, tables=TABLES, partitions=partitions)
+    for ch, rows in occs.items():
+        for o in rows:
+            builder.append(ch, (
+                builder.intern('work_id', o['work_id']), builder.intern('type', o['type']),
+                o['paragraph'], o['line'], o['pos'], o['tone'],
+            ))
+    builder.write(os.path.join(tmp_path, 'char_index.bin'))
+    index = load_index(tmp_path, mmap=True)
+
+    for dist in ('adjacent', 'sentence', 'paragraph', 'work'):
+        for rev in (False, True):
+            for sources in ((), ('ci',)):
+                for tones in ((), (2,), (0, 4)):
+                    got = merged(index['不'], index['人'], dist, rev, sources, tones)
+                    want = merged(occs['不'], occs['人'], dist, rev, sources, tones)
+                    assert sorted(map(key, got)) == sorted(map(key, want))
+
+
+def test_partitions_select_rows_by_source_and_tone(tmp_path):
+    builder = PostingsBuilder(COLUMNS, tables=TABLES, partitions=PARTITIONS)
+    poetry, ci = builder.intern('type', 'poetry'), builder.intern('type', 'ci')
+    rows = [('w1', ci, 2), ('w1', poetry, 1), ('w2', poetry, 2), ('w2', ci, 2), ('w3', poetry, 2)]
+    for pos, (work, kind, tone) in enumerate(rows, start=1):
+        builder.append('长', (builder.intern('work_id', work), kind, 1, 1, pos, tone))
+    builder.write(os.path.join(tmp_path, 'char_index.bin'))
+    postings = load_index(tmp_path)['长']
+
+    assert [(o['type'], o['tone']) for o in postings] == [
+        ('poetry', 1), ('poetry', 2), ('poetry', 2), ('ci', 2), ('ci', 2),
+    ]
+    assert partition_rows(postings, ('ci',)) == [range(3, 5)]
+    assert partition_rows(postings, (), (2, 3)) == [range(1, 3), range(3, 3), range(3, 5), range(5, 5)]
+    keys, _ = sorted_keys(postings, tones=(2,))
+    assert [k[0] for k in keys] == [0, 1, 1, 2]
+    assert has_rows(postings, ('poetry',), (1,))
+    assert not has_rows(postings, ('ci',), (1,))
+
+
+@pytest.mark.parametrize('dist', ['adjacent', 'sentence', 'paragraph', 'work', None])
+@pytest.mark.parametrize('rev', [False, True])
+def test_merge_join_resumes_from_start(dist, rev):
+    rng = random.Random(f'resume-{dist}-{rev}')
+    for _ in range(10):
+        keys2, _ = sorted_keys(random_occs(rng, rng.randint(1, 30)))
+        keys3, _ = sorted_keys(random_occs(rng, rng.randint(1, 30)))
+        pairs = list(merge_join(keys2, keys3, dist, rev))
+        assert pairs == sorted(pairs)
+        for start in pairs[::3] + [(len(keys2) - 1, len(keys3))]:
+            resumed = list(merge_join(keys2, keys3, dist, rev, start))
+            assert resumed == [pair for pair in pairs if pair >= start]
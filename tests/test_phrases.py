@@ -0,0 +1,114 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from lib.indexer import load_index
+from lib.phrases import is_punctuation
+from scripts import compact, preprocess, search
+
+POEMS = [
+    {"title": "静夜思", "paragraphs": ["床前明月光，疑是地上霜。", "举头望明月，低头思故乡。"]},
+    {"rhythmic": "水调歌头", "paragraphs": ["明月几时有？把酒问青天。", "不知天上宫阙，今夕是何年。"]},
+    {"title": "月下", "paragraphs": ["明月光照人", "明", "月光"]},
+    {"title": "春晓", "paragraphs": ["春眠不觉晓，处处闻啼鸟。", "夜来风雨声，花落知多少。"]},
+]
+
+
+def _write(data_dir, poems):
+    data_dir.mkdir(exist_ok=True)
+    with open(data_dir / "a.json", "w", encoding="utf-8") as fh:
+        json.dump(poems, fh, ensure_ascii=False)
+
+
+@pytest.fixture
+def build(tmp_path):
+    _write(tmp_path / "data", POEMS)
+
+    def build(name, **options):
+        preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(tmp_path / name),
+                                 **options)
+        return tmp_path / name
+
+    return build
+
+
+def _expected(poems, phrase, loose=False):
+    found = []
+    for idx, poem in enumerate(poems, start=1):
+        places = [(line_idx, pos) for line_idx, line in enumerate(poem["paragraphs"], start=1)
+                  for pos, ch in enumerate(line, start=1) if not is_punctuation(ch)]
+        text = "".join(ch for line in poem["paragraphs"] for ch in line if not is_punctuation(ch))
+        for start in range(len(text) - len(phrase) + 1):
+            span = places[start:start + len(phrase)]
+            adjacent = all(b == (a[0], a[1] + 1) for a, b in zip(span, span[1:]))
+            if text.startswith(phrase, start) and (loose or adjacent):
+                found.append((f"a-{idx}", idx) + span[0])
+    return found
+
+
+@pytest.mark.parametrize("phrase", ["明月", "明月光", "月光", "天上", "明", "处处闻啼鸟", "光疑"])
+def test_phrase_index_matches_scan(build, phrase):
+    index = load_index(str(build("index", phrase_index=True)), mmap=True)
+    assert index.has_phrases
+    assert list(index.find_phrase(phrase)) == _expected(POEMS, phrase)
+    assert list(index.find_phrase(phrase, loose=True)) == _expected(POEMS, phrase, loose=True)
+    assert list(index.find_phrase(phrase, source=["ci"])) == [
+        match for match in _expected(POEMS, phrase) if match[0] == "a-2"]
+
+    plain = load_index(str(build("plain")), mmap=True)
+    scanned = load_index(str(build("json", index_format="json")))
+    assert not plain.has_phrases
+    for other in (plain, scanned):
+        assert list(search.scan_phrase(other, phrase)) == _expected(POEMS, phrase)
+
+
+def test_source_needs_bitmaps(build):
+    index_dir = build("index", phrase_index=True)
+    for path in index_dir.glob("segments/*/bitmaps.bin"):
+        path.unlink()
+    index = load_index(str(index_dir), mmap=True)
+    assert len(list(index.find_phrase("明月"))) == len(_expected(POEMS, "明月"))
+    with pytest.raises(ValueError, match="rebuild it with preprocess.py"):
+        list(index.find_phrase("明月", source=["ci"]))
+
+
+def test_loose_phrases_cross_lines(build):
+    index = load_index(str(build("index", phrase_index=True)), mmap=True)
+    assert list(index.find_phrase("光，疑")) == []
+    assert list(index.find_phrase("光疑", loose=True)) == [("a-1", 1, 1, 5)]
+    assert list(index.find_phrase("明月光", loose=True)) == [
+        ("a-1", 1, 1, 3), ("a-3", 3, 1, 1), ("a-3", 3, 2, 1)]
+    with pytest.raises(ValueError):
+        list(index.find_phrase("，。"))
+    with pytest.raises(ValueError):
+        list(search.scan_phrase(load_index(str(build("plain")), mmap=True), "明月", loose=True))
+
+
+def test_phrases_follow_updates_and_compaction(tmp_path, build):
+    index_dir = build("index", phrase_index=True, incremental=True)
+    changed = POEMS[:2] + [{"title": "月下", "paragraphs": ["照人明月"]}]
+    _write(tmp_path / "data", changed)
+    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(index_dir),
+                             phrase_index=True, incremental=True)
+    index = load_index(str(index_dir), mmap=True)
+    assert len(index.segments) == 2
+    assert list(index.find_phrase("明月")) == _expected(changed, "明月")
+
+    compact.main.callback(index_dir=str(index_dir), full=True)
+    index = load_index(str(index_dir), mmap=True)
+    assert index.has_phrases
+    assert list(index.find_phrase("明月")) == _expected(changed, "明月")
+
+
+def test_cli_phrase(build):
+    index_dir = build("index", phrase_index=True)
+    runner = CliRunner()
+    args = ["--index-dir", str(index_dir), "--phrase", "明月光"]
+    result = runner.invoke(search.main, args)
+    assert result.exit_code == 0
+    assert result.output.count("(a-") == 2
+    result = runner.invoke(search.main, args + ["--ignore-punctuation", "--offset", "2"])
+    assert result.output.count("(a-3)") == 1
+    result = runner.invoke(search.main, args + ["--char2", "明"])
+    assert result.exit_code == 2
@@ -1,10 +1,34 @@
 import json
 import io
 import builtins
+import os
 
+from lib.docstore import open_docstore
+from lib.indexer import load_index
+from lib.segments import compact
 from scripts import preprocess
 
 
+def _fake_corpus(monkeypatch, sample_data):
+    json_str = json.dumps(sample_data, ensure_ascii=False)
+
+    def fake_glob(pattern, recursive=True):
+        return ["dummy.json"]
+
+    monkeypatch.setattr(preprocess.glob, "glob", fake_glob)
+
+    real_open = builtins.open
+
+    def fake_open(path, *args, **kwargs):
+        if path == "dummy.json":
+            if "b" in (args[0] if args else kwargs.get("mode", "r")):
+                return io.BytesIO(json_str.encode("utf-8"))
+            return io.StringIO(json_str)
+        return real_open(path, *args, **kwargs)
+
+    monkeypatch.setattr(builtins, "open", fake_open)
+
+
 def test_preprocess_creates_index(tmp_path, monkeypatch):
     # Sample poem consisting of two lines
     sample_data = [
@@ -23,12 +47,15 @@ def test_preprocess_creates_index(tmp_path, monkeypatch):
 
     def fake_open(path, *args, **kwargs):
         if path == "dummy.json":
+            if "b" in (args[0] if args else kwargs.get("mode", "r")):
+                return io.BytesIO(json_str.encode("utf-8"))
             return io.StringIO(json_str)
         return real_open(path, *args, **kwargs)
 
     monkeypatch.setattr(builtins, "open", fake_open)
 
-    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(tmp_path))
+    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(tmp_path),
+                             index_format="json")
 
     index_file = tmp_path / "char_index.json"
     with open(index_file, "r", encoding="utf-8") as fh:
@@ -38,3 +65,156 @@ def test_preprocess_creates_index(tmp_path, monkeypatch):
     assert index["处"][0]["pos"] == 1
     assert index["处"][1]["pos"] == 2
     assert index["鸟"][0]["tone"] == 3
+
+
+def test_preprocess_binary_index_matches_json(tmp_path, monkeypatch):
+    _fake_corpus(monkeypatch, [
+        {"paragraphs": ["春眠不觉晓", "处处闻啼鸟"]},
+        {"rhythmic": "如梦令", "paragraphs": ["昨夜雨疏风骤"]},
+    ])
+
+    json_dir = tmp_path / "json"
+    bin_dir = tmp_path / "bin"
+    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(json_dir),
+                             index_format="json")
+    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(bin_dir))
+
+    assert not (bin_dir / "char_index.json").exists()
+    expected = load_index(json_dir)
+    index = load_index(bin_dir)
+    assert sorted(index) == sorted(expected)
+    for ch, occs in expected.items():
+        assert list(index[ch]) == occs
+    assert index["雨"][0]["type"] == "ci"
+
+
+def test_parallel_build_is_byte_identical(tmp_path):
+    data_dir = tmp_path / "data"
+    (data_dir / "ci").mkdir(parents=True)
+    poems = [
+        ("a.json", [{"title": "春晓", "paragraphs": ["春眠不觉晓", "处处闻啼鸟"]}]),
+        ("b.json", [{"id": "dup", "paragraphs": ["床前明月光"]},
+                    {"paragraphs": ["疑是地上霜"]}]),
+        ("ci/c.json", [{"rhythmic": "如梦令", "paragraphs": ["昨夜雨疏风骤"]}]),
+        ("ci/d.json", [{"id": "dup", "paragraphs": ["明月几时有"]}]),
+        ("e.json", {"not": "a list"}),
+    ]
+    for name, data in poems:
+        with open(data_dir / name, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False)
+
+    for index_format in ("binary", "json"):
+        outputs = []
+        for jobs in (1, 3):
+            index_dir = tmp_path / f"{index_format}-{jobs}"
+            preprocess.main.callback(data_dir=str(data_dir), index_dir=str(index_dir),
+                                     index_format=index_format, jobs=jobs, cooccur_top=3)
+            outputs.append({
+                path.relative_to(index_dir).as_posix(): path.read_bytes()
+                for path in index_dir.rglob("*") if path.is_file()
+            })
+        assert outputs[0] == outputs[1]
+        if index_format == "binary":
+            expected = ["manifest.json", "segments/000001/bitmaps.bin",
+                        "segments/000001/char_index.bin", "segments/000001/cooccur.bin", "segments/000001/docs.bin",
+                        "segments/000001/paragraphs.bin", "tones.json"]
+        else:
+            expected = ["char_index.json", "docs.bin", "manifest.json", "tones.json"]
+        assert sorted(outputs[0]) == expected
+
+
+def _write_corpus(data_dir, files):
+    for name, data in files.items():
+        path = data_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as fh:
+            json.dump(data, fh, ensure_ascii=False)
+
+
+def _index_bytes(index_dir):
+    """Return the files of a single segment index, ignoring segment names."""
+    manifest = json.loads((index_dir / "manifest.json").read_bytes())
+    [segment] = manifest["segments"]
+    for record in manifest["files"].values():
+        assert record.pop("segment") == segment["name"]
+    segment_dir = index_dir / "segments" / segment.pop("name")
+    return {
+        "char_index.bin": (segment_dir / "char_index.bin").read_bytes(),
+        "docs.bin": (segment_dir / "docs.bin").read_bytes(),
+        "paragraphs.bin": (segment_dir / "paragraphs.bin").read_bytes(),
+        "bitmaps.bin": (segment_dir / "bitmaps.bin").read_bytes(),
+        "manifest.json": manifest,
+    }
+
+
+def _search_view(index_dir):
+    index = load_index(index_dir, mmap=True)
+    docs = open_docstore(index_dir)
+    postings = {
+        char: sorted(json.dumps(occ, ensure_ascii=False, sort_keys=True) for occ in index[char])
+        for char in index
+    }
+    works = {occ["work_id"] for occs in index.values() for occ in occs}
+    return postings, {work: docs.get(work) for work in works}
+
+
+def test_incremental_build_matches_full_rebuild(tmp_path, capsys):
+    data_dir = tmp_path / "data"
+    _write_corpus(data_dir, {
+        "a.json": [{"title": "春晓", "paragraphs": ["春眠不觉晓"]}],
+        "b.json": [{"id": "dup", "paragraphs": ["床前明月光"]}],
+        "c.json": [{"paragraphs": ["疑是地上霜"]}],
+        "d.json": [{"id": "dup", "paragraphs": ["明月几时有"]}],
+        "e.json": [{"rhythmic": "如梦令", "paragraphs": ["昨夜雨疏风骤"]}],
+    })
+    for jobs in (1, 2):
+        index_dir = tmp_path / f"incremental-{jobs}"
+        preprocess.main.callback(data_dir=str(data_dir), index_dir=str(index_dir), jobs=jobs)
+
+    # change a file that shares a work id, add one and remove one
+    _write_corpus(data_dir, {
+        "b.json": [{"id": "dup", "paragraphs": ["床前看月光"]}],
+        "bb.json": [{"title": "新", "paragraphs": ["低头思故乡"]}],
+    })
+    os.remove(data_dir / "c.json")
+
+    full_dir = tmp_path / "full"
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(full_dir))
+    expected = _index_bytes(full_dir)
+    capsys.readouterr()
+    for jobs in (1, 2):
+        index_dir = tmp_path / f"incremental-{jobs}"
+        preprocess.main.callback(data_dir=str(data_dir), index_dir=str(index_dir),
+                                 jobs=jobs, incremental=True)
+        assert "Re-indexed 3 of 5 files" in capsys.readouterr().out
+
+        manifest = json.loads((index_dir / "manifest.json").read_bytes())
+        # half of the first segment was deleted, so compaction rewrote it
+        assert [(segment["name"], segment["deleted"]) for segment in manifest["segments"]] == [
+            ("000003", []), ("000002", []),
+        ]
+        assert manifest["files"]["a.json"]["segment"] == "000003"
+        assert manifest["files"]["d.json"]["segment"] == "000002"
+        assert _search_view(index_dir) == _search_view(full_dir)
+
+        assert compact(str(index_dir), full=True) == 1
+        assert sorted(os.listdir(index_dir / "segments")) == ["000004"]
+        assert _index_bytes(index_dir) == expected
+
+    manifest = expected["manifest.json"]
+    assert manifest["files"]["d.json"]["shared"] == ["dup"]
+    assert manifest["files"]["e.json"]["works"] == [3, 4]
+    index = load_index(full_dir)
+    assert "看" in index and "疑" not in index
+
+
+def test_incremental_without_changes_keeps_segments(tmp_path, capsys):
+    data_dir = tmp_path / "data"
+    _write_corpus(data_dir, {"a.json": [{"paragraphs": ["春眠不觉晓"]}]})
+    index_dir = tmp_path / "index"
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(index_dir))
+    before = _index_bytes(index_dir)
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(index_dir), incremental=True)
+    assert "Re-indexed 0 of 1 files" in capsys.readouterr().out
+    assert _index_bytes(index_dir) == before
+    assert os.listdir(index_dir / "segments") == ["000001"]
@@ -0,0 +1,106 @@
+import json
+
+import pytest
+from click.testing import CliRunner
+
+from lib.indexer import load_index
+from lib.query import evaluate, parse, terms, tokenize
+from scripts import preprocess, search
+
+POEMS = [
+    {"title": "春晓", "paragraphs": ["春眠不觉晓", "处处闻啼鸟", "夜来风雨声", "花落知多少"]},
+    {"title": "静夜思", "paragraphs": ["床前明月光", "疑是地上霜", "举头望明月", "低头思故乡"]},
+    {"rhythmic": "水调歌头", "paragraphs": ["明月几时有", "把酒问青天"]},
+    {"rhythmic": "霜天晓角", "paragraphs": ["冰清霜洁", "枝头月"]},
+    {"title": "秋夕", "paragraphs": ["银烛秋光冷画屏", "天阶夜色凉如水"]},
+    {"title": "秋风", "paragraphs": ["秋风起兮白云飞", "草木黄落兮雁南归"]},
+]
+
+
+def _write(data_dir, poems):
+    data_dir.mkdir(exist_ok=True)
+    with open(data_dir / "a.json", "w", encoding="utf-8") as fh:
+        json.dump(poems, fh, ensure_ascii=False)
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    _write(tmp_path / "data", POEMS)
+    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(tmp_path / "index"))
+    return tmp_path / "index"
+
+
+def _expected(poems, node, source=()):
+    def holds(node, chars):
+        kind, value = node
+        if kind == "char":
+            return value in chars
+        if kind == "not":
+            return not holds(value, chars)
+        combine = all if kind == "and" else any
+        return combine(holds(child, chars) for child in value)
+
+    return [
+        (f"a-{idx}", idx) for idx, poem in enumerate(poems, start=1)
+        if holds(node, set("".join(poem["paragraphs"])))
+        and (not source or ("ci" if "rhythmic" in poem else "poetry") in source)
+    ]
+
+
+def test_parse_operators_and_errors():
+    assert tokenize("月霜 AND NOT 秋") == ["月", "霜", "&", "!", "秋"]
+    assert tokenize("-秋 OR ANDY") == ["!", "秋", "|", "A", "N", "D", "Y"]
+    assert parse("月霜-秋") == parse("月 & 霜 & !秋") == (
+        "and", (("char", "月"), ("char", "霜"), ("not", ("char", "秋"))))
+    assert parse("(春|秋) 风") == (
+        "and", (("or", (("char", "春"), ("char", "秋"))), ("char", "风")))
+    assert terms(parse("月 !(霜 | !秋)")) == {"月", "秋"}
+    for text in ("", "月 &", "(月", "月)", "| 月", "!月"):
+        with pytest.raises(ValueError):
+            parse(text)
+
+
+@pytest.mark.parametrize("query", ["月", "明月", "月 & 霜 & !秋", "(春|秋) 风", "秋 | 霜 -天", "!夜 月"])
+def test_evaluate_matches_scan(index_dir, query):
+    index = load_index(str(index_dir), mmap=True)
+    node = parse(query)
+    assert list(evaluate(index, query)) == _expected(POEMS, node)
+    assert list(evaluate(index, query, source=["ci"])) == _expected(POEMS, node, ["ci"])
+    assert list(evaluate(index, node, scope="work")) == [
+        (work_id, None) for work_id, _ in _expected(POEMS, node)]
+
+
+def test_evaluate_skips_deleted_works(tmp_path, index_dir):
+    changed = POEMS[:3] + [{"title": "霜月", "paragraphs": ["秋霜月"]}]
+    _write(tmp_path / "data", changed)
+    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(index_dir),
+                             incremental=True)
+    index = load_index(str(index_dir), mmap=True)
+    assert len(index.segments) == 2
+    for query in ("霜", "月 !秋", "秋 | 风"):
+        assert list(evaluate(index, query)) == _expected(changed, parse(query))
+
+
+def test_json_index_is_rejected(tmp_path):
+    _write(tmp_path / "data", POEMS)
+    preprocess.main.callback(data_dir=str(tmp_path / "data"), index_dir=str(tmp_path / "index"),
+                             index_format="json")
+    with pytest.raises(ValueError):
+        list(evaluate(load_index(str(tmp_path / "index")), "月"))
+
+
+def test_cli_query(index_dir):
+    runner = CliRunner()
+    args = ["--index-dir", str(index_dir), "--query", "月 & 霜 & !秋"]
+    result = runner.invoke(search.main, args)
+    assert result.exit_code == 0
+    assert result.output.count("(a-") == 2
+    assert "静夜思 (a-2)" in result.output and "霜天晓角 (a-4)" in result.output
+
+    result = runner.invoke(search.main, args + ["--source", "ci", "--limit", "1"])
+    assert result.output.count("(a-") == 1
+
+    result = runner.invoke(search.main, ["--index-dir", str(index_dir), "--query", "月 &"])
+    assert result.exit_code == 2 and "query ends unexpectedly" in result.output
+    result = runner.invoke(search.main, args + ["--char2", "月"])
+    assert result.exit_code == 2
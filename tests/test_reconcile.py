@@ -0,0 +1,52 @@
+import random
+from difflib import SequenceMatcher
+
+import numpy as np
+
+from lib.reconcile import CharCounts, Replacer, best_matches, plain_text, quick_ratios
+
+TEXTS = ["明月几时有把酒问青天", "大江东去浪淘尽千古风流人物", "寻寻觅觅冷冷清清凄凄惨惨戚戚",
+         "昨夜雨疏风骤浓睡不消残酒", "", "醉", "十年生死两茫茫不思量自难忘"]
+
+
+def test_plain_text():
+    assert plain_text(["明月几时有？把酒问青天。", "不知天上宫阙， 今夕是何年。"]) == \
+        "明月几时有把酒问青天不知天上宫阙今夕是何年"
+
+
+def test_quick_ratios_equal_difflib():
+    rng = random.Random(1)
+    old = TEXTS + ["".join(rng.choice("天地玄黄宇宙洪荒") for _ in range(rng.randrange(12)))
+                   for _ in range(30)]
+    new = list(reversed(old))
+    pairs = [(i, j) for i in range(len(old)) for j in range(len(new))]
+    ratios = quick_ratios(CharCounts(old), CharCounts(new), np.array([i for i, _ in pairs]),
+                          np.array([j for _, j in pairs]))
+    expected = [SequenceMatcher(a=old[i], b=new[j]).quick_ratio() if old[i] or new[j] else 1.0
+                for i, j in pairs]
+    assert np.allclose(ratios, expected, rtol=0, atol=1e-12)
+
+
+def test_best_matches_shifted():
+    # the crawled list gained a record at the front, so every index is shifted
+    old = [text for text in TEXTS if text != "醉"]
+    new = ["新增一首词在最前面"] + [text.replace("千古", "千年") for text in old]
+    match, ratio = best_matches(old, new, hint=range(len(old)))
+    assert list(match) == [1, 2, 3, 4, 5, 6]
+    assert ratio[0] == 1.0 and 0.9 <= ratio[1] < 1.0 and ratio[4] == 1.0
+
+
+def test_best_matches_hint_wins_ties():
+    old = ["春眠不觉晓处处闻啼鸟"]
+    new = ["春眠不觉晓处处闻啼鸟"] * 3
+    assert best_matches(old, new, hint=[2])[0][0] == 2
+    assert best_matches(old, new, hint=[7])[0][0] in (0, 1, 2)
+    match, ratio = best_matches(["一二三四五六七八"], ["甲乙丙丁戊己庚辛"])
+    assert match[0] == -1 and ratio[0] == 0
+
+
+def test_replacer():
+    single = Replacer({"倖": "幸", "崙": "仑"})
+    assert single("薄倖崑崙") == "薄幸崑仑"
+    multi = Replacer({"鷫鸘": "鹔鹴", "鷫": "鹔", "崑崙": "昆仑"})
+    assert multi.lines(["鷫鸘裘", "鷫鷫", "崑崙山"]) == ["鹔鹴裘", "鹔鹔", "昆仑山"]
@@ -132,4 +132,88 @@ def test_any_char3(sample_files, monkeypatch):
     assert highlight('乐眠', {1, 2}) in out
 
 
+def test_distance_adjacent(sample_files, monkeypatch):
+    tmp = sample_files
+    out = run_cli(tmp, monkeypatch, [
+        '--char2', '春', '--char3', '不', '--distance', 'adjacent',
+        '--index-dir', 'index'
+    ])
+    assert out == ''
+    out = run_cli(tmp, monkeypatch, [
+        '--char2', '春', '--char3', '不', '--distance', 'sentence',
+        '--index-dir', 'index'
+    ])
+    assert highlight('春眠不觉晓', {1, 3}) in out
+
 
+def test_results_rendered_from_docstore(tmp_path, monkeypatch):
+    from scripts import preprocess
+
+    data_dir = tmp_path / 'data'
+    data_dir.mkdir()
+    with open(data_dir / 'ci.json', 'w', encoding='utf-8') as fh:
+        json.dump([{'rhythmic': '如梦令', 'paragraphs': ['昨夜雨疏风骤', '浓睡不消残酒']}],
+                  fh, ensure_ascii=False)
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / 'index'))
+    os.remove(data_dir / 'ci.json')
+
+    out = run_cli(tmp_path, monkeypatch, [
+        '--char2', '雨', '--char3', '风', '--index-dir', 'index'
+    ])
+    assert '如梦令 (ci)' in out
+    assert highlight('昨夜雨疏风骤', {3, 5}) in out
+
+
+def test_limit_and_cursor_page_through_matches(sample_files, monkeypatch):
+    monkeypatch.chdir(sample_files)
+    args = ['--char2', '春', '--char3', '不', '--reversible', '--index-dir', 'index']
+    runner = CliRunner()
+    full = runner.invoke(search.main, args).output
+    assert full.count('(') == 2
+
+    pages, cursor = [], []
+    while True:
+        result = runner.invoke(search.main, args + ['--limit', '1'] + cursor)
+        assert result.exit_code == 0
+        pages.append(result.stdout)
+        if 'Next page' not in result.stderr:
+            break
+        cursor = ['--cursor', result.stderr.split('--cursor ')[1].strip()]
+    assert len(pages) == 2 and ''.join(pages) == full
+
+    result = runner.invoke(search.main, args + ['--offset', '1'])
+    assert result.output == pages[1]
+    result = runner.invoke(search.main, ['--char2', '春', '--char3', '眠', '--index-dir', 'index',
+                                         '--cursor', cursor[1]])
+    assert result.exit_code != 0 and 'does not belong' in result.output
+
+
+def test_tone_filters_select_occurrences(tmp_path):
+    from lib.indexer import PARTITIONS, load_index
+    from lib.postings import PostingsBuilder
+
+    rows = {
+        '重': [('w1', 'poetry', 2), ('w2', 'poetry', 4), ('w3', 'ci', 4)],
+        '阳': [('w1', 'poetry', 2), ('w2', 'poetry', 2), ('w3', 'ci', 2)],
+    }
+    occs = {
+        ch: [{'work_id': w, 'type': t, 'paragraph': 1, 'line': 1, 'pos': pos, 'tone': tone}
+             for w, t, tone in entries]
+        for pos, (ch, entries) in enumerate(rows.items(), start=1)
+    }
+    builder = PostingsBuilder(list(occs['重'][0]), tables=['work_id', 'type'], partitions=PARTITIONS)
+    for ch, entries in occs.items():
+        for o in entries:
+            builder.append(ch, [builder.intern(c, v) if c in ('work_id', 'type') else v
+                                for c, v in o.items()])
+    builder.write(str(tmp_path / 'char_index.bin'))
+
+    for index in (occs, load_index(tmp_path, mmap=True)):
+        def works(**options):
+            return [m[0]['work_id'] for _, m in search.search(index, '重', '阳', **options)]
+
+        assert works() == ['w1', 'w2', 'w3']
+        assert works(tone2=4) == ['w2', 'w3']
+        assert works(tone2=4, source=['ci']) == ['w3']
+        assert works(tone2=1) == []
+        assert works(tone3=[4]) == []
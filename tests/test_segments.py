@@ -0,0 +1,97 @@
+import json
+import os
+
+from lib.docstore import DocStoreBuilder, open_docstore
+from lib.indexer import SegmentedIndex, load_index, new_builder
+from lib.matcher import merge_join, sorted_keys
+from lib.segments import plan_merges, write_manifest, write_segment
+from scripts import compact, preprocess
+
+
+def _segment(size, works=10, deleted=()):
+    return {"name": "x", "size": size, "works": works, "deleted": list(deleted)}
+
+
+def test_plan_merges_groups_tiers():
+    segments = [_segment(5000), _segment(40), _segment(50), _segment(60), _segment(30)]
+    assert plan_merges(segments, factor=4) == [(1, 5)]
+    assert plan_merges(segments[:4], factor=4) == []
+    # a mostly deleted segment is rewritten on its own
+    segments[0] = _segment(5000, works=10, deleted=[str(i) for i in range(5)])
+    assert plan_merges(segments[:4], factor=4) == [(0, 1)]
+
+
+def _write(index_dir, name, works):
+    builder = new_builder()
+    docs = DocStoreBuilder(spool_dir=index_dir)
+    for work_id, line in works:
+        work = builder.intern("work_id", work_id)
+        kind = builder.intern("type", "poetry")
+        docs.add(work_id, {"title": name}, [line])
+        for pos, ch in enumerate(line, start=1):
+            builder.append(ch, (work, kind, 1, 1, pos, 0))
+    return write_segment(str(index_dir), name, builder, docs)
+
+
+def test_segmented_index_skips_deleted_works(tmp_path):
+    old = _write(tmp_path, "000001", [("w1", "明月"), ("w2", "明日"), ("dup", "月明")])
+    new = _write(tmp_path, "000002", [("w2", "明天"), ("dup", "明月")])
+    old["deleted"] = ["w2"]
+    write_manifest(str(tmp_path), {"segments": [old, new], "files": {}})
+
+    index = load_index(tmp_path, mmap=True)
+    assert isinstance(index, SegmentedIndex)
+    assert [(o["work_id"], o["pos"]) for o in index["明"]] == [
+        ("w1", 1), ("dup", 2), ("w2", 1), ("dup", 1),
+    ]
+    assert "日" not in index and "天" in index
+    assert sorted(index) == ["天", "明", "月"]
+
+    keys2, rows2 = sorted_keys(index["明"])
+    keys3, rows3 = sorted_keys(index["月"])
+    pairs = [
+        (index["明"][rows2[i]]["work_id"], index["月"][rows3[j]]["work_id"])
+        for i, j in merge_join(keys2, keys3, "adjacent", reversible=False)
+    ]
+    # rows of "dup" from both segments belong to the same work
+    assert pairs == [("w1", "w1"), ("dup", "dup")]
+
+    docs = open_docstore(tmp_path)
+    assert docs.get("w2")["title"] == "000002"
+    assert docs.get("dup")["title"] == "000001"
+    assert docs.get("missing") is None
+
+
+def test_tiered_compaction_keeps_search_results(tmp_path, capsys):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    lines = ["春眠不觉晓", "处处闻啼鸟", "夜来风雨声", "花落知多少", "床前明月光", "疑是地上霜"]
+
+    def write_file(idx, text):
+        with open(data_dir / f"{idx}.json", "w", encoding="utf-8") as fh:
+            json.dump([{"paragraphs": [text]}], fh, ensure_ascii=False)
+
+    for idx, line in enumerate(lines):
+        write_file(idx, line)
+    index_dir = tmp_path / "index"
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(index_dir))
+    for idx in range(1, 6):
+        write_file(idx, lines[idx][::-1])
+        preprocess.main.callback(data_dir=str(data_dir), index_dir=str(index_dir),
+                                 incremental=True)
+    segments = json.loads((index_dir / "manifest.json").read_bytes())["segments"]
+    assert len(segments) < 6
+    assert sorted(os.listdir(index_dir / "segments")) == [s["name"] for s in segments]
+
+    full_dir = tmp_path / "full"
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(full_dir))
+    expected = load_index(full_dir)
+    index = load_index(index_dir)
+    assert sorted(index) == sorted(expected)
+    for ch in expected:
+        assert sorted(map(repr, index[ch])) == sorted(map(repr, expected[ch]))
+
+    compact.main.callback(index_dir=str(index_dir), full=True)
+    assert "1 segments left" in capsys.readouterr().out
+    index = load_index(index_dir)
+    assert {ch: list(index[ch]) for ch in index} == {ch: list(expected[ch]) for ch in expected}
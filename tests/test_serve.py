@@ -0,0 +1,119 @@
+import asyncio
+import json
+from urllib.parse import quote
+
+import pytest
+
+from lib.indexer import load_index
+from scripts import preprocess, serve
+from scripts.search import search
+
+
+@pytest.fixture
+def index_dir(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    poems = [
+        {"title": "静夜思", "paragraphs": ["床前明月光", "疑是地上霜", "举头望明月", "低头思故乡"]},
+        {"rhythmic": "水调歌头", "paragraphs": ["明月几时有", "把酒问青天"]},
+    ]
+    with open(data_dir / "a.json", "w", encoding="utf-8") as fh:
+        json.dump(poems, fh, ensure_ascii=False)
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / "index"))
+    return str(tmp_path / "index")
+
+
+async def _get(port, target, method="GET", body=b""):
+    reader, writer = await asyncio.open_connection("127.0.0.1", port)
+    writer.write(f"{method} {target} HTTP/1.1\r\nContent-Length: {len(body)}\r\n"
+                 "Connection: close\r\n\r\n".encode() + body)
+    data = await reader.read()
+    writer.close()
+    head, _, payload = data.partition(b"\r\n\r\n")
+    return int(head.split()[1]), json.loads(payload)
+
+
+def _with_server(index_dir, workers, client):
+    async def main():
+        started = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(serve.serve(index_dir, port=0, workers=workers, started=started))
+        server = await started
+        try:
+            return await client(server.sockets[0].getsockname()[1])
+        finally:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    return asyncio.run(main())
+
+
+@pytest.mark.parametrize("workers", [0, 1])
+def test_search_endpoint_matches_cli(index_dir, workers):
+    async def client(port):
+        return await asyncio.gather(
+            _get(port, f"/search?char2={quote('明')}&char3={quote('月')}&distance=adjacent"),
+            _get(port, "/search", "POST", json.dumps(
+                {"char2": "明", "char3": "月", "source": ["ci"], "limit": 1}).encode()),
+        )
+
+    (status, body), (post_status, post_body) = _with_server(index_dir, workers, client)
+    assert status == 200 and post_status == 200
+    expected = list(search(load_index(index_dir), "明", "月", distance="adjacent"))
+    assert len(body["results"]) == len(expected) == 3
+    assert body["results"][0]["title"] == "静夜思"
+    assert body["results"][0]["highlights"] == [[1, 3], [1, 4]]
+    assert body["cursor"] is None
+    assert [r["title"] for r in post_body["results"]] == ["水调歌头"]
+
+
+def test_pages_follow_cursor(index_dir):
+    target = f"/search?char2={quote('明')}&char3={quote('月')}&distance=work&reversible=1"
+
+    async def client(port):
+        pages = []
+        cursor = ""
+        while True:
+            status, body = await _get(port, f"{target}&limit=2{cursor}")
+            assert status == 200
+            pages.append(body["results"])
+            if body["cursor"] is None:
+                return pages, (await _get(port, f"{target}&limit=100"))[1]
+            cursor = f"&cursor={body['cursor']}"
+
+    pages, full = _with_server(index_dir, 0, client)
+    assert [len(page) for page in pages] == [2, 2, 2, 2, 2]
+    assert [r for page in pages for r in page] == full["results"]
+
+
+def test_bad_requests(index_dir):
+    async def client(port):
+        return await asyncio.gather(
+            _get(port, "/search?char3=x"),
+            _get(port, f"/search?char2={quote('明')}&distance=far"),
+            _get(port, f"/search?char2={quote('明')}&cursor=bogus"),
+            _get(port, "/nowhere"),
+            _get(port, "/health"),
+        )
+
+    responses = _with_server(index_dir, 0, client)
+    assert [status for status, _ in responses] == [400, 400, 400, 404, 200]
+    assert responses[0][1] == {"error": "char2 is required"}
+
+
+def test_content_length_checked(index_dir):
+    async def raw(port, length):
+        reader, writer = await asyncio.open_connection("127.0.0.1", port)
+        writer.write(f"POST /search HTTP/1.1\r\nContent-Length: {length}\r\n\r\n".encode())
+        # the server answers and closes without waiting for the body
+        data = await asyncio.wait_for(reader.read(), 5)
+        writer.close()
+        head, _, payload = data.partition(b"\r\n\r\n")
+        return int(head.split()[1]), json.loads(payload)
+
+    async def client(port):
+        return await asyncio.gather(raw(port, "abc"), raw(port, "-5"),
+                                    raw(port, serve.MAX_BODY + 1), _get(port, "/health"))
+
+    responses = _with_server(index_dir, 0, client)
+    assert [status for status, _ in responses] == [400, 400, 413, 200]
+    assert responses[0][1] == {"error": "invalid Content-Length"}
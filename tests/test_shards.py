@@ -0,0 +1,107 @@
+import importlib.util
+import json
+import os
+import sqlite3
+
+import pytest
+from click.testing import CliRunner
+
+from lib.corpuscache import CorpusFile
+from lib.shards import export_shards, iter_rows, state_path
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def _records(n, changed=()):
+    return [{"rhythmic": "浣溪沙", "author": f"作者{i}",
+             "paragraphs": [f"第{i}首。" + ("改" if i in changed else ""), "一向年光有限身。"]}
+            for i in range(n)]
+
+
+def _db(path, n):
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE ci (rhythmic TEXT, author TEXT, content TEXT)")
+    conn.execute("CREATE TABLE ciauthor (name TEXT, long_desc TEXT, short_desc TEXT)")
+    conn.executemany("INSERT INTO ci VALUES (?, ?, ?)",
+                     [(r["rhythmic"], r["author"], "\n".join(r["paragraphs"])) for r in _records(n)])
+    conn.execute("INSERT INTO ciauthor VALUES ('晏殊', '北宋词人', NULL)")
+    conn.commit()
+    conn.close()
+
+
+def test_iter_rows(tmp_path):
+    _db(str(tmp_path / "ci.db"), 25)
+    conn = sqlite3.connect(str(tmp_path / "ci.db"))
+    rows = list(iter_rows(conn, "SELECT author FROM ci WHERE rowid > ?", (20,), batch=2))
+    assert rows == [(f"作者{i}",) for i in range(20, 25)]
+    with pytest.raises(ValueError):
+        list(iter_rows(conn, "SELECT author FROM ci", batch=0))
+
+
+def test_formats(tmp_path):
+    records = _records(25)
+    report = export_shards(iter(records), str(tmp_path), "ci.song", shard_size=10)
+    assert report == {"records": 25, "written": ["ci.song.0.json", "ci.song.10.json",
+                                                 "ci.song.20.json"],
+                      "unchanged": [], "removed": []}
+    text = (tmp_path / "ci.song.10.json").read_text(encoding="utf-8")
+    assert text == json.dumps(records[10:20], ensure_ascii=False, indent=2, sort_keys=True,
+                              separators=(", ", ": "))
+
+    export_shards(iter(records), str(tmp_path), "ci.song", shard_size=10, fmt="jsonl")
+    lines = (tmp_path / "ci.song.20.jsonl").read_text(encoding="utf-8").splitlines()
+    assert [json.loads(line) for line in lines] == records[20:]
+
+    export_shards(iter(records), str(tmp_path), "ci.song", shard_size=10, fmt="bin")
+    corpus = CorpusFile.open(str(tmp_path / "ci.song.10.bin"))
+    assert len(corpus) == 10 and corpus.poem(3) == records[13]["paragraphs"]
+    assert corpus.fields == ["author", "rhythmic"]
+    assert corpus.field("author", -1) == "作者19"
+    assert (tmp_path / "ci.song.0.json").exists()
+
+    with pytest.raises(ValueError):
+        export_shards(iter(records), str(tmp_path), "ci.song", fmt="xml")
+
+
+def test_incremental(tmp_path):
+    out = str(tmp_path)
+    export_shards(iter(_records(25)), out, "ci.song", shard_size=10, incremental=True)
+    before = os.stat(tmp_path / "ci.song.0.json").st_mtime_ns
+
+    report = export_shards(iter(_records(25, changed={12})), out, "ci.song", shard_size=10,
+                           incremental=True)
+    assert report["written"] == ["ci.song.10.json"]
+    assert report["unchanged"] == ["ci.song.0.json", "ci.song.20.json"]
+    assert os.stat(tmp_path / "ci.song.0.json").st_mtime_ns == before
+
+    report = export_shards(iter(_records(15)), out, "ci.song", shard_size=10, incremental=True)
+    assert report["written"] == ["ci.song.10.json"] and report["removed"] == ["ci.song.20.json"]
+    assert not (tmp_path / "ci.song.20.json").exists()
+    with open(state_path(out, "ci.song", "json"), encoding="utf-8") as fh:
+        assert json.load(fh)["records"] == 15
+
+    # a new shard size rewrites every shard
+    report = export_shards(iter(_records(15)), out, "ci.song", shard_size=5, incremental=True)
+    assert report["written"] == ["ci.song.0.json", "ci.song.5.json", "ci.song.10.json"]
+    assert report["unchanged"] == report["removed"] == []
+
+
+def test_main(tmp_path):
+    spec = importlib.util.spec_from_file_location("ci_main", os.path.join(ROOT, "宋词", "main.py"))
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    _db(str(tmp_path / "ci.db"), 1200)
+    args = ["--db", str(tmp_path / "ci.db"), "--out-dir", str(tmp_path / "out")]
+    result = CliRunner().invoke(module.main, args)
+    assert result.exit_code == 0, result.output
+    assert result.output.strip() == "1200 ci: 2 shards written, 0 unchanged, 0 removed"
+    with open(tmp_path / "out" / "author.song.json", encoding="utf-8") as fh:
+        assert json.load(fh) == [{"description": "北宋词人", "name": "晏殊",
+                                  "short_description": None}]
+    with open(tmp_path / "out" / "ci.song.1000.json", encoding="utf-8") as fh:
+        assert json.load(fh) == _records(1200)[1000:]
+    result = CliRunner().invoke(module.main, args + ["--incremental"])
+    assert result.output.strip() == "1200 ci: 0 shards written, 2 unchanged, 0 removed"
+    for size in ("0", "-1"):
+        result = CliRunner().invoke(module.main, args + ["--shard-size", size])
+        assert result.exit_code == 2 and "--shard-size" in result.output
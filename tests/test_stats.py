@@ -0,0 +1,146 @@
+import json
+import os
+
+import numpy as np
+import pytest
+from click.testing import CliRunner
+
+from lib.indexer import load_index
+from lib.stats import StatsBuilder, load_stats, merge_stats
+from scripts import preprocess
+from scripts import stats as stats_script
+
+
+def _counts(lines, tones=None):
+    builder = StatsBuilder()
+    for idx, line in enumerate(lines):
+        builder.add_line(line, tones[idx] if tones else [1] * len(line))
+    return builder.build()
+
+
+def test_file_counts():
+    counts = _counts(["明月，明月 光", "月光"], [[4, 4, 0, 4, 2, 0, 1], [3, 1]])
+    assert [chr(code) for code in counts.chars] == ["光", "明", "月", "，"]
+    assert counts.char_tones.tolist() == [[0, 2, 0, 0, 0], [0, 0, 0, 0, 2],
+                                          [0, 0, 1, 1, 1], [1, 0, 0, 0, 0]]
+    pairs = {chr(int(key) >> 21) + chr(int(key) & 0x1FFFFF): int(count)
+             for key, count in zip(counts.bigrams, counts.bigram_counts)}
+    # no bigram across punctuation, a space or a line break
+    assert pairs == {"明月": 2, "月光": 1}
+    empty = _counts([])
+    assert len(empty.chars) == 0 and len(empty.bigrams) == 0
+
+
+def test_merge_and_slices(tmp_path):
+    stats = merge_stats([
+        ("宋词", "宋", _counts(["明月几时有", "明月"])),
+        ("全唐诗", "唐", _counts(["床前明月光。"])),
+        ("全唐诗", "宋", _counts(["明月"])),
+    ])
+    assert stats.collections == ["全唐诗", "宋词"] and stats.dynasties == ["唐", "宋"]
+    assert stats.counts.shape == (len(stats.chars), 2, 2)
+    assert stats.count("月") == 4 and stats.count("月", collection="全唐诗") == 2
+    assert stats.count("月", collection=["全唐诗", "宋词"], dynasty="宋") == 3
+    assert stats.count("霜") == 0 and stats.char_id("霜") == -1
+    assert stats.frequency("月", collection="宋词") == pytest.approx(2 / 7)
+    assert stats.most_common(2, dynasty="宋") == [("明", 3), ("月", 3)]
+    assert stats.top_bigrams(1) == [("明月", 4)]
+    assert sorted(stats.top_bigrams(10, collection="全唐诗", dynasty="唐")) == \
+        sorted([("床前", 1), ("前明", 1), ("明月", 1), ("月光", 1)])
+    # punctuation counts as a character but not in the tone distribution
+    assert stats.total(collection="全唐诗", dynasty="唐") == 6
+    assert stats.tone_distribution().tolist() == [0, 1, 0, 0, 0]
+    with pytest.raises(KeyError):
+        stats.count("月", collection="元曲")
+
+    stats.save(str(tmp_path / "stats.npz"))
+    loaded = load_stats(str(tmp_path))
+    assert loaded.collections == stats.collections and loaded.dynasties == stats.dynasties
+    for name in ("chars", "counts", "char_tones", "tones", "bigrams", "bigram_cells",
+                 "bigram_counts"):
+        assert np.array_equal(getattr(loaded, name), getattr(stats, name))
+
+
+CORPUS = {
+    "全唐诗/poet.tang.0.json": [{"title": "静夜思", "paragraphs": ["床前明月光，疑是地上霜。"]}],
+    "全唐诗/poet.song.0.json": [{"title": "月", "paragraphs": ["明月几时有"]}],
+    "宋词/ci.song.0.json": [{"rhythmic": "水调歌头", "paragraphs": ["明月几时有？", "把酒问青天。"]}],
+    "楚辞/chuci.json": [{"content": ["帝高阳之苗裔兮"]}],
+}
+
+
+def _write(data_dir, files):
+    for name, data in files.items():
+        path = data_dir / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+def _arrays(index_dir):
+    with np.load(index_dir / "stats.npz") as data:
+        return {name: data[name].tolist() for name in data.files}
+
+
+def test_preprocess_stats(tmp_path):
+    data_dir = tmp_path / "data"
+    _write(data_dir, CORPUS)
+    for jobs in (1, 2):
+        preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / f"ix{jobs}"),
+                                 jobs=jobs, with_stats=True)
+    assert _arrays(tmp_path / "ix1") == _arrays(tmp_path / "ix2")
+    stats = load_stats(str(tmp_path / "ix1"))
+    assert stats.collections == ["全唐诗", "宋词", "楚辞"]
+    assert stats.dynasties == ["", "唐", "宋"]
+    index = load_index(str(tmp_path / "ix1"))
+    for ch in "月明，兮":
+        assert stats.count(ch) == len(index[ch])
+    assert stats.count("月", collection="全唐诗", dynasty="唐") == 1
+    assert stats.count("月", dynasty="宋") == 2
+    assert len(os.listdir(tmp_path / "ix1" / "stats")) == 4
+
+    # an incremental build counts the changed files and matches a full one
+    _write(data_dir, {"宋词/ci.song.0.json": [{"rhythmic": "水调歌头", "paragraphs": ["明月明月"]}]})
+    os.remove(data_dir / "楚辞" / "chuci.json")
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / "ix1"),
+                             incremental=True, with_stats=True)
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / "full"),
+                             with_stats=True)
+    assert _arrays(tmp_path / "ix1") == _arrays(tmp_path / "full")
+    assert len(os.listdir(tmp_path / "ix1" / "stats")) == 3
+    assert load_stats(str(tmp_path / "ix1")).count("明", collection="宋词") == 2
+
+    # a build without --stats drops counts that would be stale
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / "ix1"))
+    assert not (tmp_path / "ix1" / "stats.npz").exists()
+
+
+def test_config_outside_repo_root(tmp_path, monkeypatch):
+    data_dir = tmp_path / "data"
+    _write(data_dir, CORPUS)
+    monkeypatch.chdir(tmp_path)
+    preprocess.main.callback(data_dir=str(data_dir), index_dir="ix", with_stats=True)
+    assert load_stats("ix").count("月", collection="全唐诗", dynasty="唐") == 1
+
+    # an unreadable config fails before any part of the index is written
+    with pytest.raises(FileNotFoundError):
+        preprocess.main.callback(data_dir=str(data_dir), index_dir="other", with_stats=True,
+                                 config=str(tmp_path / "missing.json"))
+    assert not (tmp_path / "other").exists()
+
+
+def test_cli(tmp_path):
+    data_dir = tmp_path / "data"
+    _write(data_dir, CORPUS)
+    preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / "ix"),
+                             with_stats=True)
+    runner = CliRunner()
+    args = ["--index-dir", str(tmp_path / "ix")]
+    result = runner.invoke(stats_script.main, args + ["--char", "月", "--collection", "宋词",
+                                                      "--collection", "全唐诗", "--bigrams", "1"])
+    assert result.exit_code == 0, result.output
+    assert result.output.splitlines() == ["月\t宋词\t1\t833.33", "月\t全唐诗\t2\t1176.47",
+                                          "明月\t3"]
+    result = runner.invoke(stats_script.main, args + ["--collection", "元曲", "--top", "1"])
+    assert result.exit_code == 2 and "unknown 元曲" in result.output
+    result = runner.invoke(stats_script.main, ["--index-dir", str(tmp_path), "--top", "1"])
+    assert result.exit_code == 2 and "preprocess.py --stats" in result.output
@@ -0,0 +1,37 @@
+from lib.tones import ToneTable, tone_digit
+
+
+def test_lookup_is_memoized(monkeypatch):
+    table = ToneTable()
+    assert table.lookup('乐') == ('le4', 4, ['le4', 'yue4'])
+    assert table.tone('春') == 1
+    assert table.tone('，') == 0
+
+    import lib.tones
+    monkeypatch.setattr(lib.tones, 'pinyin', None)
+    assert table.tone('春') == 1
+    assert set(table.added) == {'乐', '春', '，'}
+
+
+def test_save_and_reload(tmp_path):
+    path = str(tmp_path / 'tones.json')
+    table = ToneTable()
+    table.tone('月')
+    table.save(path)
+
+    reloaded = ToneTable.load(path)
+    assert reloaded.entries == table.entries
+    assert reloaded.added == {}
+    assert ToneTable.load(str(tmp_path / 'missing.json')).entries == {}
+
+
+def test_line_tones_uses_context():
+    table = ToneTable()
+    assert [table.tone(ch) for ch in '长城'] == [3, 2]
+    assert table.line_tones('长城') == [2, 2]
+    assert table.line_tones('睡觉，好') == [4, 4, 0, 3]
+
+
+def test_tone_digit():
+    assert tone_digit('zhong4') == 4
+    assert tone_digit('de') == 0
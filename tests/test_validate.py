@@ -0,0 +1,78 @@
+import json
+import os
+
+import pytest
+from click.testing import CliRunner
+
+from lib.validate import validate
+from scripts import validate as validate_script
+
+
+def _dump(path, data):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+
+
+@pytest.fixture
+def corpus(tmp_path):
+    _dump(tmp_path / "宋词" / "ci.song.0.json", [{"rhythmic": "水调歌头", "paragraphs": ["明月"]}])
+    _dump(tmp_path / "宋词" / "ci.song.1000.json", [{"paragraphs": ["明月"]}, {"rhythmic": 1}])
+    _dump(tmp_path / "宋词" / "author.song.json", [{"name": "苏轼"}])
+    _dump(tmp_path / "论语" / "lunyu.json", [{"content": "子曰", "id": None}])
+    (tmp_path / "诗经").mkdir()
+    (tmp_path / "诗经" / "shijing.json").write_text("[{", encoding="utf-8")
+    _dump(tmp_path / "strains" / "json" / "poet.song.0.json", [{"id": "a", "strains": ["平"]}])
+    _dump(tmp_path / "scripts" / "ignored.json", "not checked")
+    _dump(tmp_path / "datas.json", {"cp_path": str(tmp_path), "datasets": {
+        "songci": {"id": 5, "path": "宋词/", "tag": "paragraphs", "excludes": ["author.song.json"],
+                   "schema": {"rhythmic": "str"}},
+        "lunyu": {"id": 12, "path": "论语/lunyu.json", "tag": "content",
+                  "schema": {"content": "str", "id": "str?"}},
+    }})
+    return tmp_path
+
+
+def test_validate(corpus):
+    report = validate(str(corpus), str(corpus / "datas.json"))
+    assert report["files"] == 6
+    assert report["failed"] == ["宋词/ci.song.1000.json", "诗经/shijing.json"]
+    errors = report["results"]["宋词/ci.song.1000.json"]["errors"]
+    assert errors == ["entry 0: missing 'rhythmic'", "entry 1: missing 'paragraphs'",
+                      "entry 1: 'rhythmic' is not str"]
+    assert report["results"]["诗经/shijing.json"]["errors"][0].startswith("invalid JSON")
+    assert report["results"]["宋词/author.song.json"]["schema"] is None
+    assert report["results"]["strains/json/poet.song.0.json"]["errors"] == []
+
+    parallel = validate(str(corpus), str(corpus / "datas.json"), jobs=2)
+    assert parallel == report
+
+
+def test_cache(corpus):
+    cache = str(corpus / "cache.json")
+    config = str(corpus / "datas.json")
+    first = validate(str(corpus), config, cache_path=cache)
+    assert (first["checked"], first["cached"]) == (6, 0)
+    again = validate(str(corpus), config, cache_path=cache)
+    assert (again["checked"], again["cached"]) == (0, 6)
+    assert again["failed"] == first["failed"]
+
+    os.utime(corpus / "论语" / "lunyu.json", ns=(1, 1))
+    (corpus / "诗经" / "shijing.json").write_text("[]", encoding="utf-8")
+    report = validate(str(corpus), config, cache_path=cache)
+    assert (report["checked"], report["cached"]) == (1, 5)
+    assert report["failed"] == ["宋词/ci.song.1000.json"]
+    assert validate(str(corpus), config, cache_path=cache, paths=["论语"])["checked"] == 0
+
+
+def test_cli(corpus):
+    runner = CliRunner()
+    args = ["--root", str(corpus), "--config", str(corpus / "datas.json"), "--no-cache",
+            "--report", str(corpus / "report.json")]
+    result = runner.invoke(validate_script.main, args)
+    assert result.exit_code == 1
+    assert "entry 0: missing 'rhythmic'" in result.output
+    with open(corpus / "report.json", encoding="utf-8") as fh:
+        assert json.load(fh)["failed"] == ["宋词/ci.song.1000.json", "诗经/shijing.json"]
+    result = runner.invoke(validate_script.main, args + ["论语", "strains"])
+    assert result.exit_code == 0
+    assert result.output.startswith("2 files, 2 checked")
@@ -0,0 +1,89 @@
+import json
+
+import click
+import pytest
+
+from lib.indexer import load_index
+from lib.query import evaluate
+from lib.variants import fold, fold_text, load_variants, variants
+from scripts import compact, preprocess, search
+
+POEMS = [
+    {"title": "東風", "paragraphs": ["東風夜放花千樹", "樂遊原上清秋節"]},
+    {"title": "东风", "paragraphs": ["东风不与周郎便", "乐游原上望昭陵"]},
+    {"rhythmic": "春风", "paragraphs": ["春風又綠江南岸", "後來東風吹"]},
+]
+
+
+@pytest.fixture
+def build(tmp_path):
+    data_dir = tmp_path / "data"
+    data_dir.mkdir()
+    with open(data_dir / "a.json", "w", encoding="utf-8") as fh:
+        json.dump(POEMS, fh, ensure_ascii=False)
+
+    def build(name, **options):
+        preprocess.main.callback(data_dir=str(data_dir), index_dir=str(tmp_path / name), **options)
+        return load_index(str(tmp_path / name), mmap=True)
+
+    return build
+
+
+def _works(index, char2, char3, **options):
+    return [(m[0]["work_id"], m[0]["line"], m[0]["pos"])
+            for _, m in search.search(index, char2, char3, distance="adjacent", **options)]
+
+
+def test_table_folds_to_simplified():
+    table = load_variants()
+    assert fold("樂") == "乐" and fold("乐") == "乐" and fold("峯") == "峰"
+    assert fold_text("東風夜放花千樹") == "东风夜放花千树"
+    assert variants("樂") == variants("乐") == ["乐", "樂"]
+    assert not any(canonical in table for canonical in table.values())
+    # characters that are distinct in classical text are not merged
+    for variant, other in ("乾干", "後后", "著着", "藉借", "瞭了", "徵征"):
+        assert fold(variant) == variant and other not in variants(variant)
+
+
+def test_folded_index_matches_all_forms(build):
+    folded = build("folded", fold_variants=True)
+    plain = build("plain")
+    assert folded.folded and not plain.folded
+    assert "東" not in folded and "東" in plain
+    assert sorted((o["work_id"], chr(o["surface"])) for o in folded["东"]) == [
+        ("a-1", "東"), ("a-2", "东"), ("a-3", "東")]
+
+    for char2, char3 in (("东", "风"), ("東", "風"), ("乐", "游"), ("後", "來")):
+        # the plain index is searched form by form, the folded one in corpus order
+        expected = sorted(_works(plain, char2, char3, fold=True))
+        assert _works(folded, char2, char3) == expected
+        assert expected
+    assert _works(folded, "后", "来") == []
+    # an unfolded index matches the written form unless asked to fold
+    assert _works(plain, "东", "风") == [("a-2", 1, 1)]
+    assert _works(folded, "東", "風", fold=False) == _works(plain, "東", "風", fold=False) == [
+        ("a-1", 1, 1), ("a-3", 2, 3)]
+    assert _works(folded, "东", "风", fold=False) == [("a-2", 1, 1)]
+    assert _works(folded, "東", "风", fold=False) == []
+
+    # tones are those of the written character
+    assert _works(folded, "乐", "游", tone2=4) == sorted(_works(plain, "乐", "游", tone2=4,
+                                                                fold=True))
+    assert list(evaluate(folded, "東 & 樂")) == [("a-1", 1), ("a-2", 2)]
+    assert list(search.scan_phrase(folded, "東風")) == list(search.scan_phrase(folded, "东风"))
+    assert len(list(search.scan_phrase(folded, "東風"))) == 3
+
+
+def test_folding_survives_updates(tmp_path, build):
+    index = build("index", fold_variants=True, incremental=True)
+    with open(tmp_path / "data" / "b.json", "w", encoding="utf-8") as fh:
+        json.dump([{"title": "樂", "paragraphs": ["東風"]}], fh, ensure_ascii=False)
+    index = build("index", fold_variants=True, incremental=True)
+    assert len(index.segments) == 2 and index.folded
+    compact.main.callback(index_dir=str(tmp_path / "index"), full=True)
+    index = load_index(str(tmp_path / "index"), mmap=True)
+    assert index.folded
+    assert [w for w, _, _ in _works(index, "东", "风")] == ["a-1", "a-2", "a-3", "b-1"]
+
+    with pytest.raises(click.UsageError):
+        build("json", fold_variants=True, index_format="json")
@@ -1,24 +1,34 @@
+import asyncio
+import functools
 import json
 import logging
 import os
 import re
-from difflib import SequenceMatcher
+import sys
 
-import requests
 from bs4 import BeautifulSoup
 from bs4.element import NavigableString
 
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.crawler import Checkpoint, Fetcher, crawl  # noqa: E402
+from lib.reconcile import Replacer, best_matches, plain_text  # noqa: E402
 
-def get_page_content(page: int) -> list:
-    """ 获取目录页每一页的内容 """
+URL = "http://qsc.zww.cn/getdata.asp"
+# 目录页页码
+PAGES = range(1, 1240)
+
+
+def _script_arg(pattern: str, text: str) -> str:
+    found = re.search(pattern, text)
+    if found is None:
+        raise ValueError("unexpected response: " + text[:80])
+    return found.group(1)
+
+
+def parse_page(text: str) -> list:
+    """ 解析目录页, 每首词带有获取内容的参数 param """
     content = []
-    r = requests.post("http://qsc.zww.cn/getdata.asp", data={
-        "seektype": 2,
-        "seekvalue": "",
-        "pageno": page
-    })
-    r.encoding = "gbk"
-    soup = BeautifulSoup(re.search(r"filllist\('·(.*?)'\);", r.text).group(1), features="lxml")
+    soup = BeautifulSoup(_script_arg(r"filllist\('·(.*?)'\);", text), features="lxml")
     for i, a in enumerate(soup.find_all(name="a")):
         if i % 2 == 0:
             content.append({
@@ -27,58 +37,81 @@ def get_page_content(page: int) -> list:
             })
         else:
             content[-1]["author"] = a.string
-    for c in content:
-        c["paragraphs"] = get_paragraphs(int(c["param"][0]), int(c["param"][1]))
-        del c["param"]
     return content
 
 
-def get_paragraphs(seek_type: int, seek_value: int) -> list:
-    """ 获取词的内容段落 """
+def parse_paragraphs(text: str) -> list:
+    """ 解析词的内容段落 """
     paragraphs = []
-    r = requests.post("http://qsc.zww.cn/getdata.asp", data={
-        "seektype": seek_type,
-        "seekvalue": seek_value,
-        "pageno": 1
-    })
-    r.encoding = "gbk"
-    soup = BeautifulSoup(re.search(r"fillbody\('(.*?)'\);", r.text).group(1), features="lxml")
+    soup = BeautifulSoup(_script_arg(r"fillbody\('(.*?)'\);", text), features="lxml")
     for child in soup.find(name="p", align=None).contents:
         if isinstance(child, NavigableString):
-            paragraphs.append(child)
+            paragraphs.append(str(child))
     return paragraphs
 
 
-def get_all_page(temp_file: str):
-    """ 爬取数据并保存至临时文件 """
-    for page in range(1, 1240):
-        all_data.extend(get_page_content(page))
-        logging.info("Success: save page {0}".format(page))
+async def get_page_content(fetcher: Fetcher, page: int) -> list:
+    """ 获取目录页每一页的内容, 各首词的内容并发获取 """
+    body = await fetcher.post({"seektype": 2, "seekvalue": "", "pageno": page})
+    content = parse_page(body.decode("gbk", errors="replace"))
+    paragraphs = await asyncio.gather(*(
+        get_paragraphs(fetcher, int(c["param"][0]), int(c["param"][1])) for c in content))
+    for c, p in zip(content, paragraphs):
+        c["paragraphs"] = p
+        del c["param"]
+    return content
+
+
+async def get_paragraphs(fetcher: Fetcher, seek_type: int, seek_value: int) -> list:
+    """ 获取词的内容段落 """
+    body = await fetcher.post({"seektype": seek_type, "seekvalue": seek_value, "pageno": 1})
+    return parse_paragraphs(body.decode("gbk", errors="replace"))
+
+
+def get_all_page(temp_file: str, checkpoint_dir: str = "pages", url: str = URL, pages=PAGES,
+                 concurrency: int = 8, rate: float = 20.0):
+    """ 并发爬取数据并保存至临时文件
+
+    每页完成后即保存至 checkpoint_dir, 中断或有页失败时重新运行只爬取缺失的页.
+    concurrency 为同时进行的请求数, rate 为每秒最多发出的请求数.
+    """
+    async def run():
+        async with Fetcher(url, concurrency=concurrency, rate=rate) as fetcher:
+            return await crawl(pages, functools.partial(get_page_content, fetcher),
+                               Checkpoint(checkpoint_dir), workers=concurrency)
+
+    results = asyncio.run(run())
+    missing = [page for page in pages if page not in results]
+    if missing:
+        raise SystemExit("Failed pages {0}, run again to resume".format(missing))
+    data = [ci for page in pages for ci in results[page]]
     with open(temp_file, "w", encoding="utf-8") as f:
-        f.write(json.dumps(all_data, indent=2, ensure_ascii=False))
+        f.write(json.dumps(data, indent=2, ensure_ascii=False))
+    return data
 
 
-def only_text(text: str):
-    """ 去除标点只保留文字 """
-    return re.sub(r"[，。、《》…（）·・\s]", "", text)
+def match_data(old_data: list, new_data: list, start: int = 0):
+    """ 按内容为每条旧数据找出最相似的新数据, 相似度相同时优先同一位置 """
+    return best_matches([plain_text(ci["paragraphs"]) for ci in old_data],
+                        [plain_text(ci["paragraphs"]) for ci in new_data],
+                        hint=range(start, start + len(old_data)))
 
 
-def update_file_data(old_data: list, new_data: list):
-    for i in range(len(old_data)):
-        old_text = only_text("".join(old_data[i]["paragraphs"]))
-        new_text = only_text("".join(new_data[start + i]["paragraphs"]))
-        # 计算纯文字的相似度
-        ratio = SequenceMatcher(a=old_text, b=new_text).quick_ratio()
-        if 0.9 <= ratio < 1.0:
-            # 假定此范围内说明缺字，需要更新
-            old_data[i]["author"] = new_data[start + i]["author"]
-            old_data[i]["paragraphs"] = new_data[start + i]["paragraphs"]
-        elif ratio < 0.9:
+def update_file_data(old_data: list, new_data: list, matches=None, start: int = 0):
+    """ matches 为 match_data 的结果, 缺省时就地计算 """
+    if matches is None:
+        matches = match_data(old_data, new_data, start)
+    for ci, index, ratio in zip(old_data, *matches):
+        if index < 0 or ratio < 0.9:
             # 异常情况warning输出，不更新
-            logging.warning(old_text)
-            logging.warning(new_text)
-        else:
-            old_data[i]["author"] = new_data[start + i]["author"]
+            logging.warning(plain_text(ci["paragraphs"]))
+            if index >= 0:
+                logging.warning(plain_text(new_data[index]["paragraphs"]))
+            continue
+        ci["author"] = new_data[index]["author"]
+        if ratio < 1.0:
+            # 假定此范围内说明缺字，需要更新
+            ci["paragraphs"] = new_data[index]["paragraphs"]
 
 
 char_dict = {
@@ -102,13 +135,13 @@ char_dict = {
 }
 
 
+replace_chars = Replacer(char_dict)
+
+
 def correct(old_data: list):
     """ 部分繁体转为简体 """
-    for i in range(len(old_data)):
-        for j in range(len(old_data[i]["paragraphs"])):
-            for k, v in char_dict.items():
-                if k in old_data[i]["paragraphs"][j]:
-                    old_data[i]["paragraphs"][j] = old_data[i]["paragraphs"][j].replace(k, v)
+    for ci in old_data:
+        ci["paragraphs"] = replace_chars.lines(ci["paragraphs"])
 
 
 if __name__ == '__main__':
@@ -119,18 +152,27 @@ if __name__ == '__main__':
     if not os.path.exists(temp_file_name):
         get_all_page(temp_file_name)
     # 读取临时文件
-    with open("all.json", "r", encoding="utf-8") as f:
+    with open(temp_file_name, "r", encoding="utf-8") as f:
         all_data = json.load(f)
-    # 遍历当前目录
+    # 遍历当前目录, 所有文件一次匹配
+    files = {}
     for file_name in os.listdir("./"):
-        if re.match(r"ci\.song\.\d+\.json", file_name):
-            # 每个文件开始的数据索引
-            start = int(file_name.split(".")[2])
+        if re.match(r"ci\.song\.\d+\.json$", file_name):
             with open(file_name, "r", encoding="utf-8") as f:
-                file_data = json.load(f)
-            update_file_data(file_data, all_data)
-            correct(file_data)
-            # 保存数据，原文件中逗号后有空格，这里保持一致
-            with open(file_name, "w", encoding="utf-8") as f:
-                f.write(json.dumps(file_data, indent=2, ensure_ascii=False).replace(",", ", "))
-                logging.info("Save " + file_name)
+                files[file_name] = json.load(f)
+    old_data = [ci for file_data in files.values() for ci in file_data]
+    # 每个文件开始的数据索引作为位置提示
+    hint = [int(file_name.split(".")[2]) + i
+            for file_name, file_data in files.items() for i in range(len(file_data))]
+    match, ratio = best_matches([plain_text(ci["paragraphs"]) for ci in old_data],
+                                [plain_text(ci["paragraphs"]) for ci in all_data], hint=hint)
+    offset = 0
+    for file_name, file_data in files.items():
+        end = offset + len(file_data)
+        update_file_data(file_data, all_data, (match[offset:end], ratio[offset:end]))
+        offset = end
+        correct(file_data)
+        # 保存数据，原文件中逗号后有空格，这里保持一致
+        with open(file_name, "w", encoding="utf-8") as f:
+            f.write(json.dumps(file_data, indent=2, ensure_ascii=False).replace(",", ", "))
+            logging.info("Save " + file_name)
@@ -1,46 +1,59 @@
 #!-*- coding: utf-8 -*-
+""" 从 ci.db 导出 author.song.json 与 ci.song.*.json
 
-import json, sys
+    python main.py --db ci.db --format json
+    python main.py --format jsonl --out-dir ./export --incremental
+"""
+import os
 import sqlite3
-from collections import OrderedDict
-
-try:               # Python 2
-    reload(sys)
-    sys.setdefaultencoding('utf-8')
-except NameError:  # Python 3
-    pass
-
-c = sqlite3.connect('ci.db')
-
-cursor = c.execute("SELECT name, long_desc, short_desc from ciauthor;")
-
-d = {"name": None, "description": None, "short_description": None}
-
-authors = []
-
-for row in cursor:
-    author = OrderedDict(sorted(d.items(), key=lambda t: t[0]))
-    author["name"] = row[0]
-    author["description"] = row[1]
-    author["short_description"] = row[2]
-    authors.append(author) 
-
-open('author.song.json', 'w').write(json.dumps(authors, indent=2, ensure_ascii=False))
-
-
-cursor = c.execute("SELECT rhythmic, author, content from ci;")
-
-d = {"rhythmic": None, "author": None, "paragraphs": None}
-
-cis = []
-
-for row in cursor:
-    ci = OrderedDict(sorted(d.items(), key=lambda t: t[0]))
-    ci["rhythmic"] = row[0]
-    ci["author"] = row[1]
-    ci["paragraphs"] = row[2].split('\n')
-    cis.append(ci) 
-
-for i in range(0, 21050, 1000):
-    open('ci.song.%s.json' % i, 'w').write(json.dumps(cis[i:i+1000], indent=2, ensure_ascii=False))
-
+import sys
+
+import click
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from lib.shards import FORMATS, export_shards, iter_rows  # noqa: E402
+
+
+def authors(conn: sqlite3.Connection, batch: int):
+    for name, long_desc, short_desc in iter_rows(
+            conn, "SELECT name, long_desc, short_desc FROM ciauthor", batch=batch):
+        yield {"name": name, "description": long_desc, "short_description": short_desc}
+
+
+def cis(conn: sqlite3.Connection, batch: int):
+    for rhythmic, author, content in iter_rows(
+            conn, "SELECT rhythmic, author, content FROM ci", batch=batch):
+        yield {"rhythmic": rhythmic, "author": author, "paragraphs": content.split("\n")}
+
+
+@click.command()
+@click.option("--db", "db_path", default="ci.db", show_default=True, help="SQLite database to read.")
+@click.option("--out-dir", default=".", show_default=True, help="Directory of the shards.")
+@click.option("--format", "fmt", type=click.Choice(list(FORMATS)), default="json",
+              show_default=True, help="json: indented like the repo; jsonl: one ci per line; "
+                                      "bin: the binary corpus format.")
+@click.option("--shard-size", default=1000, show_default=True, type=click.IntRange(min=1),
+              help="Ci per shard.")
+@click.option("--batch", default=1000, show_default=True, type=click.IntRange(min=1),
+              help="Rows fetched at a time.")
+@click.option("--incremental", is_flag=True,
+              help="Only rewrite the shards whose ci changed since the last export.")
+def main(db_path, out_dir, fmt, shard_size, batch, incremental):
+    """ 逐批读取数据库并按 --shard-size 分片写出 """
+    conn = sqlite3.connect(db_path)
+    try:
+        # 作者介绍只有一个文件, 二进制格式只用于词的内容
+        author_fmt = "jsonl" if fmt == "jsonl" else "json"
+        export_shards(authors(conn, batch), out_dir, "author.song", shard_size=0, fmt=author_fmt,
+                      incremental=incremental)
+        report = export_shards(cis(conn, batch), out_dir, "ci.song", shard_size=shard_size,
+                               fmt=fmt, incremental=incremental)
+    finally:
+        conn.close()
+    click.echo("{0} ci: {1} shards written, {2} unchanged, {3} removed".format(
+        report["records"], len(report["written"]), len(report["unchanged"]),
+        len(report["removed"])))
+
+
+if __name__ == "__main__":
+    main()